@@ -0,0 +1,364 @@
+import datetime
+import glob
+import hashlib
+import os
+import sys
+
+import duckdb
+import numpy as np
+import pandas as pd
+
+# Féléveken átívelő archívum: minden futás első lépés bemenete és csoportosítása, második lépés ösztöndíjasai és
+# harmadik lépés döntései egy-egy Parquet fájlba kerülnek, féléves (Hive) partíciókba:
+#
+#   archive/<szakasz>/semester=<félév>/<futás>.parquet        a teljes tábla, Neptun kód szerint rendezve
+#   archive/index/semester=<félév>/<szakasz>-<futás>.parquet  szak és csoport szerinti összesítő
+#
+# Az archívum csak bővül: a meglévő fájlok sosem íródnak felül, egy futás tartalma (hash) csak egyszer kerül be.
+# Az összetartozó futások (pl. az első lépés bemenete és az abból készült csoportosítás) a 'parent_run' oszlopon
+# keresztül kapcsolódnak; az index fájl íródik utoljára, így egy futás csak akkor látszik, ha már teljes.
+# A Neptun kód szerinti rendezés és a kis sorcsoportok miatt a Parquet min/max statisztikái indexként működnek: egy
+# hallgató előzményeinél a DuckDB csak az érintett sorcsoportokat olvassa, nem a teljes féléveket. A szakok
+# trendjéhez elég a kicsi összesítő fájlokat olvasni.
+# Parancssorból: python Archive.py history <Neptun kód> | trend <KépzésKód> [archívum mappa]
+
+DEFAULT_ARCHIVE_DIR = os.environ.get('SCHOLARSHIP_ARCHIVE', 'archive')
+STAGES = ['input', 'grouping', 'recipients', 'decisions']
+ROW_GROUP_SIZE = 10_000
+# Az Excelből olvasott oszlopokban a szám és az üres szöveg ('') keveredhet; ezek számként kerülnek az archívumba
+NUMERIC_COLUMNS = ['GroupIndex', 'Ösztöndíjindex', 'KÖDI', 'Scholarship Amount', 'Group Minimum Ösztöndíjindex',
+                   '1 havi Ösztöndíj', '5 havi Ösztöndíj']
+
+def semester_partition(semester):
+    # '2024/25/1' -> '2024-25-1', mert a '/' mappát jelentene
+    return str(semester).strip().replace('/', '-')
+
+def normalize_for_archive(data):
+    """Egységes típusok a Parquet íráshoz: a NUMERIC_COLUMNS számok, a többi vegyes oszlop szöveg (a hiányzó érték
+    hiányzó marad). Az eredeti sorrend a '_row' oszlopba kerül."""
+    columns = {}
+    for col in data.columns:
+        values = data[col]
+        if col in NUMERIC_COLUMNS:
+            values = pd.to_numeric(values, errors='coerce')
+        elif not pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(values):
+            values = values.astype(object).where(values.notna(), None).map(lambda value: value if value is None
+                                                                          else str(value))
+        columns[col] = values.to_numpy()
+    columns['_row'] = np.arange(len(data))
+    return pd.DataFrame(columns)
+
+### Összesítő index szakonként és csoportonként: létszám, ösztöndíjasok száma és a kiosztott összeg
+def build_program_index(data, stage):
+    if stage == 'recipients':
+        amount = pd.to_numeric(data['Scholarship Amount'], errors='coerce').fillna(0)
+        recipient = amount > 0
+    elif stage == 'decisions':
+        recipient = data['Ösztöndíj döntés'] == 'Jogosult'
+        amount = pd.to_numeric(data['1 havi Ösztöndíj'], errors='coerce').fillna(0).where(recipient, 0)
+    else:
+        amount = pd.Series(0.0, index=data.index)
+        recipient = pd.Series(False, index=data.index)
+
+    keys = [col for col in ['KépzésKód', 'KépzésNév', 'GroupIndex'] if col in data.columns]
+    grouped = data[keys].astype(str).assign(Recipients=recipient.astype(int), Amount=amount).groupby(keys)
+    return grouped.agg(Students=('Recipients', 'size'), Recipients=('Recipients', 'sum'),
+                       Amount=('Amount', 'sum')).reset_index().assign(stage=stage)
+
+def write_parquet(con, data, path, order_by=None):
+    # Előbb ideiglenes fájlba, majd átnevezés: az olvasók (glob '*.parquet') sosem látnak félkész fájlt
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    con.register('archive_frame', data)
+    order = f'ORDER BY {order_by}' if order_by else ''
+    con.execute(f"COPY (SELECT * FROM archive_frame {order}) TO '{path}.tmp' "
+                f"(FORMAT PARQUET, ROW_GROUP_SIZE {ROW_GROUP_SIZE})")
+    con.unregister('archive_frame')
+    os.replace(path + '.tmp', path)
+
+### Egy futás egy szakaszának archiválása
+def row_hashes(data):
+    return pd.util.hash_pandas_object(data.astype(str), index=False).values.tobytes()
+
+def run_partition(archive_dir, stage, semester):
+    return os.path.join(archive_dir, stage, f'semester={semester_partition(semester)}')
+
+def existing_run(partition, content_hash):
+    # Ugyanez a tartalom ebben a félévben már archiválva van: a meglévő futás azonosítója
+    existing = glob.glob(os.path.join(partition, f'*-{content_hash}.parquet'))
+    return os.path.basename(existing[0])[:-len('.parquet')] if existing else None
+
+def write_program_index(con, program_index, stage, semester, archive_dir, run_id, parent_run):
+    write_parquet(con, program_index.assign(run=run_id, parent_run=parent_run),
+                  os.path.join(archive_dir, 'index', f'semester={semester_partition(semester)}',
+                               f'{stage}-{run_id}.parquet'))
+
+def archive_run(data, stage, semester, archive_dir=DEFAULT_ARCHIVE_DIR, parent_run=None):
+    """Hozzáadja az archívumhoz egy futás egy szakaszának tábláját.
+
+        Args:
+            data (pd.DataFrame): A szakasz táblája (első lépés bemenete vagy fő kimenete, ösztöndíjasok, döntések).
+            stage (str): 'input', 'grouping', 'recipients' vagy 'decisions'.
+            semester (str): A félév, pl. '2024/25/1'.
+            archive_dir (str): Az archívum mappája.
+            parent_run (str, optional): A futás, amelyből ez a tábla készült (pl. a 'grouping' futás 'input'
+                futása).
+
+        Returns:
+            str: A futás azonosítója (időbélyeg és a tartalom hash-e). Ha ugyanez a tartalom ebben a félévben már
+            archiválva van, a meglévő futás azonosítója, új fájl nélkül.
+    """
+    if stage not in STAGES:
+        raise ValueError(f"Unknown stage: {stage}")
+    partition = run_partition(archive_dir, stage, semester)
+    content_hash = hashlib.sha256(row_hashes(data) + str(parent_run).encode()).hexdigest()[:16]
+    existing = existing_run(partition, content_hash)
+    if existing:
+        return existing
+
+    run_id = f"{datetime.datetime.now():%Y%m%dT%H%M%S}-{content_hash}"
+    archived = normalize_for_archive(data).assign(run=run_id, parent_run=parent_run)
+    con = duckdb.connect()
+    write_parquet(con, archived, os.path.join(partition, f'{run_id}.parquet'), order_by='"Neptun kód"')
+    write_program_index(con, build_program_index(data, stage), stage, semester, archive_dir, run_id, parent_run)
+    con.close()
+    return run_id
+
+### Darabonként elkészülő tábla archiválása (a harmadik lépés streaming módja): a darabok normalizálva ideiglenes
+# Parquet fájlokba kerülnek, a tartalom hash és az összesítő darabonként gyűlik, így a teljes tábla sosem kell a
+# memóriában legyen. Az archive_chunked_run a darabokból ugyanazt a két fájlt írja, mint az archive_run.
+def start_chunked_run(stage, parts_dir):
+    """Előkészíti egy darabonként gyűjtött futás állapotát.
+
+        Args:
+            stage (str): 'input', 'grouping', 'recipients' vagy 'decisions'.
+            parts_dir (str): Ideiglenes mappa a darabok Parquet fájljainak (a hívó törli).
+
+        Returns:
+            dict: Az add_chunk és az archive_chunked_run állapota.
+    """
+    if stage not in STAGES:
+        raise ValueError(f"Unknown stage: {stage}")
+    return {'stage': stage, 'parts_dir': parts_dir, 'parts': [], 'rows': 0, 'hash': hashlib.sha256(),
+            'index': []}
+
+def add_chunk(chunked_run, data):
+    part = normalize_for_archive(data)
+    part['_row'] += chunked_run['rows']
+    path = os.path.join(chunked_run['parts_dir'], f"part-{len(chunked_run['parts']):05d}.parquet")
+    con = duckdb.connect()
+    write_parquet(con, part, path)
+    con.close()
+    chunked_run['parts'].append(path)
+    chunked_run['hash'].update(row_hashes(data))
+    chunked_run['index'].append(build_program_index(data, chunked_run['stage']))
+    chunked_run['rows'] += len(data)
+
+def union_parts_sql(con, parts):
+    # Ha egy oszlop az egyik darabban logikai, a másikban szöveg (pl. az ösztöndíjasoknál bool, az új hallgatóknál
+    # ''), a teljes táblán futó normalize_for_archive a Python str-jével szövegként írná: a logikai darabokból is
+    # 'True'/'False' lesz, nem a DuckDB átalakítás szerinti 'true'/'false'
+    part_types = [dict(con.execute(f"SELECT column_name, column_type FROM (DESCRIBE SELECT * FROM "
+                                   f"read_parquet('{part}'))").fetchall()) for part in parts]
+    column_types = {}
+    for types in part_types:
+        for column, column_type in types.items():
+            column_types.setdefault(column, set()).add(column_type)
+    text_booleans = [column for column, types in column_types.items() if {'BOOLEAN', 'VARCHAR'} <= types]
+
+    selects = []
+    for part, types in zip(parts, part_types):
+        replaced = [f"CASE WHEN \"{column}\" THEN 'True' WHEN NOT \"{column}\" THEN 'False' END AS \"{column}\""
+                    for column in text_booleans if types.get(column) == 'BOOLEAN']
+        replace = f"REPLACE ({', '.join(replaced)})" if replaced else ''
+        selects.append(f"SELECT * {replace} FROM read_parquet('{part}')")
+    return '\n UNION ALL BY NAME '.join(selects)
+
+def archive_chunked_run(chunked_run, semester, archive_dir=DEFAULT_ARCHIVE_DIR, parent_run=None):
+    """Az archive_run párja a start_chunked_run / add_chunk által gyűjtött darabokra.
+
+        Args:
+            chunked_run (dict): A start_chunked_run állapota, benne már az összes darabbal.
+            semester (str): A félév, pl. '2024/25/1'.
+            archive_dir (str): Az archívum mappája.
+            parent_run (str, optional): A futás, amelyből ez a tábla készült.
+
+        Returns:
+            str: A futás azonosítója, vagy a meglévő futásé, ha ugyanez a tartalom már archiválva van.
+    """
+    stage = chunked_run['stage']
+    partition = run_partition(archive_dir, stage, semester)
+    content_hash = chunked_run['hash'].copy()
+    content_hash.update(str(parent_run).encode())
+    content_hash = content_hash.hexdigest()[:16]
+    existing = existing_run(partition, content_hash)
+    if existing:
+        return existing
+
+    run_id = f"{datetime.datetime.now():%Y%m%dT%H%M%S}-{content_hash}"
+    path = os.path.join(partition, f'{run_id}.parquet')
+    parent = 'NULL' if parent_run is None else f"'{parent_run}'"
+    os.makedirs(partition, exist_ok=True)
+    con = duckdb.connect()
+    # A DuckDB a rendezést szükség esetén lemezre írva végzi, a darabok így sem kerülnek egyszerre a memóriába
+    con.execute(f"""
+        COPY (SELECT *, '{run_id}' AS run, CAST({parent} AS VARCHAR) AS parent_run
+              FROM ({union_parts_sql(con, chunked_run['parts'])})
+              ORDER BY "Neptun kód")
+        TO '{path}.tmp' (FORMAT PARQUET, ROW_GROUP_SIZE {ROW_GROUP_SIZE})""")
+    os.replace(path + '.tmp', path)
+
+    program_index = pd.concat(chunked_run['index'], ignore_index=True)
+    keys = [col for col in program_index.columns if col not in ('Students', 'Recipients', 'Amount')]
+    program_index = program_index.groupby(keys, as_index=False)[['Students', 'Recipients', 'Amount']].sum()[
+        chunked_run['index'][0].columns]
+    write_program_index(con, program_index, stage, semester, archive_dir, run_id, parent_run)
+    con.close()
+    return run_id
+
+def stage_files(archive_dir, stage):
+    return os.path.join(archive_dir, stage, '*', '*.parquet')
+
+def query(sql, parameters=None):
+    con = duckdb.connect()
+    try:
+        return con.execute(sql, parameters or []).df()
+    finally:
+        con.close()
+
+# Az archívumban szereplő futások félévenként és szakaszonként, időrendben
+def list_runs(archive_dir=DEFAULT_ARCHIVE_DIR):
+    if not glob.glob(os.path.join(archive_dir, 'index', '*', '*.parquet')):
+        return pd.DataFrame(columns=['semester', 'stage', 'run'])
+    return query(f"""
+        SELECT DISTINCT semester, stage, run
+        FROM read_parquet('{os.path.join(archive_dir, 'index', '*', '*.parquet')}', hive_partitioning = true,
+                          union_by_name = true)
+        ORDER BY semester, run, stage""")
+
+### Lekérdezések
+def student_history(neptun_code, archive_dir=DEFAULT_ARCHIVE_DIR, stages=('grouping', 'recipients', 'decisions')):
+    """Egy hallgató összes archivált sora.
+
+        Args:
+            neptun_code (str): A hallgató Neptun kódja.
+            archive_dir (str): Az archívum mappája.
+            stages (tuple): A lekérdezett szakaszok.
+
+        Returns:
+            dict: {szakasz: DataFrame} a hallgató soraival félév és futás szerint rendezve (üres szakasz nélkül).
+    """
+    history = {}
+    for stage in stages:
+        if not glob.glob(stage_files(archive_dir, stage)):
+            continue
+        rows = query(f"""
+            SELECT * EXCLUDE (_row)
+            FROM read_parquet('{stage_files(archive_dir, stage)}', hive_partitioning = true, union_by_name = true)
+            WHERE "Neptun kód" = ?
+            ORDER BY semester, run""", [neptun_code])
+        if len(rows):
+            history[stage] = rows
+    return history
+
+def program_trend(program_code, archive_dir=DEFAULT_ARCHIVE_DIR, stage='recipients'):
+    """Egy szak létszáma, ösztöndíjasai és kiosztott összege félévenként, csak az összesítő fájlokból.
+
+        Args:
+            program_code (str): A szak KépzésKód-ja.
+            archive_dir (str): Az archívum mappája.
+            stage (str): 'recipients' (második lépés) vagy 'decisions' (harmadik lépés).
+
+        Returns:
+            pd.DataFrame: Félévenként a szak utolsó futásának összesítője, csoportonkénti bontással együtt
+            ('GroupIndex' üres a szak összesítő soraiban).
+    """
+    index_files = os.path.join(archive_dir, 'index', '*', f'{stage}-*.parquet')
+    if not glob.glob(index_files):
+        return pd.DataFrame(columns=['semester', 'run', 'GroupIndex', 'Students', 'Recipients', 'Amount'])
+    return query(f"""
+        WITH program AS (
+            SELECT * FROM read_parquet('{index_files}', hive_partitioning = true, union_by_name = true)
+            WHERE "KépzésKód" = ?
+            QUALIFY run = max(run) OVER (PARTITION BY semester))
+        SELECT semester, run, "GroupIndex", sum("Students") AS "Students", sum("Recipients") AS "Recipients",
+               sum("Amount") AS "Amount"
+        FROM program
+        GROUP BY GROUPING SETS ((semester, run), (semester, run, "GroupIndex"))
+        ORDER BY semester, "GroupIndex" NULLS FIRST""", [program_code])
+
+### Az előző futás visszatöltése (pl. az első lépés inkrementális módjához): a futás táblája az eredeti sorrendben és
+# oszlopokkal, a hiányzó szövegek NaN-ként, ahogy az Excel beolvasásnál
+def load_run(stage, semester, run_id, archive_dir=DEFAULT_ARCHIVE_DIR):
+    path = os.path.join(archive_dir, stage, f"semester={semester}", f"{run_id}.parquet")
+    data = query(f"SELECT * FROM read_parquet('{path}', hive_partitioning = false) ORDER BY _row")
+    return data.drop(columns=['_row', 'run', 'parent_run'], errors='ignore').fillna(np.nan)
+
+def load_latest_run(stage, archive_dir=DEFAULT_ARCHIVE_DIR, before_semester=None):
+    """Betölti egy szakasz legutolsó archivált futását.
+
+        Args:
+            stage (str): Pl. 'input' vagy 'grouping'.
+            archive_dir (str): Az archívum mappája.
+            before_semester (str, optional): Csak az ennél korábbi félévek futásai közül.
+
+        Returns:
+            pd.DataFrame: A futás táblája, vagy None, ha nincs ilyen futás.
+    """
+    runs = list_runs(archive_dir)
+    runs = runs[runs['stage'] == stage]
+    if before_semester is not None:
+        runs = runs[runs['semester'] < semester_partition(before_semester)]
+    if runs.empty:
+        return None
+    latest = runs.iloc[-1]
+    return load_run(stage, latest['semester'], latest['run'], archive_dir)
+
+# A legutolsó olyan parent_stage futás, amelyhez már teljes child_stage futás is tartozik (a félkész párok nem
+# látszanak, mert a gyerek futás indexe íródik utoljára)
+def latest_linked_runs(parent_stage='input', child_stage='grouping', archive_dir=DEFAULT_ARCHIVE_DIR):
+    """Megkeresi a legutolsó összetartozó futás párt.
+
+        Args:
+            parent_stage (str): A szülő szakasz, pl. 'input'.
+            child_stage (str): A belőle készült szakasz, pl. 'grouping'.
+            archive_dir (str): Az archívum mappája.
+
+        Returns:
+            dict: {'semester', parent_stage: futás, child_stage: futás}, vagy None, ha nincs ilyen pár.
+    """
+    index_files = os.path.join(archive_dir, 'index', '*', '*.parquet')
+    if not glob.glob(index_files):
+        return None
+    runs = f"read_parquet('{index_files}', hive_partitioning = true, union_by_name = true)"
+    try:
+        pairs = query(f"""
+            SELECT parent.semester, parent.run AS parent_run, child.run AS child_run
+            FROM (SELECT DISTINCT semester, run FROM {runs} WHERE stage = ?) parent
+            JOIN (SELECT DISTINCT semester, run, CAST(parent_run AS VARCHAR) AS parent_run FROM {runs}
+                  WHERE stage = ?) child
+              ON child.parent_run = parent.run AND child.semester = parent.semester
+            ORDER BY parent.semester DESC, parent.run DESC, child.run DESC
+            LIMIT 1""", [parent_stage, child_stage])
+    except duckdb.BinderException:
+        # Csak a parent_run oszlop előtti futások vannak az archívumban
+        return None
+    if pairs.empty:
+        return None
+    pair = pairs.iloc[0]
+    return {'semester': pair['semester'], parent_stage: pair['parent_run'], child_stage: pair['child_run']}
+
+def main():
+    if len(sys.argv) < 3 or sys.argv[1] not in ('history', 'trend'):
+        print("Usage: python Archive.py history <Neptun kód> | trend <KépzésKód> [archive_dir]")
+        return
+    archive_dir = sys.argv[3] if len(sys.argv) > 3 else DEFAULT_ARCHIVE_DIR
+    pd.set_option('display.width', 200)
+    if sys.argv[1] == 'history':
+        for stage, rows in student_history(sys.argv[2], archive_dir).items():
+            print(f"--- {stage}")
+            print(rows.to_string(index=False))
+    else:
+        print(program_trend(sys.argv[2], archive_dir).to_string(index=False))
+
+if __name__ == "__main__":
+    main()
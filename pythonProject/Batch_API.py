@@ -0,0 +1,288 @@
+import hashlib
+import io
+import json
+import multiprocessing
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pandas as pd
+
+import First_Step
+import Second_Step
+import Third_Step
+
+# Helyi HTTP szolgáltatás más egyetemi rendszereknek: a három lépés a Streamlit oldalak függvényeivel fut, korlátos
+# számú háttérszálon. Futtatás: python Batch_API.py [port], csak a 127.0.0.1 címen figyel.
+#
+#   POST /upload               a kérés törzse egy xlsx fájl        -> {"file_id": ...}
+#   POST /group                {"input", "semester_limits", ["previous_input", "previous_main"]}
+#   POST /allocate             {"input", "max_amount", "min_amount", ["k", "x0", "group_percentages",
+#                               "default_percentage", "group_budgets", "budget_level" ('Group' vagy 'Program'),
+#                               "total_fund", "slack" (pontos keret 100 Ft-os egységekben, csoportkeret nélkül;
+#                               slack nélkül az azonos KÖDI-jűek azonos összeget kapnak, 0: pontosan a keret)]}
+#   POST /merge                {"scholarship", "original"}
+#   GET  /jobs/<job_id>        a feladat állapota: queued, running, done vagy failed, kész feladatnál az eredmény
+#   GET  /files/<file_id>      egy feltöltött vagy elkészült fájl letöltése
+#
+# A fájlokat a tartalmuk SHA-256 hash-e azonosítja, a feladatokat a lépés és a paraméterek (benne a fájl hash-ek)
+# hash-e, így az azonos kérések ugyanazt a feladatot kapják vissza, akár fut még, akár már kész.
+# A memória korlátos: legfeljebb MAX_STORED_FILES fájl (a legrégebben használt törlődik, a várakozó vagy futó
+# feladatok bemenetei kivételével) és MAX_FINISHED_JOBS befejezett feladat marad meg. A bemenetek gyorsítótár nélkül
+# töltődnek be, mert Streamlit nélkül a cache_data korlátlan memória tárat használna.
+
+DEFAULT_PORT = 8502
+MAX_WORKERS = 2
+MAX_QUEUED_JOBS = 16
+MAX_STORED_FILES = 64
+MAX_FINISHED_JOBS = 256
+# A kész feladatok eredményében ezek a mezők fájl azonosítók
+RESULT_FILES = ['main_data', 'small_groups', 'scholarship_data', 'combined', 'summary']
+XLSX_MIME = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+def create_service(max_workers=MAX_WORKERS, max_queued_jobs=MAX_QUEUED_JOBS, max_files=MAX_STORED_FILES,
+                   max_finished_jobs=MAX_FINISHED_JOBS):
+    """Létrehozza a szolgáltatás állapotát: fájltár, feladatok és végrehajtók.
+
+        Args:
+            max_workers (int): Az egyszerre futó feladatok száma.
+            max_queued_jobs (int): A várakozó feladatok legnagyobb száma, fölötte az új kéréseket elutasítja.
+            max_files (int): A tárolt fájlok legnagyobb száma.
+            max_finished_jobs (int): A megőrzött befejezett feladatok legnagyobb száma.
+
+        Returns:
+            dict: A szolgáltatás állapota, a kéréskezelő ezen keresztül éri el.
+    """
+    return {'files': {}, 'jobs': {}, 'lock': threading.Lock(), 'max_queued_jobs': max_queued_jobs,
+            'max_files': max_files, 'max_finished_jobs': max_finished_jobs,
+            'job_executor': ThreadPoolExecutor(max_workers=max_workers),
+            'export_executor': ProcessPoolExecutor(max_workers=2, mp_context=multiprocessing.get_context('spawn'))}
+
+### Fájltár. A szótár sorrendje a használat sorrendje (minden írás és olvasás a végére teszi a fájlt), így az elején
+# vannak a legrégebben használtak. Az evict_* függvényeket a zár birtokában kell hívni.
+def active_file_ids(service):
+    return {value for job in service['jobs'].values() if job['status'] in ('queued', 'running')
+            for value in job['params'].values() if isinstance(value, str)}
+
+def evict_files(service):
+    excess = len(service['files']) - service['max_files']
+    if excess > 0:
+        active = active_file_ids(service)
+        for file_id in [file_id for file_id in service['files'] if file_id not in active][:excess]:
+            del service['files'][file_id]
+
+def evict_jobs(service):
+    finished = [job_id for job_id, job in service['jobs'].items() if job['status'] in ('done', 'failed')]
+    for job_id in finished[:max(len(finished) - service['max_finished_jobs'], 0)]:
+        del service['jobs'][job_id]
+
+def store_file(service, content):
+    file_id = hashlib.sha256(content).hexdigest()
+    with service['lock']:
+        service['files'].pop(file_id, None)
+        service['files'][file_id] = content
+        evict_files(service)
+    return file_id
+
+def get_file(service, file_id):
+    with service['lock']:
+        content = service['files'].pop(file_id, None)
+        if content is not None:
+            service['files'][file_id] = content
+    if content is None:
+        raise KeyError(f"Unknown file_id: {file_id}")
+    return io.BytesIO(content)
+
+def read_excel(service, file_id):
+    return pd.read_excel(get_file(service, file_id))
+
+### A három lépés. Mindegyik a bemeneti fájlok azonosítóit és a paramétereket kapja, és az elkészült fájlok
+# azonosítóit (plusz néhány összesítő értéket) adja vissza.
+def run_group(service, params):
+    previous_input = params.get('previous_input')
+    previous_main = params.get('previous_main')
+    result = First_Step.process_step1(
+        read_excel(service, params['input']),
+        First_Step.build_semester_limit_index(read_excel(service, params['semester_limits'])),
+        read_excel(service, previous_input) if previous_input else None,
+        read_excel(service, previous_main) if previous_main else None,
+        export_executor=service['export_executor'])
+    return {'main_data': store_file(service, result['main_buffer'].getvalue()),
+            'small_groups': store_file(service, result['separate_buffer'].getvalue()),
+            'messages': result['messages']}
+
+def run_allocate(service, params):
+    data = Second_Step.read_input_file(get_file(service, params['input']))
+    submitted_data_all, submitted_data_over, submitted_data_kerveny = Second_Step.split_submitted_data(data)
+
+    # A JSON kulcsok szövegek, a GroupIndex egész szám
+    default_percentage = params.get('default_percentage', 0.3)
+    group_percentages = {int(group): percentage for group, percentage in params.get('group_percentages', {}).items()}
+    group_percentages = {group: group_percentages.get(group, default_percentage)
+                         for group in submitted_data_all['GroupIndex'].unique()}
+
+    recipients, total_recipients, total_students, group_min_kodi_dict = \
+        Second_Step.calculate_scholarship_amounts_global(
+            submitted_data_kerveny, submitted_data_all, params['max_amount'], params['min_amount'], group_percentages,
+            params.get('k', 10.0), params.get('x0', 0.5))
+    budget_report = None
+    if 'group_budgets' in params:
+        # A JSON szöveg kulcsait a calculate_group_budget_amounts illeszti a csoportokhoz (szakokhoz)
+        recipients, budget_report = Second_Step.calculate_group_budget_amounts(
+            recipients, params['group_budgets'], params['max_amount'], params['min_amount'], params.get('k', 10.0),
+            params.get('x0', 0.5), Second_Step.BUDGET_LEVELS[params.get('budget_level', 'Group')])
+    elif 'total_fund' in params:
+        recipients = Second_Step.allocate_exact_budget(
+            recipients, params['total_fund'], params['max_amount'], params['min_amount'], params.get('k', 10.0),
+            params.get('x0', 0.5), params.get('slack'))
+    all_students_data = Second_Step.build_all_students_data(data, recipients, group_min_kodi_dict,
+                                                            submitted_data_over)
+    return {'scholarship_data': store_file(service, Second_Step.scholarship_data_excel(all_students_data)),
+            'total_allocated': float(Second_Step.calculate_total_allocated_funds(recipients)),
+            'total_recipients': int(total_recipients), 'total_students': int(total_students),
+            'budget_report': None if budget_report is None else
+            json.loads(budget_report.reset_index().to_json(orient='records', force_ascii=False))}
+
+def run_merge(service, params):
+    result = Third_Step.merge_files(Third_Step.load_scholarship_file(get_file(service, params['scholarship'])),
+                                    get_file(service, params['original']))
+    if result is None:
+        raise ValueError("The scholarship or the original file is missing required columns")
+    return {'combined': store_file(service, result['excel']),
+            'summary': store_file(service, Third_Step.summary_excel(result['summary']))}
+
+STEPS = {'/group': (run_group, ['input', 'semester_limits']),
+         '/allocate': (run_allocate, ['input', 'max_amount', 'min_amount']),
+         '/merge': (run_merge, ['scholarship', 'original'])}
+
+def run_job(service, job, step):
+    job['status'] = 'running'
+    try:
+        result, error, status = step(service, job['params']), None, 'done'
+    except Exception as exception:
+        result, error, status = None, f"{type(exception).__name__}: {exception}", 'failed'
+    with service['lock']:
+        job.update(result=result, error=error, status=status)
+        evict_jobs(service)
+
+# Egy kész feladat csak akkor adható vissza újra, ha az eredmény fájljai még megvannak
+def results_available(service, job):
+    return job['status'] != 'done' or all(job['result'][name] in service['files'] for name in RESULT_FILES
+                                          if name in job['result'])
+
+### Feladat indítása. Egy már létező (várakozó, futó vagy kész) azonos feladatot ad vissza új helyett; a hibás és a
+# törölt eredményfájlú kész feladat újraküldéskor újra lefut.
+def submit_job(service, path, params):
+    """Elindít egy lépést a háttérben, vagy visszaadja az azonos kéréshez tartozó meglévő feladatot.
+
+        Args:
+            service (dict): A create_service által létrehozott állapot.
+            path (str): A lépés végpontja ('/group', '/allocate' vagy '/merge').
+            params (dict): A kérés JSON törzse.
+
+        Returns:
+            dict: A feladat, vagy None, ha a várakozási sor megtelt.
+    """
+    step, required_params = STEPS[path]
+    missing_params = [name for name in required_params if name not in params]
+    if missing_params:
+        raise ValueError(f"Missing parameters: {', '.join(missing_params)}")
+
+    job_id = hashlib.sha256(json.dumps([path, params], sort_keys=True).encode()).hexdigest()
+    with service['lock']:
+        job = service['jobs'].get(job_id)
+        if job is not None and job['status'] != 'failed' and results_available(service, job):
+            return job
+        queued_jobs = sum(job['status'] == 'queued' for job in service['jobs'].values())
+        if queued_jobs >= service['max_queued_jobs']:
+            return None
+        job = {'job_id': job_id, 'step': path.strip('/'), 'params': params, 'status': 'queued', 'result': None,
+               'error': None}
+        service['jobs'][job_id] = job
+    service['job_executor'].submit(run_job, service, job, step)
+    return job
+
+def job_status(job):
+    return {key: job[key] for key in ['job_id', 'step', 'status', 'result', 'error']}
+
+class BatchRequestHandler(BaseHTTPRequestHandler):
+    def send_json(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        service = self.server.service
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.path == '/upload':
+            self.send_json(201, {'file_id': store_file(service, body)})
+            return
+        if self.path not in STEPS:
+            self.send_json(404, {'error': f"Unknown endpoint: {self.path}"})
+            return
+        try:
+            params = json.loads(body or b'{}')
+            if not isinstance(params, dict):
+                raise ValueError("The request body must be a JSON object")
+            for name in ['input', 'semester_limits', 'previous_input', 'previous_main', 'scholarship', 'original']:
+                if params.get(name):
+                    if not isinstance(params[name], str):
+                        raise ValueError(f"'{name}' must be a file_id string")
+                    get_file(service, params[name])
+            job = submit_job(service, self.path, params)
+        except KeyError as error:
+            self.send_json(404, {'error': error.args[0]})
+            return
+        except ValueError as error:
+            self.send_json(400, {'error': str(error)})
+            return
+        if job is None:
+            self.send_json(503, {'error': "Too many queued jobs, try again later"})
+            return
+        self.send_json(202, job_status(job))
+
+    def do_GET(self):
+        service = self.server.service
+        if self.path.startswith('/jobs/'):
+            job = service['jobs'].get(self.path[len('/jobs/'):])
+            if job is None:
+                self.send_json(404, {'error': "Unknown job_id"})
+                return
+            self.send_json(200, job_status(job))
+            return
+        if self.path.startswith('/files/'):
+            try:
+                content = get_file(service, self.path[len('/files/'):]).getvalue()
+            except KeyError as error:
+                self.send_json(404, {'error': error.args[0]})
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', XLSX_MIME)
+            self.send_header('Content-Length', str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+            return
+        self.send_json(404, {'error': f"Unknown endpoint: {self.path}"})
+
+def create_server(port=DEFAULT_PORT, service=None):
+    server = ThreadingHTTPServer(('127.0.0.1', port), BatchRequestHandler)
+    server.service = service if service is not None else create_service()
+    return server
+
+def main():
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_PORT
+    server = create_server(port)
+    print(f"Scholarship batch API listening on http://127.0.0.1:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
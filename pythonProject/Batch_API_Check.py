@@ -0,0 +1,163 @@
+import contextlib
+import io
+import json
+import os
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import pandas as pd
+
+import Batch_API
+from Benchmark import generate_semester_limits, generate_students
+
+# A Batch_API végpontok ellenőrzése teljesen helyben: a szerver egy szabad (0-s) porton indul a 127.0.0.1 címen, és
+# szintetikus bemenettel végigmegy a feltöltés -> indítás -> lekérdezés -> letöltés láncon mindhárom lépéssel.
+# Ellenőrzi az azonos kérések összevonását, a várakozási sor korlátját, a fájltár korlátját és a hibás kéréseket is.
+# Futtatás: python Batch_API_Check.py [sorok száma]; eltérésnél AssertionError.
+
+POLL_SECONDS = 0.2
+TIMEOUT_SECONDS = 300
+
+def start_server(service):
+    server = Batch_API.create_server(0, service)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+def call(base_url, method, path, body=None):
+    """Egy kérés a szervernek.
+
+        Returns:
+            tuple: (HTTP státusz, JSON válasz vagy a letöltött fájl bájtjai).
+    """
+    data = body if body is None or isinstance(body, bytes) else json.dumps(body).encode()
+    request = urllib.request.Request(base_url + path, data=data, method=method)
+    try:
+        with urllib.request.urlopen(request) as response:
+            status, content, content_type = response.status, response.read(), response.headers['Content-Type']
+    except urllib.error.HTTPError as error:
+        status, content, content_type = error.code, error.read(), error.headers['Content-Type']
+    return status, json.loads(content) if content_type.startswith('application/json') else content
+
+def upload(base_url, data):
+    buffer = io.BytesIO()
+    data.to_excel(buffer, index=False)
+    status, response = call(base_url, 'POST', '/upload', buffer.getvalue())
+    assert status == 201, response
+    return response['file_id']
+
+def wait_for(base_url, job):
+    deadline = time.monotonic() + TIMEOUT_SECONDS
+    while job['status'] in ('queued', 'running'):
+        assert time.monotonic() < deadline, f"Job {job['job_id']} did not finish"
+        time.sleep(POLL_SECONDS)
+        status, job = call(base_url, 'GET', f"/jobs/{job['job_id']}")
+        assert status == 200, job
+    assert job['status'] == 'done', job['error']
+    return job['result']
+
+def download(base_url, file_id):
+    status, content = call(base_url, 'GET', f'/files/{file_id}')
+    assert status == 200 and content[:2] == b'PK', status
+    return pd.read_excel(io.BytesIO(content))
+
+### A teljes lánc: csoportosítás, ösztöndíj számítás, összefésülés
+def check_pipeline(num_students):
+    service = Batch_API.create_service()
+    server, base_url = start_server(service)
+    try:
+        students = generate_students(num_students, num_programs=40)
+        input_id = upload(base_url, students)
+        limits_id = upload(base_url, generate_semester_limits(40))
+
+        params = {'input': input_id, 'semester_limits': limits_id}
+        first = call(base_url, 'POST', '/group', params)
+        second = call(base_url, 'POST', '/group', dict(reversed(list(params.items()))))
+        assert first[0] == second[0] == 202 and first[1]['job_id'] == second[1]['job_id'], (first, second)
+        group_result = wait_for(base_url, first[1])
+        assert len(download(base_url, group_result['main_data'])) > 0
+
+        allocate_params = {'input': group_result['main_data'], 'max_amount': 100000, 'min_amount': 30000,
+                           'total_fund': 20_000_000, 'slack': 0}
+        status, job = call(base_url, 'POST', '/allocate', allocate_params)
+        assert status == 202, job
+        allocate_result = wait_for(base_url, job)
+        scholarship_data = download(base_url, allocate_result['scholarship_data'])
+        assert allocate_result['total_allocated'] == 20_000_000, allocate_result
+        assert pd.to_numeric(scholarship_data['Scholarship Amount'], errors='coerce').sum() == 20_000_000
+
+        # A kész feladat újraküldése ugyanazt az eredményt adja, új futás nélkül
+        status, again = call(base_url, 'POST', '/allocate', allocate_params)
+        assert status == 202 and again['status'] == 'done' and again['job_id'] == job['job_id'], again
+
+        # Slack nélkül az azonos KÖDI-jűek azonos összeget kapnak, és a keretet nem lépi túl
+        status, tied_job = call(base_url, 'POST', '/allocate',
+                                {key: value for key, value in allocate_params.items() if key != 'slack'})
+        assert status == 202, tied_job
+        tied_data = download(base_url, wait_for(base_url, tied_job)['scholarship_data'])
+        tied_amounts = pd.to_numeric(tied_data['Scholarship Amount'], errors='coerce')
+        assert tied_amounts.sum() <= 20_000_000
+        assert (tied_amounts.groupby(tied_data['KÖDI']).nunique() <= 1).all()
+
+        status, job = call(base_url, 'POST', '/merge', {'scholarship': allocate_result['scholarship_data'],
+                                                        'original': input_id})
+        assert status == 202, job
+        merge_result = wait_for(base_url, job)
+        assert '1 havi Ösztöndíj' in download(base_url, merge_result['combined']).columns
+        download(base_url, merge_result['summary'])
+    finally:
+        server.shutdown()
+        server.server_close()
+        service['export_executor'].shutdown()
+
+### Várakozási sor, fájltár korlát és hibás kérések. A feladat végrehajtót egy várakozó feladat foglalja le, így az
+# újak biztosan a sorban maradnak.
+def check_limits():
+    service = Batch_API.create_service(max_workers=1, max_queued_jobs=1, max_files=3)
+    server, base_url = start_server(service)
+    release = threading.Event()
+    try:
+        service['job_executor'].submit(release.wait)
+        file_id = call(base_url, 'POST', '/upload', b'not an xlsx')[1]['file_id']
+
+        params = {'scholarship': file_id, 'original': file_id}
+        status, queued = call(base_url, 'POST', '/merge', params)
+        assert status == 202 and queued['status'] == 'queued', queued
+        status, duplicate = call(base_url, 'POST', '/merge', params)
+        assert status == 202 and duplicate['job_id'] == queued['job_id'], duplicate
+        status, rejected = call(base_url, 'POST', '/allocate', {'input': file_id, 'max_amount': 1, 'min_amount': 1})
+        assert status == 503, rejected
+
+        # A várakozó feladat bemenete nem törlődik, a legrégebbi nem használt feltöltés igen
+        uploads = [call(base_url, 'POST', '/upload', bytes([number]))[1]['file_id'] for number in range(3)]
+        assert file_id in service['files'] and uploads[0] not in service['files'], list(service['files'])
+        assert call(base_url, 'GET', f'/files/{uploads[0]}')[0] == 404
+
+        for body in [b'[]', b'"x"', b'{not json', json.dumps({'scholarship': ['x'], 'original': file_id}).encode()]:
+            status, response = call(base_url, 'POST', '/merge', body)
+            assert status == 400, (body, status, response)
+
+        release.set()
+        status, job = call(base_url, 'GET', f"/jobs/{queued['job_id']}")
+        while job['status'] in ('queued', 'running'):
+            time.sleep(POLL_SECONDS)
+            status, job = call(base_url, 'GET', f"/jobs/{queued['job_id']}")
+        assert job['status'] == 'failed' and job['error'], job
+    finally:
+        release.set()
+        server.shutdown()
+        server.server_close()
+        service['export_executor'].shutdown()
+
+def main():
+    num_students = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    # A lépések diagnosztikai kiírásai nélkül
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        check_pipeline(num_students)
+        check_limits()
+    print("Batch API checks passed")
+
+if __name__ == "__main__":
+    main()
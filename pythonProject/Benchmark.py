@@ -0,0 +1,198 @@
+import contextlib
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+import First_Step
+
+# Teljesítmény és memória mérés szintetikus adatokon, a valódi Neptun export oszlopaival.
+# Futtatás: python Benchmark.py [sorok száma], az oldalak import idejéhez: python Benchmark.py --import-time,
+# a DuckDB-s mód összevetéséhez: python Benchmark.py --duckdb [sorok száma]
+
+LEVELS = ['alapképzés (BA/BSc/BProf)', 'mesterképzés (MA/MSc)', 'egységes, osztatlan képzés']
+
+### Szintetikus hallgatói tábla: véletlen szakméretek, néhány duplikált Neptun kód (több képzésen tanuló hallgatók)
+def generate_students(num_students, num_programs=200, seed=0, duplicate_ratio=0.01):
+    """Véletlen hallgatói adatokat generál az első lépés bemeneti formátumában.
+
+        Args:
+            num_students (int): A sorok száma.
+            num_programs (int): A szakok száma.
+            seed (int): A véletlengenerátor kezdőértéke.
+            duplicate_ratio (float): A több képzésen szereplő hallgatók aránya.
+
+        Returns:
+            pd.DataFrame: A generált bemeneti adatok.
+    """
+    rng = np.random.default_rng(seed)
+    weights = rng.pareto(1.5, num_programs) + 0.05
+    program = rng.choice(num_programs, size=num_students, p=weights / weights.sum())
+
+    neptun_codes = np.array([f'N{i:06d}' for i in range(num_students)], dtype=object)
+    num_duplicates = int(num_students * duplicate_ratio)
+    if num_duplicates:
+        targets = rng.choice(num_students, size=num_duplicates, replace=False)
+        neptun_codes[targets] = neptun_codes[rng.choice(num_students, size=num_duplicates, replace=False)]
+
+    request_ids = np.where(rng.random(num_students) < 0.7, np.char.add('K', np.arange(num_students).astype(str)), None)
+
+    return pd.DataFrame({
+        'KépzésKód': np.char.add('K', program.astype(str)),
+        'KépzésNév': np.char.add('Szak ', program.astype(str)),
+        'Neptun kód': neptun_codes,
+        'Nyomtatási név': np.char.add('Hallgató ', np.arange(num_students).astype(str)),
+        'Felvétel féléve': '2023/24/1',
+        'Aktív félévek': rng.integers(1, 13, num_students),
+        'Státusz2 jelen félév': 'Aktív',
+        'Ösztöndíj átlag előző félév': rng.uniform(3.8, 5.0, num_students).round(2),
+        'Képzési szint': np.array(LEVELS, dtype=object)[program % len(LEVELS)],
+        'Nyelv ID': np.where(program % 5 == 0, 'angol', 'magyar'),
+        'Tagozat': 'nappali',
+        'ElőzőFélévTeljesítettKredit': rng.integers(23, 45, num_students),
+        'Hallgató kérvény azonosító': request_ids,
+        'Évfolyam': '',
+    })
+
+# A generált szakokhoz tartozó félévszám limit tábla
+def generate_semester_limits(num_programs=200):
+    program = np.arange(num_programs)
+    return pd.DataFrame({
+        'Képzéskód': np.char.add('K', program.astype(str)),
+        'Félévszám': np.array([7, 4, 10])[program % len(LEVELS)],
+        'Képzés neve': np.char.add('Szak ', program.astype(str)),
+        'Képzési szint': np.array(LEVELS, dtype=object)[program % len(LEVELS)],
+        'Tagozat': 'nappali',
+    })
+
+### Memória mérés: a csoportosítás alatti csúcs allokáció (tracemalloc) a bemenet méretéhez képest
+def measure_pipeline_memory(num_students=100_000, budget_ratio=3.0):
+    """Lefuttatja a teljes első lépést és ellenőrzi, hogy a csúcs memória a megadott kereten belül marad.
+
+        Args:
+            num_students (int): A szintetikus bemenet sorainak száma.
+            budget_ratio (float): A megengedett csúcs memória a bemenet méretének többszöröseként.
+
+        Returns:
+            dict: A bemenet mérete, a csúcs memória (byte) és a futási idő (s).
+    """
+    data = generate_students(num_students)
+    input_bytes = int(data.memory_usage(deep=True).sum())
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        First_Step.run_grouping_pipeline(data)
+    elapsed = time.perf_counter() - start
+    _, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    result = {'input_bytes': input_bytes, 'peak_bytes': peak_bytes, 'seconds': elapsed}
+    if peak_bytes > budget_ratio * input_bytes:
+        raise AssertionError(f"Peak memory {peak_bytes / 2**20:.1f} MiB exceeds {budget_ratio}x the input "
+                             f"({input_bytes / 2**20:.1f} MiB)")
+    return result
+
+# Oldalanként megengedett import idő (s) hideg indításnál. A streamlit importja mindegyikben benne van, a pandas a
+# lépésekben; a matplotlib, openpyxl és xlsxwriter csak akkor töltődik be, amikor a hozzájuk tartozó lépés fut.
+IMPORT_TIME_BUDGETS = {'Main_menu': 0.6, 'First_Step': 1.2, 'Second_Step': 1.2, 'Third_Step': 1.2}
+
+### Import idő mérés: minden oldal külön, friss Python folyamatban (-X importtime), a kimenet utolsó sora az oldal
+# modul kumulatív ideje mikroszekundumban
+def measure_import_times(budgets=IMPORT_TIME_BUDGETS):
+    """Megméri az oldalak hideg import idejét és ellenőrzi, hogy a kereten belül maradnak.
+
+        Args:
+            budgets (dict): {modulnév: megengedett idő másodpercben}.
+
+        Returns:
+            dict: {modulnév: import idő másodpercben}.
+    """
+    directory = os.path.dirname(os.path.abspath(__file__))
+    import_times = {}
+    for module in budgets:
+        completed = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                                   cwd=directory, capture_output=True, text=True, check=True)
+        last_line = [line for line in completed.stderr.splitlines() if line.startswith('import time:')][-1]
+        import_times[module] = int(last_line.split('|')[1]) / 1e6
+
+    over_budget = {module: seconds for module, seconds in import_times.items() if seconds > budgets[module]}
+    if over_budget:
+        raise AssertionError("Import time over budget: " + ', '.join(
+            f"{module} {seconds:.2f} s > {budgets[module]} s" for module, seconds in over_budget.items()))
+    return import_times
+
+### A DuckDB-s végrehajtás összevetése a pandas-ossal ugyanazon a szintetikus bemeneten
+def compare_duckdb_backend(num_students=100_000):
+    """Lefuttatja az első és a második lépést mindkét módon, és ellenőrzi, hogy a fő és kiscsoport adatok, valamint
+    az ösztöndíjasok és az összegek megegyeznek (ugyanazokkal a százalékokkal és paraméterekkel).
+
+        Args:
+            num_students (int): A szintetikus bemenet sorainak száma.
+
+        Returns:
+            dict: A pandas és a DuckDB futási ideje (s).
+    """
+    import DuckDB_Backend
+    import Second_Step
+
+    data = generate_students(num_students)
+    semester_limits = generate_semester_limits()
+    parameters = (DuckDB_Backend.DEFAULT_MAX_AMOUNT, DuckDB_Backend.DEFAULT_MIN_AMOUNT)
+    curve = (DuckDB_Backend.DEFAULT_K, DuckDB_Backend.DEFAULT_X0)
+
+    start = time.perf_counter()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        pandas_results = First_Step.run_grouping_pipeline(data)
+        main_data, _ = First_Step.highlight_exceeded_semesters(
+            *pandas_results, First_Step.build_semester_limit_index(semester_limits))
+        submitted_data_all, _, submitted_data_kerveny = Second_Step.split_submitted_data(main_data)
+        group_percentages = {int(group): DuckDB_Backend.DEFAULT_PERCENTAGE
+                             for group in submitted_data_all['GroupIndex'].unique()}
+        pandas_recipients = Second_Step.calculate_scholarship_amounts_global(
+            submitted_data_kerveny, submitted_data_all, *parameters, group_percentages, *curve)[0]
+    pandas_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    con = DuckDB_Backend.connect()
+    DuckDB_Backend.load_table(con, data, 'students')
+    tables = DuckDB_Backend.run_grouping_pipeline(con)
+    duckdb_results = [con.table(table).df() for table in tables]
+    DuckDB_Backend.add_semester_limits(con, tables[0], semester_limits)
+    duckdb_recipients = con.table(DuckDB_Backend.calculate_scholarship_amounts(
+        con, DuckDB_Backend.select_recipients(con, tables[0], group_percentages), *parameters, *curve)).df()
+    duckdb_seconds = time.perf_counter() - start
+
+    compared_columns = ['GroupIndex', 'Neptun kód', 'Évfolyam', 'Ösztöndíjindex', 'KÖDI']
+    for pandas_data, duckdb_data in zip(pandas_results, duckdb_results):
+        pd.testing.assert_frame_equal(pandas_data[compared_columns].astype(str).reset_index(drop=True),
+                                      duckdb_data[compared_columns].astype(str), check_dtype=False)
+
+    recipient_columns = ['GroupIndex', 'Neptun kód', 'KÖDI', 'Scholarship Amount', 'Group Minimum Ösztöndíjindex']
+    pd.testing.assert_frame_equal(
+        pandas_recipients[recipient_columns].sort_values(['GroupIndex', 'Neptun kód'], ignore_index=True),
+        duckdb_recipients[recipient_columns].sort_values(['GroupIndex', 'Neptun kód'], ignore_index=True),
+        check_dtype=False)
+    return {'pandas_seconds': pandas_seconds, 'duckdb_seconds': duckdb_seconds}
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == '--duckdb':
+        result = compare_duckdb_backend(int(sys.argv[2]) if len(sys.argv) > 2 else 100_000)
+        print(f"Identical results, pandas: {result['pandas_seconds']:.1f} s, duckdb: {result['duckdb_seconds']:.1f} s")
+        return
+    if len(sys.argv) > 1 and sys.argv[1] == '--import-time':
+        for module, seconds in measure_import_times().items():
+            print(f"{module}: {seconds:.2f} s (budget {IMPORT_TIME_BUDGETS[module]} s)")
+        return
+
+    num_students = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    result = measure_pipeline_memory(num_students)
+    print(f"Input: {result['input_bytes'] / 2**20:.1f} MiB, peak: {result['peak_bytes'] / 2**20:.1f} MiB "
+          f"({result['peak_bytes'] / result['input_bytes']:.2f}x), time: {result['seconds']:.1f} s")
+
+if __name__ == "__main__":
+    main()
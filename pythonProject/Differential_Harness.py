@@ -0,0 +1,564 @@
+import contextlib
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+import First_Step
+import Second_Step
+from Benchmark import generate_students
+
+# Differenciális ellenőrzés: a gyorsított függvényeket az eredeti (referencia) változatukkal veti össze véletlen és
+# szándékosan nehéz (holtverseny, egyforma szomszédos évfolyamok, max == min csoportok, kis szakok, duplikált
+# Neptun kódok, üres vagy 1-14-en kívüli félévszámok) hallgatói táblákon, és esetenként feljegyzi a gyorsulást.
+# Futtatás: python Differential_Harness.py [véletlen esetek száma] [sorok száma]
+#
+# A referencia függvények az első kiadás változatai, szándékosan érintetlenül (a print-ekkel együtt, a futtató
+# elnémítja őket); ha egy gyorsítás eltér tőlük, az a gyorsítás hibája.
+
+### Referencia: First_Step.group_students_by_year (első kiadás)
+def reference_group_students_by_year(data):
+    modified_data = data.copy()
+    grouping_columns = ['KépzésNév', 'Képzési szint', 'Nyelv ID']
+
+    unique_programs = modified_data[grouping_columns].drop_duplicates()
+
+    for _, program in unique_programs.iterrows():
+        program_mask = (
+            (modified_data['KépzésNév'] == program['KépzésNév']) &
+            (modified_data['Képzési szint'] == program['Képzési szint']) &
+            (modified_data['Nyelv ID'] == program['Nyelv ID'])
+        )
+        program_data = modified_data[program_mask].copy()
+
+        year_counts = program_data['Évfolyam'].value_counts().sort_index()
+        years = list(year_counts.index)
+        counts = list(year_counts.values)
+
+        year_df = pd.DataFrame({'Évfolyam': years, 'Létszám': counts})
+        year_df.sort_values('Évfolyam', inplace=True)
+        year_df.reset_index(drop=True, inplace=True)
+
+        year_order = {label: idx for idx, label in enumerate(year_df['Évfolyam'])}
+
+        year_to_group = {year: year for year in year_df['Évfolyam']}
+
+        merged_years = set()
+
+        idx = 0
+        while idx < len(year_df):
+            current_year = year_df.loc[idx, 'Évfolyam']
+            current_count = year_df.loc[idx, 'Létszám']
+
+            if current_count >= 10:
+                idx += 1
+                continue
+
+            prev_idx = idx - 1 if idx > 0 else None
+            next_idx = idx + 1 if idx + 1 < len(year_df) else None
+
+            candidates = []
+            if prev_idx is not None:
+                prev_year = year_df.loc[prev_idx, 'Évfolyam']
+                prev_count = year_df.loc[prev_idx, 'Létszám']
+                candidates.append({'idx': prev_idx, 'year': prev_year, 'count': prev_count})
+            if next_idx is not None:
+                next_year = year_df.loc[next_idx, 'Évfolyam']
+                next_count = year_df.loc[next_idx, 'Létszám']
+                candidates.append({'idx': next_idx, 'year': next_year, 'count': next_count})
+
+            if not candidates:
+                idx += 1
+                continue
+
+            min_count = min(c['count'] for c in candidates)
+            min_candidates = [c for c in candidates if c['count'] == min_count]
+
+            if len(min_candidates) > 1:
+                merge_candidate = max(min_candidates, key=lambda c: year_order[c['year']])
+            else:
+                merge_candidate = min_candidates[0]
+
+            merge_idx = merge_candidate['idx']
+            merge_year = merge_candidate['year']
+
+            year_df.loc[merge_idx, 'Létszám'] += current_count
+            year_df.loc[idx, 'Létszám'] = 0
+
+            target_group = year_to_group[merge_year]
+            year_to_group[current_year] = target_group
+
+            modified_data.loc[
+                program_mask & (modified_data['Évfolyam'] == current_year),
+                'Évfolyam'
+            ] = target_group
+
+            merged_years.add(current_year)
+            year_df = year_df[year_df['Létszám'] > 0].reset_index(drop=True)
+            idx = 0
+
+        for merged_year in merged_years:
+            target_group = year_to_group[merged_year]
+            modified_data.loc[
+                program_mask & (modified_data['Évfolyam'] == merged_year),
+                'Évfolyam'
+            ] = target_group
+
+    return modified_data
+
+### Referencia: First_Step.calculate_kodi (első kiadás, soronkénti apply-jal)
+def reference_calculate_kodi(data):
+    grouping_columns = ['KépzésNév', 'Képzési szint', 'Nyelv ID', 'Évfolyam']
+    grouped = data.groupby(grouping_columns, observed=True)
+
+    data['MinÖDI'] = grouped['Ösztöndíjindex'].transform('min')
+    data['MaxÖDI'] = grouped['Ösztöndíjindex'].transform('max')
+
+    def calculate_group_kodi(row):
+        if row['MaxÖDI'] == row['MinÖDI']:
+            return 100
+        else:
+            kodi = ((row['Ösztöndíjindex'] - row['MinÖDI']) / (row['MaxÖDI'] - row['MinÖDI'])) * 100
+            return round(kodi)
+
+    data['KÖDI'] = data.apply(calculate_group_kodi, axis=1)
+
+    max_odi_mask = data['Ösztöndíjindex'] == data['MaxÖDI']
+    data.loc[max_odi_mask, 'KÖDI'] = 100
+
+    min_odi_mask = data['Ösztöndíjindex'] == data['MinÖDI']
+    data.loc[min_odi_mask, 'KÖDI'] = 0
+
+    data.drop(columns=['MinÖDI', 'MaxÖDI'], inplace=True)
+
+    return data
+
+### Referencia: First_Step.remove_lower_kodi_duplicates (első kiadás, Neptun kódonként az egész táblán szűrve)
+def reference_remove_lower_kodi_duplicates(data):
+    duplicated = data[data.duplicated(subset=['Neptun kód'], keep=False)]
+    if not duplicated.empty:
+        for neptun_code in duplicated['Neptun kód'].unique():
+            student_rows = data[data['Neptun kód'] == neptun_code]
+            max_kodi_index = student_rows['KÖDI'].idxmax()
+            indices_to_drop = student_rows.index.difference([max_kodi_index])
+            data = data.drop(indices_to_drop)
+    return data.reset_index(drop=True)
+
+### Referencia: First_Step.filter_small_groups (első kiadás, groupby + merge)
+def reference_filter_small_groups(data):
+    grouping_columns = ['KépzésNév', 'Képzési szint', 'Nyelv ID']
+    course_counts = data.groupby(grouping_columns).size().reset_index(name='Total_in_Course')
+    data = data.merge(course_counts, on=grouping_columns)
+    small_groups = data[data['Total_in_Course'] < 10]
+    remaining_data = data[data['Total_in_Course'] >= 10]
+    small_groups = small_groups.drop(columns=['Total_in_Course'])
+    remaining_data = remaining_data.drop(columns=['Total_in_Course'])
+    return remaining_data, small_groups
+
+### Referencia: First_Step.group_students (első kiadás, a bemenetre írja az évfolyamot)
+def reference_group_students(data):
+    bins = [0, 2, 4, 6, 8, 10, 12, 14]
+    labels = ['1. éves', '2. éves', '3. éves', '4. éves', '5. éves', '6. éves', '7. éves']
+    data['Évfolyam'] = pd.cut(data['Aktív félévek'], bins=bins, labels=labels, right=True)
+
+    grouping_columns = ['KépzésNév', 'Képzési szint', 'Nyelv ID', 'Évfolyam']
+    grouped = data.groupby(grouping_columns, observed=True).size().reset_index(name='Létszám')
+    return grouped, data
+
+### Referencia: First_Step.calculate_scholarship_index (első kiadás, soronkénti apply-jal)
+def reference_calculate_scholarship_index(data):
+    data['Kredit szám'] = data['ElőzőFélévTeljesítettKredit'].apply(lambda x: min(x, 42))
+    data['Ösztöndíjindex'] = data['Ösztöndíj átlag előző félév'] + ((data['Kredit szám'] / 27) - 1) / 2
+
+    nan_rows = data[data['Ösztöndíjindex'].isna()]
+    print("Rows with NaN Ösztöndíjindex:\n", nan_rows)
+    return data
+
+### Referencia: First_Step.add_group_index (első kiadás, soronkénti join-nal)
+def reference_add_group_index(data):
+    grouping_columns = ['KépzésNév', 'Képzési szint', 'Nyelv ID', 'Évfolyam']
+    data['GroupID'] = data[grouping_columns].apply(lambda x: ' | '.join(x.astype(str)), axis=1)
+    data['GroupIndex'] = (data['GroupID'] != data['GroupID'].shift()).cumsum()
+    data.drop(columns=['GroupID'], inplace=True)
+    cols = data.columns.tolist()
+    cols.insert(0, cols.pop(cols.index('GroupIndex')))
+    data = data[cols]
+    return data
+
+### Referencia: First_Step.run_grouping_pipeline (az első kiadás main függvényének csoportosító része, két körrel)
+def reference_run_grouping_pipeline(data):
+    remaining_data, small_groups_data_initial = reference_filter_small_groups(data)
+    grouped_data, original_data = reference_group_students(remaining_data)
+    updated_data = reference_group_students_by_year(remaining_data)
+    updated_data = reference_calculate_scholarship_index(updated_data)
+    updated_data = reference_calculate_kodi(updated_data)
+
+    updated_data = reference_remove_lower_kodi_duplicates(updated_data)
+
+    remaining_data, small_groups_data_after = reference_filter_small_groups(updated_data)
+    grouped_data, original_data = reference_group_students(remaining_data)
+    updated_data = reference_group_students_by_year(remaining_data)
+    updated_data = reference_calculate_scholarship_index(updated_data)
+    updated_data = reference_calculate_kodi(updated_data)
+
+    small_groups_data_combined = (pd.concat([small_groups_data_initial, small_groups_data_after])
+                                  .drop_duplicates().reset_index(drop=True))
+
+    small_groups_data_combined = reference_calculate_scholarship_index(small_groups_data_combined)
+
+    sort_columns = ['KépzésNév', 'Képzési szint', 'Nyelv ID', 'Évfolyam', 'Aktív félévek']
+    updated_data = updated_data.sort_values(by=sort_columns, ascending=True)
+    small_groups_data_combined = small_groups_data_combined.sort_values(by=sort_columns, ascending=True)
+
+    updated_data = reference_add_group_index(updated_data)
+    # Az első kiadás üres táblán elhasal (az üres apply DataFrame-et ad vissza), ha nincs kis szak, csak az oszlop kerül be
+    if small_groups_data_combined.empty:
+        small_groups_data_combined.insert(0, 'GroupIndex', 0)
+    else:
+        small_groups_data_combined = reference_add_group_index(small_groups_data_combined)
+    return updated_data, small_groups_data_combined
+
+### Referencia: Second_Step.calculate_scholarship_amounts_global (első kiadás, csoportonkénti teljes szűréssel)
+def reference_calculate_scholarship_amounts_global(submitted_data, all_data, max_amount_per_group,
+                                                   min_amount_per_group, group_percentages, k, x0):
+    recipients_list = []
+    total_students = len(all_data)
+    total_recipients = 0
+    group_min_index_dict = {}
+
+    for group in all_data['GroupIndex'].unique():
+        all_group_data = all_data[all_data['GroupIndex'] == group].copy()
+        group_submitted_data = submitted_data[submitted_data['GroupIndex'] == group].copy()
+
+        num_students_in_group = len(all_group_data)
+        group_percentage = group_percentages.get(group, 0.25)
+
+        num_recipients = int(np.ceil(group_percentage * num_students_in_group))
+
+        group_submitted_data = group_submitted_data.sort_values(by='KÖDI', ascending=False).reset_index(drop=True)
+
+        initial_recipients = group_submitted_data.iloc[:num_recipients].copy()
+
+        if not initial_recipients.empty:
+            last_included_KODI = initial_recipients['KÖDI'].iloc[-1]
+
+            additional_recipients = group_submitted_data[
+                (group_submitted_data['KÖDI'] == last_included_KODI) & (group_submitted_data.index >= num_recipients)]
+
+            all_recipients_group = pd.concat([initial_recipients, additional_recipients]).drop_duplicates(
+                subset=['Neptun kód'])
+
+            if len(all_recipients_group) < num_recipients:
+                remaining_students = group_submitted_data.loc[
+                    ~group_submitted_data['Neptun kód'].isin(all_recipients_group['Neptun kód'])]
+                num_needed = num_recipients - len(all_recipients_group)
+                additional_needed = remaining_students.iloc[:num_needed]
+                all_recipients_group = pd.concat([all_recipients_group, additional_needed])
+
+            num_recipients_actual = len(all_recipients_group)
+            total_recipients += num_recipients_actual
+
+            group_min_index_dict[group] = all_recipients_group['Ösztöndíjindex'].min()
+
+            all_recipients_group['Group Minimum Ösztöndíjindex'] = all_recipients_group['Ösztöndíjindex'].min()
+            recipients_list.append(all_recipients_group)
+
+    all_recipients = pd.concat(recipients_list, ignore_index=True)
+    all_recipients.drop_duplicates(inplace=True)
+
+    KODI_cutoff_global = all_recipients['KÖDI'].min()
+
+    epsilon = 0.01
+    KODI_normalized = (all_recipients['KÖDI'] - KODI_cutoff_global) / (100 - KODI_cutoff_global + epsilon)
+    KODI_normalized = np.clip(KODI_normalized, 0, 1)
+
+    f_K = 1 / (1 + np.exp(-k * (KODI_normalized - x0)))
+
+    all_recipients['Scholarship Amount'] = min_amount_per_group + f_K * (max_amount_per_group - min_amount_per_group)
+    all_recipients.loc[all_recipients['KÖDI'] == 100, 'Scholarship Amount'] = max_amount_per_group
+    all_recipients['Scholarship Amount'] = (all_recipients['Scholarship Amount'] / 100).round() * 100
+
+    cols = all_recipients.columns.tolist()
+    cols.insert(0, cols.pop(cols.index('Scholarship Amount')))
+    cols.insert(1, cols.pop(cols.index('Group Minimum Ösztöndíjindex')))
+    all_recipients = all_recipients[cols]
+
+    return all_recipients, total_recipients, total_students, group_min_index_dict
+
+### Bemenetek: véletlen táblák a Benchmark generátorával, és szándékosan nehéz esetek
+def program_with_year_counts(students, program, year_counts):
+    """A students első sum(year_counts) sorából egy szakot készít a megadott évfolyam létszámokkal.
+
+        Args:
+            students (pd.DataFrame): A generate_students kimenete, legalább sum(year_counts) sorral.
+            program (str): A szak azonosítója (KépzésKód és KépzésNév utótagja).
+            year_counts (list): Létszámok az 1., 2., ... évfolyamra (0 is lehet).
+
+        Returns:
+            pd.DataFrame: A szak hallgatói.
+    """
+    semesters = np.repeat(np.arange(len(year_counts)) * 2 + 1, year_counts)
+    rows = students.iloc[:len(semesters)]
+    return rows.assign(**{'KépzésKód': f'A{program}', 'KépzésNév': f'Adversarial {program}',
+                          'Képzési szint': 'alapképzés (BA/BSc/BProf)', 'Nyelv ID': 'magyar',
+                          'Aktív félévek': semesters,
+                          'Neptun kód': [f'{program}-{i:05d}' for i in range(len(semesters))]})
+
+def adversarial_cases(seed=0):
+    """A nehéz esetek: {név: (hallgatói tábla, max összeg, min összeg)}."""
+    rng = np.random.default_rng(seed)
+    students = generate_students(4000, seed=seed)
+    cases = {}
+
+    # Sok azonos ösztöndíjindex: holtversenyek a kiválasztási határon és a KÖDI kerekítésénél
+    ties = students.assign(**{'Ösztöndíj átlag előző félév': rng.choice([4.0, 4.5, 5.0], len(students)),
+                              'ElőzőFélévTeljesítettKredit': 30})
+    cases['cutoff_ties'] = (ties, 100000, 30000)
+
+    # Egyforma létszámú szomszéd évfolyamok (a magasabb évfolyam felé kell összevonni), láncolt összevonások,
+    # üres évfolyamok és pontosan 10 fős csoportok
+    patterns = [[10, 3, 10], [5, 5, 5, 5], [9, 0, 9, 20], [1, 1, 1, 1, 1, 1, 1], [12, 4, 4, 12], [10, 10, 9],
+                [3, 30, 3], [0, 0, 10, 0, 1], [6, 6], [2, 9, 2, 9, 2]]
+    merge_ties = pd.concat([program_with_year_counts(students, f'M{number}', pattern)
+                            for number, pattern in enumerate(patterns)], ignore_index=True)
+    cases['merge_tie_breaks'] = (merge_ties, 100000, 30000)
+
+    # Csoportonként azonos ösztöndíjindex (max == min), és egyforma max és min ösztöndíj összeg
+    flat = students.assign(**{'Ösztöndíj átlag előző félév': 4.2, 'ElőzőFélévTeljesítettKredit': 27})
+    cases['flat_groups_equal_amounts'] = (flat, 50000, 50000)
+
+    # Kis szakok: 1-12 fős szakok, a 10 fős határ mindkét oldalán
+    small = pd.concat([program_with_year_counts(students, f'S{size}', [size // 2, size - size // 2])
+                       for size in range(1, 13)] + [students.iloc[:1000]], ignore_index=True)
+    cases['small_programs'] = (small, 100000, 30000)
+
+    # Sok több képzésen szereplő hallgató, azonos KÖDI-vel is
+    duplicates = generate_students(4000, num_programs=40, seed=seed + 1, duplicate_ratio=0.25)
+    duplicates['Ösztöndíj átlag előző félév'] = duplicates['Ösztöndíj átlag előző félév'].round(1)
+    cases['many_duplicates'] = (duplicates, 100000, 30000)
+
+    # Üres vagy 1-14-en kívüli félévszám: nincs évfolyama, de a szak összlétszámába beleszámít (a 10 fős szak egy
+    # 15 féléves hallgatóval nem kiscsoport). Nagy szakon az első kiadás KÖDI hibával áll meg, kis szakon végigfut.
+    def with_semesters(program, year_counts, semesters):
+        rows = program_with_year_counts(students, program, year_counts)
+        return rows.assign(**{'Aktív félévek': list(semesters) + rows['Aktív félévek'].tolist()[len(semesters):]})
+
+    out_of_range_small = [with_semesters('O1', [4, 4], [15, 0]), with_semesters('O2', [3, 5], [np.nan]),
+                          with_semesters('O3', [1, 1], [16, np.nan])]
+    cases['out_of_range_small_programs'] = (pd.concat(out_of_range_small + [students.iloc[:1000]],
+                                                      ignore_index=True), 100000, 30000)
+    out_of_range_large = [with_semesters('O4', [5, 5], [15]), with_semesters('O5', [6, 6], [0, np.nan]),
+                          with_semesters('O6', [5, 4], [20])]
+    cases['out_of_range_large_programs'] = (pd.concat(out_of_range_small + out_of_range_large +
+                                                      [students.iloc[:1000]], ignore_index=True), 100000, 30000)
+    return cases
+
+def random_cases(count, num_students, seed=0):
+    rng = np.random.default_rng(seed)
+    return {f'random_{number}': (generate_students(num_students, num_programs=int(rng.integers(5, 120)),
+                                                   seed=seed + number,
+                                                   duplicate_ratio=float(rng.uniform(0, 0.05))),
+                                 100000, int(rng.integers(10, 90)) * 1000)
+            for number in range(count)}
+
+### Összevetés
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+def result_or_error(func, *args):
+    # Az eredmény, vagy a ValueError, ha a függvény (mint az első kiadás a hiányzó KÖDI-nél) hibával áll meg
+    try:
+        return func(*args)
+    except ValueError as error:
+        return error
+
+def grouping_input(students):
+    # Az évfolyam szerinti csoportosítás bemenete: a kis szakok nélküli, évfolyammal ellátott tábla
+    count_index = First_Step.build_count_index(students)
+    remaining_data, _ = First_Step.filter_small_groups(students, count_index)
+    _, remaining_data = First_Step.group_students(remaining_data.copy(), count_index)
+    return remaining_data.reset_index(drop=True), count_index
+
+def compare_case(name, students, max_amount, min_amount, seed=0):
+    """Lefuttatja a hat függvényt referencia és gyors változatban ugyanazon a bemeneten.
+
+        Args:
+            name (str): Az eset neve.
+            students (pd.DataFrame): Az első lépés bemenete.
+            max_amount (int): A maximális ösztöndíj.
+            min_amount (int): A minimális ösztöndíj.
+            seed (int): A csoportszázalékok véletlengenerátorának kezdőértéke.
+
+        Returns:
+            list: Függvényenként egy szótár: eset, függvény, sorok, idők, gyorsulás és hogy egyezik-e.
+    """
+    results = []
+
+    def record(kernel, rows, reference_seconds, fast_seconds, identical):
+        results.append({'case': name, 'kernel': kernel, 'rows': rows, 'reference_s': reference_seconds,
+                        'fast_s': fast_seconds, 'speedup': reference_seconds / max(fast_seconds, 1e-9),
+                        'identical': bool(identical)})
+
+    reference_split, reference_seconds = timed(reference_filter_small_groups, students.copy())
+    fast_split, fast_seconds = timed(First_Step.filter_small_groups, students,
+                                     First_Step.build_count_index(students))
+    record('filter_small_groups', len(students), reference_seconds, fast_seconds,
+           all(same_frame(reference, fast) for reference, fast in zip(reference_split, fast_split)))
+
+    reference_frames, reference_seconds = timed(result_or_error, reference_run_grouping_pipeline, students.copy())
+    fast_frames, fast_seconds = timed(result_or_error, First_Step.run_grouping_pipeline, students.copy())
+    if isinstance(reference_frames, ValueError) or isinstance(fast_frames, ValueError):
+        # Mindkettőnek hibával kell megállnia; a további függvényeknek nincs érvényes bemenete
+        record('run_grouping_pipeline', len(students), reference_seconds, fast_seconds,
+               isinstance(reference_frames, ValueError) and isinstance(fast_frames, ValueError))
+        return results
+    record('run_grouping_pipeline', len(students), reference_seconds, fast_seconds,
+           all(same_frame(reference, fast) for reference, fast in zip(reference_frames, fast_frames)))
+
+    data, count_index = grouping_input(students)
+    reference_grouped, reference_seconds = timed(reference_group_students_by_year, data.copy())
+    fast_grouped, fast_seconds = timed(First_Step.group_students_by_year, data, count_index)
+    record('group_students_by_year', len(data), reference_seconds, fast_seconds,
+           reference_grouped['Évfolyam'].astype(str).tolist() == fast_grouped['Évfolyam'].astype(str).tolist())
+
+    indexed = First_Step.calculate_scholarship_index(reference_grouped.copy())
+    reference_kodi, reference_seconds = timed(reference_calculate_kodi, indexed.copy())
+    fast_kodi, fast_seconds = timed(First_Step.calculate_kodi, indexed)
+    record('calculate_kodi', len(indexed), reference_seconds, fast_seconds,
+           np.array_equal(reference_kodi['KÖDI'].to_numpy(dtype=float), fast_kodi['KÖDI'].to_numpy(dtype=float),
+                          equal_nan=True))
+
+    reference_unique, reference_seconds = timed(reference_remove_lower_kodi_duplicates, reference_kodi.copy())
+    fast_unique, fast_seconds = timed(First_Step.remove_lower_kodi_duplicates, reference_kodi)
+    record('remove_lower_kodi_duplicates', len(reference_kodi), reference_seconds, fast_seconds,
+           reference_unique.astype(str).equals(fast_unique.astype(str)))
+
+    # A második lépés bemenete: csoportindex, a kérelmet benyújtók és véletlen (0 is lehet) csoportszázalékok
+    step2_data = First_Step.add_group_index(First_Step.sort_data(reference_unique)).assign(
+        **{'Exceed Limit': False})
+    submitted_data_all, _, submitted_data_kerveny = Second_Step.split_submitted_data(step2_data)
+    rng = np.random.default_rng(seed)
+    groups = submitted_data_all['GroupIndex'].unique()
+    group_percentages = dict(zip(groups, rng.choice([0.0, 0.1, 0.25, 0.3, 0.5, 1.0], len(groups))))
+    group_percentages[groups[0]] = 0.5
+    arguments = (submitted_data_kerveny, submitted_data_all, max_amount, min_amount, group_percentages, 10.0, 0.5)
+
+    reference_result, reference_seconds = timed(reference_calculate_scholarship_amounts_global, *arguments)
+    fast_result, fast_seconds = timed(Second_Step.calculate_scholarship_amounts_global, *arguments)
+    # A gyorsítótáras út: első hívás feltölti, a második a gyorsítótárból válogat
+    recipient_cache = {}
+    Second_Step.calculate_scholarship_amounts_global(*arguments, recipient_cache=recipient_cache)
+    cached_result = Second_Step.calculate_scholarship_amounts_global(
+        *arguments, recipient_cache=recipient_cache, group_sizes=submitted_data_all['GroupIndex'].value_counts())
+    record('calculate_scholarship_amounts_global', len(submitted_data_all), reference_seconds, fast_seconds,
+           same_allocation(reference_result, fast_result) and same_allocation(reference_result, cached_result))
+    return results
+
+def same_frame(reference, fast):
+    # Azonos oszlopok azonos sorrendben, soronként azonos értékek (szövegként, így a NaN és a típusok is egyeznek)
+    return (reference.columns.tolist() == fast.columns.tolist() and
+            reference.reset_index(drop=True).astype(str).equals(fast.reset_index(drop=True).astype(str)))
+
+def same_allocation(reference_result, fast_result):
+    # Azonos ösztöndíjas halmaz, Neptun kódonként azonos összeg és csoport minimum, azonos darabszámok
+    def amounts(recipients):
+        return recipients.set_index('Neptun kód')[['GroupIndex', 'Scholarship Amount',
+                                                   'Group Minimum Ösztöndíjindex']].sort_index()
+
+    reference_recipients, *reference_totals, reference_minimums = reference_result
+    fast_recipients, *fast_totals, fast_minimums = fast_result
+    return (set(reference_recipients['Neptun kód']) == set(fast_recipients['Neptun kód'])
+            and amounts(reference_recipients).equals(amounts(fast_recipients))
+            and reference_totals == fast_totals and reference_minimums == fast_minimums)
+
+### A pontos keret tulajdonságai (nincs referencia változata): a határokon belül marad, a 100-as KÖDI a maximumot
+# kapja, a nagyobb KÖDI sosem kap kevesebbet, az azonos KÖDI-jűek azonos összeget kapnak, és a végösszeg alapból
+# legfeljebb egy azonos KÖDI-jű blokknyi egységgel marad a keret alatt; slack=0-val pontosan a keret.
+def check_exact_budget(num_cases=2000, seed=0, unit=100):
+    """Véletlen KÖDI táblákon ellenőrzi az allocate_exact_budget és a calculate_group_budget_amounts kimenetét.
+
+        Args:
+            num_cases (int): A véletlen esetek száma.
+            seed (int): A véletlengenerátor kezdőértéke.
+            unit (int): A kerekítési egység forintban.
+
+        Raises:
+            AssertionError: Az első esetnél, ahol egy tulajdonság nem teljesül.
+    """
+    rng = np.random.default_rng(seed)
+    for case in range(num_cases):
+        count = int(rng.integers(1, 60))
+        kodi = rng.choice(rng.integers(0, 101, int(rng.integers(1, 20))), count)
+        max_amount = int(rng.integers(300, 1000)) * unit
+        min_amount = int(rng.integers(0, max_amount // unit)) * unit
+        required = min_amount * int((kodi != 100).sum()) + max_amount * int((kodi == 100).sum())
+        total_fund = int(rng.integers(required // unit, max_amount * count // unit + 1)) * unit
+        k, x0 = float(rng.uniform(1, 20)), float(rng.uniform(0, 1))
+        recipients = pd.DataFrame({'GroupIndex': rng.integers(1, 4, count), 'KÖDI': kodi})
+        largest_tie = int(recipients['KÖDI'].value_counts().max())
+
+        for slack in (None, 0):
+            amounts = Second_Step.allocate_exact_budget(recipients, total_fund, max_amount, min_amount, k, x0,
+                                                        slack)['Scholarship Amount']
+            by_kodi = amounts.groupby(kodi)
+            assert amounts.between(min_amount, max_amount).all(), case
+            assert (amounts[kodi == 100] == max_amount).all(), case
+            assert (by_kodi.min().to_numpy()[1:] >= by_kodi.max().to_numpy()[:-1]).all(), case
+            if slack is None:
+                assert (by_kodi.nunique() == 1).all(), case
+                assert 0 <= total_fund - amounts.sum() < max(largest_tie, 1) * unit, case
+            else:
+                assert (by_kodi.max() - by_kodi.min() <= unit).all(), case
+                assert amounts.sum() == total_fund, case
+
+        # Csoportkeret: a minimumokat fedező keretet egyik csoport sem lépi túl, a holtversenyek egyben maradnak
+        budgets = {group: int(rng.integers(0, max_amount * 30 // unit)) * unit for group in (1, 2, 3)}
+        allocated, report = Second_Step.calculate_group_budget_amounts(recipients, budgets, max_amount, min_amount,
+                                                                       k, x0)
+        required = allocated.groupby('GroupIndex')['KÖDI'].agg(
+            lambda group: min_amount * int((group != 100).sum()) + max_amount * int((group == 100).sum()))
+        assert (report.loc[report['Budget'] >= required, 'Difference'] <= 0).all(), case
+        assert (allocated.groupby(['GroupIndex', 'KÖDI'])['Scholarship Amount'].nunique() == 1).all(), case
+
+def run_harness(num_random_cases=5, num_students=5000, seed=0):
+    """Lefuttatja az összes esetet és ellenőrzi, hogy minden gyors függvény egyezik a referenciával.
+
+        Args:
+            num_random_cases (int): A véletlen esetek száma.
+            num_students (int): A véletlen esetek sorainak száma.
+            seed (int): A véletlengenerátor kezdőértéke.
+
+        Returns:
+            pd.DataFrame: Esetenként és függvényenként az idők, a gyorsulás és az egyezés.
+    """
+    cases = {**adversarial_cases(seed), **random_cases(num_random_cases, num_students, seed)}
+    results = []
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        for case_number, (name, (students, max_amount, min_amount)) in enumerate(cases.items()):
+            results.extend(compare_case(name, students, max_amount, min_amount, seed + case_number))
+    results = pd.DataFrame(results)
+
+    mismatches = results[~results['identical']]
+    if not mismatches.empty:
+        raise AssertionError("Fast path differs from the reference:\n" +
+                             mismatches[['case', 'kernel']].to_string(index=False))
+    return results
+
+def main():
+    num_random_cases = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    num_students = int(sys.argv[2]) if len(sys.argv) > 2 else 5000
+    results = run_harness(num_random_cases, num_students)
+    pd.set_option('display.width', 200)
+    print(results.to_string(index=False, float_format=lambda value: f'{value:.3f}'))
+    print()
+    print("All fast paths identical to the reference. Median speedup per kernel:")
+    print(results.groupby('kernel')['speedup'].median().to_string(float_format=lambda value: f'{value:.1f}x'))
+    check_exact_budget()
+    print("Exact budget: ties, KÖDI order and totals hold on every random case")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,354 @@
+import argparse
+import os
+
+import duckdb
+import pandas as pd
+
+from First_Step import missing_kodi_error, plan_year_merges
+
+# Egyetemi szintű (több millió soros, több féléves) futtatásra szolgáló végrehajtási mód: az első lépés szűrése és
+# csoportosítása, a KÖDI és a második lépés ösztöndíjas kiválasztása SQL ablakfüggvényekként fut egy beágyazott
+# DuckDB adatbázisban. A DuckDB több szálon dolgozik, a memóriakorlát felett pedig a temp_directory-ba lapoz, így az
+# adatoknak nem kell egy Streamlit session memóriájában elférniük. Az eredmények megegyeznek a pandas-os lépésekével.
+# Futtatás: python DuckDB_Backend.py hallgatok.(parquet|xlsx) limitek.xlsx kimeneti_mappa [--percentage 0.3]
+# [--max-amount 100000] [--min-amount 30000] [--k 10] [--x0 0.5], az alapértékek a Streamlit oldaléi.
+
+YEAR_LABELS = ['1. éves', '2. éves', '3. éves', '4. éves', '5. éves', '6. éves', '7. éves']
+PROGRAM_COLUMNS = ['KépzésNév', 'Képzési szint', 'Nyelv ID']
+GROUPING_COLUMNS = PROGRAM_COLUMNS + ['Évfolyam']
+# A második lépés alapértékei, mint a Streamlit oldalon és a Batch_API-ban
+DEFAULT_PERCENTAGE = 0.3
+DEFAULT_MAX_AMOUNT = 100000
+DEFAULT_MIN_AMOUNT = 30000
+DEFAULT_K = 10.0
+DEFAULT_X0 = 0.5
+
+def quote(column):
+    return '"' + column.replace('"', '""') + '"'
+
+def column_list(columns, prefix=''):
+    return ', '.join(prefix + quote(col) for col in columns)
+
+def connect(database=':memory:', threads=None, memory_limit=None, temp_directory=None):
+    """Megnyitja a DuckDB adatbázist.
+
+        Args:
+            database (str): Az adatbázis fájl, vagy ':memory:'.
+            threads (int, optional): A használt szálak száma (alapértelmezés: az összes mag).
+            memory_limit (str, optional): Pl. '4GB'; e felett a DuckDB a temp_directory-ba lapoz.
+            temp_directory (str, optional): A lapozáshoz használt mappa.
+
+        Returns:
+            duckdb.DuckDBPyConnection: A kapcsolat.
+    """
+    config = {'preserve_insertion_order': True}
+    if threads is not None:
+        config['threads'] = threads
+    if memory_limit is not None:
+        config['memory_limit'] = memory_limit
+    if temp_directory is not None:
+        config['temp_directory'] = temp_directory
+    return duckdb.connect(database, config=config)
+
+### Betöltés: Parquet fájl(ok) (glob vagy lista is lehet), Excel vagy DataFrame. A '_row' oszlop az eredeti
+# sorrend, ez dönti el a holtversenyeket ugyanúgy, ahogy a pandas-os lépésekben a sorok sorrendje.
+def load_table(con, source, table):
+    """Betölti a forrást a megadott nevű táblába egy '_row' sorszám oszloppal.
+
+        Args:
+            con (duckdb.DuckDBPyConnection): A kapcsolat.
+            source (str, list or pd.DataFrame): Parquet útvonal(ak), Excel fájl vagy DataFrame. Az Excel fájlt a
+                pandas olvassa be (az xlsx formátum úgyis legfeljebb ~1 millió soros), a Parquet a memórián kívül is
+                feldolgozható.
+            table (str): A létrehozandó tábla neve.
+    """
+    if isinstance(source, str) and source.lower().endswith(('.xlsx', '.xls')):
+        source = pd.read_excel(source)
+    if isinstance(source, pd.DataFrame):
+        frame = source.assign(_row=range(len(source)))
+        con.register('_source_frame', frame)
+        con.execute(f"CREATE OR REPLACE TABLE {table} AS SELECT * FROM _source_frame")
+        con.unregister('_source_frame')
+    else:
+        con.execute(f"""
+            CREATE OR REPLACE TABLE {table} AS
+            SELECT * EXCLUDE (filename, file_row_number),
+                   row_number() OVER (ORDER BY filename, file_row_number) - 1 AS _row
+            FROM read_parquet(?, filename = true, file_row_number = true)""", [source])
+
+def source_columns(con, table):
+    return [col for col in con.table(table).columns if not col.startswith('_')]
+
+# Évfolyam a félévszámból, mint a pd.cut a (0, 2], (2, 4], ... (12, 14] sávokkal; azon kívül NULL
+YEAR_SQL = """CASE WHEN "Aktív félévek" > 0 AND "Aktív félévek" <= 14
+                   THEN CAST(CAST(ceil("Aktív félévek" / 2) AS INTEGER) AS VARCHAR) || '. éves' END"""
+
+# Szakonkénti létszám minden sorból, az évfolyam nélküliekkel együtt (mint a létszám index); hiányzó szak kulcs
+# esetén NULL, az ilyen sor sem a fő, sem a kiscsoport adatokba nem kerül
+PROGRAM_TOTAL_SQL = f"""CASE WHEN {' AND '.join(f'{quote(col)} IS NOT NULL' for col in PROGRAM_COLUMNS)}
+                             THEN count(*) OVER (PARTITION BY {column_list(PROGRAM_COLUMNS)}) END"""
+
+### Az évfolyam összevonás szakonként legfeljebb 7 létszámon dönt, ezt a First_Step.plan_year_merges számolja ki
+# a DuckDB-ből lekért (kicsi) létszám táblán, a hallgatói sorokra pedig egy join viszi rá
+def build_year_plan(con, table):
+    """Kiszámolja a szakonkénti évfolyam összevonásokat a tábla '_year' oszlopa alapján.
+
+        Args:
+            con (duckdb.DuckDBPyConnection): A kapcsolat.
+            table (str): A '_year' oszloppal rendelkező tábla (csak a 10 fős vagy nagyobb szakok).
+
+        Returns:
+            pd.DataFrame: Szak oszlopok, '_year' és '_target' az összevont évfolyamokra.
+    """
+    counts = con.execute(f"""
+        SELECT {column_list(PROGRAM_COLUMNS)}, _year, count(*) AS count FROM {table}
+        WHERE _year IS NOT NULL GROUP BY ALL""").df()
+
+    plan = []
+    for program, program_counts in counts.groupby(PROGRAM_COLUMNS, sort=False):
+        year_counts = program_counts.set_index('_year')['count'].reindex(YEAR_LABELS, fill_value=0)
+        plan.extend(program + (year, target) for year, target in plan_year_merges(year_counts).items())
+    return pd.DataFrame(plan, columns=PROGRAM_COLUMNS + ['_year', '_target']).astype(
+        {col: counts[col].dtype for col in PROGRAM_COLUMNS})
+
+### Egy csoportosítási kör: szűrés a szak létszáma alapján, évfolyam összevonás, ösztöndíjindex és KÖDI.
+# A kiscsoportos sorok a kör előtti oszlopaikkal kerülnek a small_table-be.
+def grouping_pass(con, source_table, columns, main_table, small_table):
+    output_columns = columns + (['Évfolyam'] if 'Évfolyam' not in columns else []) + ['Kredit szám', 'Ösztöndíjindex',
+                                                                                      'KÖDI']
+    con.execute(f"""
+        CREATE OR REPLACE TEMP TABLE _pass AS
+        SELECT *, {PROGRAM_TOTAL_SQL} AS _total
+        FROM (SELECT *, {YEAR_SQL} AS _year FROM {source_table})""")
+    con.execute(f"CREATE OR REPLACE TEMP TABLE {small_table} AS SELECT * EXCLUDE (_year, _total) FROM _pass "
+                f"WHERE _total < 10")
+
+    con.register('_year_plan', build_year_plan(con, '(SELECT * FROM _pass WHERE _total >= 10)'))
+    year_sql = "coalesce(_year_plan._target, _pass._year)"
+    select_columns = ', '.join(f"{year_sql} AS {quote(col)}" if col == 'Évfolyam' else f'_pass.{quote(col)}'
+                               for col in columns if col not in ['Kredit szám', 'Ösztöndíjindex', 'KÖDI'])
+    if 'Évfolyam' not in columns:
+        select_columns += f", {year_sql} AS \"Évfolyam\""
+    con.execute(f"""
+        CREATE OR REPLACE TEMP TABLE _grouped AS
+        SELECT {select_columns},
+               CASE WHEN "ElőzőFélévTeljesítettKredit" > 42 THEN 42 ELSE "ElőzőFélévTeljesítettKredit" END
+                   AS "Kredit szám",
+               _pass._row
+        FROM _pass LEFT JOIN _year_plan
+          ON {' AND '.join(f'_pass.{quote(col)} = _year_plan.{quote(col)}' for col in PROGRAM_COLUMNS)}
+         AND _pass._year = _year_plan._year
+        WHERE _pass._total >= 10""")
+    con.unregister('_year_plan')
+
+    # KÖDI: a csoport minimuma 0, maximuma 100 (egyfős csoportban a minimum szabály az erősebb, mint a pandas-os
+    # maszkok sorrendjében); a kerekítés páros felé, mint a pandas round()
+    group_window = f"PARTITION BY {column_list(GROUPING_COLUMNS)}"
+    con.execute(f"""
+        CREATE OR REPLACE TEMP TABLE {main_table} AS
+        SELECT {column_list(output_columns)}, _row FROM (
+            SELECT *,
+                   CASE WHEN {' OR '.join(f'{quote(col)} IS NULL' for col in GROUPING_COLUMNS)} THEN NULL
+                        WHEN "Ösztöndíjindex" = _min THEN 0
+                        WHEN "Ösztöndíjindex" = _max THEN 100
+                        WHEN _max = _min THEN 100
+                        ELSE round_even(("Ösztöndíjindex" - _min) / (_max - _min) * 100, 0)
+                   END::BIGINT AS "KÖDI"
+            FROM (SELECT *, min("Ösztöndíjindex") OVER ({group_window}) AS _min,
+                            max("Ösztöndíjindex") OVER ({group_window}) AS _max
+                  FROM (SELECT *, "Ösztöndíj átlag előző félév" + (("Kredit szám" / 27) - 1) / 2 AS "Ösztöndíjindex"
+                        FROM _grouped)))
+        ORDER BY _row""")
+    missing = con.execute(f'SELECT "Neptun kód" FROM {main_table} WHERE "KÖDI" IS NULL ORDER BY _row').fetchall()
+    if missing:
+        raise missing_kodi_error([code for code, in missing])
+
+def run_grouping_pipeline(con, table='students'):
+    """Lefuttatja az első lépés csoportosítását és KÖDI számítását a megadott táblán.
+
+        Ugyanazt számolja, mint a First_Step.run_grouping_pipeline: két csoportosítási kör a duplikált Neptun
+        kódok (az alacsonyabb KÖDI-jű sor) törlésével közöttük, rendezés és csoportindex.
+
+        Args:
+            con (duckdb.DuckDBPyConnection): A kapcsolat.
+            table (str): A load_table által betöltött hallgatói tábla.
+
+        Returns:
+            tuple: A létrehozott 'main_data' és 'small_groups' táblák neve.
+    """
+    columns = source_columns(con, table)
+    grouping_pass(con, table, columns, '_main_first', '_small_initial')
+
+    # Duplikált Neptun kódnál a legnagyobb KÖDI-jű sor marad, egyenlőségnél az elöl álló (mint az idxmax)
+    con.execute("""
+        CREATE OR REPLACE TEMP TABLE _deduplicated AS
+        SELECT * EXCLUDE (_rank) FROM (
+            SELECT *, row_number() OVER (PARTITION BY "Neptun kód" ORDER BY "KÖDI" DESC NULLS LAST, _row) AS _rank
+            FROM _main_first)
+        WHERE "Neptun kód" IS NULL OR _rank = 1
+        ORDER BY _row""")
+
+    pass_columns = source_columns(con, '_deduplicated')
+    grouping_pass(con, '_deduplicated', pass_columns, '_main_second', '_small_after')
+
+    sort_columns = ', '.join(f'{quote(col)} ASC NULLS LAST' for col in GROUPING_COLUMNS + ['Aktív félévek'])
+    group_index = f"dense_rank() OVER (ORDER BY {', '.join(f'{quote(col)} NULLS LAST' for col in GROUPING_COLUMNS)})"
+    con.execute(f"""
+        CREATE OR REPLACE TABLE main_data AS
+        SELECT {group_index} AS "GroupIndex", {column_list(pass_columns)} FROM _main_second
+        ORDER BY {sort_columns}, _row""")
+
+    # Kiscsoportok: az első kör (eredeti oszlopok) és a második kör kiscsoportjai, teljes sor szerinti
+    # duplikátumszűréssel, majd az ösztöndíjindex újraszámolásával
+    initial_columns = ', '.join(f'CAST({quote(col)} AS VARCHAR) AS "Évfolyam"' if col == 'Évfolyam' else quote(col)
+                                for col in columns)
+    after_columns = ', '.join(f'CAST({quote(col)} AS VARCHAR) AS "Évfolyam"' if col == 'Évfolyam' else quote(col)
+                              for col in pass_columns)
+    con.execute(f"""
+        CREATE OR REPLACE TEMP TABLE _small_combined AS
+        SELECT * EXCLUDE (_rank) FROM (
+            SELECT *, row_number() OVER (PARTITION BY {column_list(pass_columns)} ORDER BY _source, _row) AS _rank
+            FROM (SELECT {initial_columns}, 0 AS _source, _row FROM _small_initial
+                  UNION ALL BY NAME
+                  SELECT {after_columns}, 1 AS _source, _row FROM _small_after))
+        WHERE _rank = 1""")
+    small_columns = ', '.join(
+        """CASE WHEN "ElőzőFélévTeljesítettKredit" > 42 THEN 42 ELSE "ElőzőFélévTeljesítettKredit" END AS "Kredit szám\""""
+        if col == 'Kredit szám' else
+        """"Ösztöndíj átlag előző félév" + ((_kredit / 27) - 1) / 2 AS "Ösztöndíjindex\""""
+        if col == 'Ösztöndíjindex' else quote(col) for col in pass_columns)
+    con.execute(f"""
+        CREATE OR REPLACE TABLE small_groups AS
+        SELECT {group_index} AS "GroupIndex", {small_columns} FROM (
+            SELECT *, CASE WHEN "ElőzőFélévTeljesítettKredit" > 42 THEN 42 ELSE "ElőzőFélévTeljesítettKredit" END
+                          AS _kredit
+            FROM _small_combined)
+        ORDER BY {sort_columns}, _source, _row""")
+    return 'main_data', 'small_groups'
+
+### Félévszám limitek, mint a First_Step.resolve_semester_limits: képzéskódonként az első limit sor számít
+def add_semester_limits(con, table, limits_source):
+    """Hozzáadja az 'Adjusted Félévszám', 'Exceed Limit' és 'Unknown Program Code' oszlopokat a táblához.
+
+        Args:
+            con (duckdb.DuckDBPyConnection): A kapcsolat.
+            table (str): A kiegészítendő tábla (pl. 'main_data').
+            limits_source (str or pd.DataFrame): A félévszám limitek (Excel, Parquet vagy DataFrame).
+    """
+    load_table(con, limits_source, '_semester_limits')
+    con.execute(f"""
+        CREATE OR REPLACE TABLE {table} AS
+        SELECT t.*,
+               limits."Félévszám" + CASE t."Képzési szint" WHEN 'alapképzés (BA/BSc/BProf)' THEN 1
+                                                         WHEN 'mesterképzés (MA/MSc)' THEN 1
+                                                         WHEN 'egységes, osztatlan képzés' THEN 2
+                                                         ELSE 0 END AS "Adjusted Félévszám",
+               coalesce(t."Aktív félévek" > "Adjusted Félévszám", false) AS "Exceed Limit",
+               limits."Félévszám" IS NULL AS "Unknown Program Code"
+        FROM (SELECT *, row_number() OVER () AS _position FROM {table}) t
+        LEFT JOIN (SELECT "Képzéskód", "Félévszám" FROM _semester_limits
+                   QUALIFY row_number() OVER (PARTITION BY "Képzéskód" ORDER BY _row) = 1) limits
+          ON t."KépzésKód" = limits."Képzéskód"
+        ORDER BY t._position""")
+    con.execute(f"ALTER TABLE {table} DROP COLUMN _position")
+
+### Második lépés: csoportonként a kérelmet beadott hallgatók felső százaléka KÖDI szerint, a határon lévő
+# holtversenyekkel együtt (RANK), mint a Second_Step.select_group_recipients. A csoport létszáma a limitet nem
+# túllépő összes hallgató, a kiválasztottak száma ceil(százalék * létszám).
+def select_recipients(con, table, group_percentages, default_percentage=DEFAULT_PERCENTAGE):
+    """Kiválasztja az ösztöndíjasokat csoportonként.
+
+        Args:
+            con (duckdb.DuckDBPyConnection): A kapcsolat.
+            table (str): Az első lépés fő táblája a félévszám limitekkel (add_semester_limits).
+            group_percentages (dict): {GroupIndex: arány (0-1)}.
+            default_percentage (float): Az arány a szótárban nem szereplő csoportokra.
+
+        Returns:
+            str: A létrehozott 'recipients' tábla neve.
+    """
+    con.register('_group_percentages', pd.DataFrame(list(group_percentages.items()),
+                                                    columns=['GroupIndex', '_percentage']).astype({'_percentage': float}))
+    con.execute(f"""
+        CREATE OR REPLACE TEMP TABLE _recipients AS
+        SELECT * EXCLUDE (_percentage, _num_recipients, _rank, _position, _row_number) FROM (
+            SELECT *,
+                   rank() OVER (PARTITION BY "GroupIndex" ORDER BY "KÖDI" DESC NULLS LAST) AS _rank,
+                   row_number() OVER (PARTITION BY "GroupIndex" ORDER BY "KÖDI" DESC NULLS LAST, _position)
+                       AS _row_number
+            FROM (SELECT t.*, coalesce(p._percentage, {float(default_percentage)}) AS _percentage,
+                         ceil(coalesce(p._percentage, {float(default_percentage)}) *
+                              count(*) OVER (PARTITION BY t."GroupIndex")) AS _num_recipients
+                  FROM (SELECT *, row_number() OVER () AS _position FROM {table}) t
+                  LEFT JOIN _group_percentages p ON t."GroupIndex" = p."GroupIndex"
+                  WHERE NOT t."Exceed Limit")
+            WHERE "Hallgató kérvény azonosító" IS NOT NULL
+              AND CAST("Hallgató kérvény azonosító" AS VARCHAR) != '')
+        WHERE _row_number <= _num_recipients OR ("KÖDI" IS NOT NULL AND _rank <= _num_recipients)
+        ORDER BY "GroupIndex", "KÖDI" DESC NULLS LAST, _row_number""")
+    con.unregister('_group_percentages')
+    return '_recipients'
+
+def calculate_scholarship_amounts(con, recipients_table, max_amount, min_amount, k, x0):
+    """Kiszámolja az ösztöndíj összegeket a Second_Step.calculate_scholarship_amounts_global képletével.
+
+        Args:
+            con (duckdb.DuckDBPyConnection): A kapcsolat.
+            recipients_table (str): A select_recipients által létrehozott tábla.
+            max_amount (int): A maximális ösztöndíj.
+            min_amount (int): A minimális ösztöndíj.
+            k (float): A logisztikus függvény meredeksége.
+            x0 (float): A logisztikus függvény középpontja.
+
+        Returns:
+            str: A létrehozott 'recipients' tábla neve.
+    """
+    columns = con.table(recipients_table).columns
+    con.execute(f"""
+        CREATE OR REPLACE TABLE recipients AS
+        SELECT round_even(CASE WHEN "KÖDI" = 100 THEN {max_amount}
+                               ELSE {min_amount} + (1 / (1 + exp(-{float(k)} * (_normalized - {float(x0)})))) *
+                                    ({max_amount} - {min_amount}) END / 100, 0) * 100 AS "Scholarship Amount",
+               min("Ösztöndíjindex") OVER (PARTITION BY "GroupIndex") AS "Group Minimum Ösztöndíjindex",
+               {column_list(columns)}
+        FROM (SELECT *, greatest(least(("KÖDI" - min("KÖDI") OVER ()) / (100 - min("KÖDI") OVER () + 0.01), 1), 0)
+                            AS _normalized
+              FROM {recipients_table})
+        ORDER BY "GroupIndex", "KÖDI" DESC NULLS LAST, "Neptun kód\"""")
+    return 'recipients'
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(description="Run steps 1 and 2 in an embedded DuckDB database.")
+    parser.add_argument('students', help="Student export (.parquet or .xlsx)")
+    parser.add_argument('semester_limits', help="Semester limits (.xlsx)")
+    parser.add_argument('output_dir', help="Directory for the Parquet outputs")
+    parser.add_argument('--percentage', type=float, default=DEFAULT_PERCENTAGE,
+                        help="Share of every group receiving a scholarship, 0-1 (default: %(default)s)")
+    parser.add_argument('--max-amount', type=int, default=DEFAULT_MAX_AMOUNT,
+                        help="Maximum scholarship amount per student (default: %(default)s)")
+    parser.add_argument('--min-amount', type=int, default=DEFAULT_MIN_AMOUNT,
+                        help="Minimum scholarship amount per student (default: %(default)s)")
+    parser.add_argument('--k', type=float, default=DEFAULT_K,
+                        help="Steepness of the logistic curve (default: %(default)s)")
+    parser.add_argument('--x0', type=float, default=DEFAULT_X0,
+                        help="Midpoint of the logistic curve (default: %(default)s)")
+    return parser.parse_args(argv)
+
+def main():
+    args = parse_arguments()
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    con = connect(temp_directory=os.path.join(args.output_dir, 'duckdb_tmp'))
+    load_table(con, args.students, 'students')
+    main_table, small_table = run_grouping_pipeline(con)
+    add_semester_limits(con, main_table, args.semester_limits)
+    add_semester_limits(con, small_table, args.semester_limits)
+    recipients_table = calculate_scholarship_amounts(
+        con, select_recipients(con, main_table, {}, args.percentage), args.max_amount, args.min_amount, args.k,
+        args.x0)
+    for name in [main_table, small_table, recipients_table]:
+        con.execute(f"COPY {name} TO '{os.path.join(args.output_dir, name + '.parquet')}' (FORMAT PARQUET)")
+        print(f"{name}: {con.execute(f'SELECT count(*) FROM {name}').fetchone()[0]} rows")
+
+if __name__ == "__main__":
+    main()
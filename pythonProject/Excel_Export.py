@@ -0,0 +1,119 @@
+import io
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import pandas as pd
+
+# Az Excel exportok külön modulban vannak, mert a Streamlit az oldalakat __main__ modulként futtatja: a párhuzamos
+# export folyamatok (ProcessPoolExecutor) csak egy rendesen importálható modul függvényeit tudják meghívni.
+# Az openpyxl csak az első exportnál töltődik be, így a modul importja nem lassítja az oldalak indulását.
+
+# Csak hogy könnyebben megkülönböztethetőek legyen a csoportok az output excelben, színezi a sorokat
+def apply_alternate_row_coloring(writer, df, sheet_name, progress=None):
+    from openpyxl.styles import PatternFill
+
+    workbook = writer.book
+    worksheet = writer.sheets[sheet_name]
+    grouping_columns = ['KépzésNév', 'Képzési szint', 'Nyelv ID', 'Évfolyam']
+    group_ids = df[grouping_columns[0]].astype(str)
+    for col in grouping_columns[1:]:
+        group_ids = group_ids + ' | ' + df[col].astype(str)
+    last_row = df.shape[0] + 1
+    last_col = df.shape[1]
+
+    fill_colors = ['FFFFFF', 'D3D3D3']
+    current_fill = 0
+    previous_group = None
+    red_fill = PatternFill(start_color='FF0000', end_color='FF0000', fill_type='solid')
+
+    for row in range(2, last_row + 1):
+        group_id = group_ids.iloc[row - 2]
+        exceed_limit = df.iloc[row - 2]['Exceed Limit'] if 'Exceed Limit' in df.columns else False
+
+        if exceed_limit:
+            for col in range(1, last_col + 1):
+                cell = worksheet.cell(row=row, column=col)
+                cell.fill = red_fill
+        else:
+            if group_id != previous_group:
+                current_fill = (current_fill + 1) % len(fill_colors)
+                previous_group = group_id
+
+            fill = PatternFill(start_color=fill_colors[current_fill], end_color=fill_colors[current_fill],
+                               fill_type='solid')
+            for col in range(1, last_col + 1):
+                cell = worksheet.cell(row=row, column=col)
+                cell.fill = fill
+
+        if progress is not None and (row % 1000 == 0 or row == last_row):
+            progress((row - 1) / (last_row - 1))
+
+# Egy munkafüzet megírása, minden lap színezve. A kész fájl tartalmát adja vissza (bytes), mert az a folyamatok
+# között olcsón átküldhető.
+def write_workbook(sheets, progress=None):
+    """Megír egy Excel munkafüzetet a megadott lapokkal.
+
+        Args:
+            sheets (list): (lapnév, DataFrame) párok listája.
+            progress (callable, optional): A színezés állapota (0-1), lapról lapra újrakezdve.
+
+        Returns:
+            bytes: Az xlsx fájl tartalma.
+    """
+    buffer = io.BytesIO()
+    with pd.ExcelWriter(buffer, engine='openpyxl') as writer:
+        for sheet_name, data in sheets:
+            data.to_excel(writer, index=False, sheet_name=sheet_name)
+            apply_alternate_row_coloring(writer, data, sheet_name, progress)
+    return buffer.getvalue()
+
+### Export ütemező: a független munkafüzeteket párhuzamosan írja, a legnagyobbal kezdve, így a teljes idő a
+# legnagyobb fájl ideje, nem az összegük.
+def export_workbooks(workbooks, executor=None, progress=None):
+    """Megírja a megadott munkafüzeteket, executor megadásakor párhuzamosan.
+
+        Args:
+            workbooks (dict): {név: [(lapnév, DataFrame), ...]} szótár.
+            executor (Executor, optional): Pl. ProcessPoolExecutor; ha nincs megadva, sorban készülnek.
+            progress (callable, optional): progress(név, arány) alakban hívva. Folyamatok esetén csak a kész
+                munkafüzeteknél (1.0), mert a hívás nem küldhető át a folyamatok között.
+
+        Returns:
+            dict: {név: io.BytesIO} a kész fájlokkal.
+    """
+    if executor is None:
+        return {name: io.BytesIO(write_workbook(sheets, (lambda fraction, name=name: progress(name, fraction))
+                                                if progress else None))
+                for name, sheets in workbooks.items()}
+
+    by_size = sorted(workbooks, key=lambda name: sum(data.size for _, data in workbooks[name]), reverse=True)
+    futures = {}
+    for name in by_size:
+        future = executor.submit(write_workbook, workbooks[name])
+        if progress is not None:
+            future.add_done_callback(lambda _, name=name: progress(name, 1.0))
+        futures[name] = future
+    return {name: io.BytesIO(futures[name].result()) for name in workbooks}
+
+# Bemelegítéshez: betölti az export által használt modulokat az adott folyamatban (szálban), hogy az első exportnak
+# már ne kelljen rájuk várnia
+def preload():
+    import openpyxl.styles
+    import xlsxwriter
+
+# Az egész alkalmazásra közös végrehajtók: szálak a futásoknak, külön folyamatok az Excel exportoknak (az openpyxl
+# színezés tiszta Python, szálakon a GIL miatt nem gyorsulna). A 'spawn' azért kell, mert a Streamlit szerver
+# több szálon fut, és egy ilyen folyamat fork-olása nem biztonságos. Itt, egy rendesen importálható modulban vannak,
+# mert a Streamlit oldalak __main__ modulként futnak: egy oldalon lévő cache_resource függvény más kulcsot kapna a
+# főmenü bemelegítésében, mint az oldalon, és két külön készlet indulna. A streamlit importja helyett egyszerű
+# modulszintű tár, hogy az export folyamatoknak ne kelljen betölteniük.
+_executors = []
+_executors_lock = threading.Lock()
+
+def get_executors():
+    with _executors_lock:
+        if not _executors:
+            _executors.extend([ThreadPoolExecutor(max_workers=4),
+                               ProcessPoolExecutor(max_workers=2, mp_context=multiprocessing.get_context('spawn'))])
+        return tuple(_executors)
@@ -1,7 +1,13 @@
 import pandas as pd
-from openpyxl.styles import PatternFill
 import streamlit as st
-import io
+import hashlib
+from Excel_Export import export_workbooks, get_executors
+from Profiling import profiling_toggle, run_profiled, show_profile
+
+# Copy-on-write: a függvények soha nem módosítják a paraméterként kapott DataFrame-et, mindig új DataFrame-et adnak
+# vissza (oszlop hozzáadás előtt data.copy(deep=False)). Így a szeleteket sem kell előre lemásolni, az oszlopok csak
+# akkor másolódnak, amikor tényleg írunk beléjük.
+pd.set_option('mode.copy_on_write', True)
 
 @st.cache_data
 
@@ -38,11 +44,12 @@ def check_duplicate_neptun_codes(data):
 
 ### Folytatása az előző functionnek, ha talált többször szereplő neptun kódot, akkor kitörli azt a sort amiben a
 ### hallgatónak alacsonyabb KÖDI értéke van.
-def remove_lower_kodi_duplicates(data):
+def remove_lower_kodi_duplicates(data, count_index=None):
     """Eltávolítja az alacsonyabb KÖDI értékkel rendelkező duplikált Neptun kódokat.
 
         Args:
             data (pd.DataFrame): A hallgatók adatait tartalmazó DataFrame.
+            count_index (dict, optional): A létszám index, amelyből a törölt sorokat levonja.
 
         Returns:
             pd.DataFrame: A DataFrame a duplikált bejegyzések eltávolítása után.
@@ -50,19 +57,63 @@ def remove_lower_kodi_duplicates(data):
     duplicated = data[data.duplicated(subset=['Neptun kód'], keep=False)]
     if not duplicated.empty:
         print("Removing lower KÖDI entries for duplicate Neptun kód:")
+        dropped_indices = []
         for neptun_code in duplicated['Neptun kód'].unique():
-            student_rows = data[data['Neptun kód'] == neptun_code]
+            student_rows = duplicated[duplicated['Neptun kód'] == neptun_code]
             max_kodi_index = student_rows['KÖDI'].idxmax()
             indices_to_drop = student_rows.index.difference([max_kodi_index])
-            data = data.drop(indices_to_drop)
+            dropped_indices.extend(indices_to_drop)
             print(f"Neptun kód {neptun_code}: Kept index {max_kodi_index}, dropped indices {list(indices_to_drop)}")
+        if count_index is not None:
+            remove_from_count_index(count_index, data.loc[dropped_indices])
+        data = data.drop(dropped_indices)
     else:
         print("No duplicate Neptun kód found after KÖDI calculation.")
     return data.reset_index(drop=True)
 
+### Félévszám limit index: KépzésKód -> Félévszám. A limit fájlból egyszer épül fel (a fájllal együtt cache-elve), így
+# nem kell a teljes limit táblát (a tucatnyi felesleges oszlopával) minden adathoz hozzá merge-elni.
+def build_semester_limit_index(semester_limits):
+    """Felépíti a képzéskód szerinti félévszám limit indexet.
+
+        Args:
+            semester_limits (pd.DataFrame): A félévszám limiteket tartalmazó DataFrame.
+
+        Returns:
+            pd.Series: A félévszám limitek 'Képzéskód' szerint indexelve (duplikált kódnál az első sor számít).
+    """
+    return semester_limits.drop_duplicates(subset=['Képzéskód']).set_index('Képzéskód')['Félévszám']
+
+@st.cache_data
+def load_semester_limit_index(file_path):
+    return build_semester_limit_index(pd.read_excel(file_path))
+
 ### Ellenőrzi hogy van-e olyan hallgató aki túllépte a jogosultsági időszakot a képzés típusa alapján
 # (alap, mester, osztatlan) és hozzá ad 1-et az alaphoz és mesterhez, és 2-t az osztatlanhoz.
-def highlight_exceeded_semesters(main_data, small_groups_data, semester_limits):
+# Tetszőleges számú DataFrame-re egy-egy indexes kereséssel (map) számol. Az ismeretlen képzéskódokat az
+# 'Unknown Program Code' oszlop jelzi, mert a hiányzó limit (NaN) összehasonlítva sosem számítana túllépésnek.
+def resolve_semester_limits(frames, semester_limit_index):
+    """Kiszámolja az 'Adjusted Félévszám' és 'Exceed Limit' oszlopokat a megadott DataFrame-ekre.
+
+        Args:
+            frames (list): A hallgatói adatokat tartalmazó DataFrame-ek.
+            semester_limit_index (pd.Series): A build_semester_limit_index által felépített index.
+
+        Returns:
+            list: Az új oszlopokkal kiegészített DataFrame-ek, a bemenettel azonos sorrendben.
+    """
+    resolved = []
+    for frame in frames:
+        frame = frame.copy(deep=False)
+        semester_limit = frame['KépzésKód'].map(semester_limit_index)
+        frame['Adjusted Félévszám'] = semester_limit + frame['Képzési szint'].map(
+            {'alapképzés (BA/BSc/BProf)': 1, 'mesterképzés (MA/MSc)': 1, 'egységes, osztatlan képzés': 2}).fillna(0)
+        frame['Exceed Limit'] = frame['Aktív félévek'] > frame['Adjusted Félévszám']
+        frame['Unknown Program Code'] = semester_limit.isna()
+        resolved.append(frame)
+    return resolved
+
+def highlight_exceeded_semesters(main_data, small_groups_data, semester_limit_index):
     """Kiemeli azokat a hallgatókat, akik túllépték a jogosultsági időszakot.
 
         A képzés típusa alapján (alap, mester, osztatlan) hozzáad 1-et az alap- és mesterképzéshez,
@@ -71,66 +122,117 @@ def highlight_exceeded_semesters(main_data, small_groups_data, semester_limits):
         Args:
             main_data (pd.DataFrame): A fő adatokat tartalmazó DataFrame.
             small_groups_data (pd.DataFrame): A kiscsoportok adatait tartalmazó DataFrame.
-            semester_limits (pd.DataFrame): A félévszám limiteket tartalmazó DataFrame.
+            semester_limit_index (pd.Series): A build_semester_limit_index által felépített index.
 
         Returns:
             tuple: A módosított main_data és small_groups_data DataFrame-ek.
     """
-    main_data = pd.merge(main_data, semester_limits, how='left', left_on='KépzésKód', right_on='Képzéskód')
-    small_groups_data = pd.merge(small_groups_data, semester_limits, how='left', left_on='KépzésKód', right_on='Képzéskód')
+    main_data, small_groups_data = resolve_semester_limits([main_data, small_groups_data], semester_limit_index)
+    # A korábbi merge-ös változathoz hasonlóan új, 0-tól számozott indexszel adja vissza
+    return main_data.reset_index(drop=True), small_groups_data.reset_index(drop=True)
+
+# Csoport azonosító szöveg ('KépzésNév | Képzési szint | Nyelv ID | Évfolyam') oszloponként összefűzve, soronkénti
+# apply nélkül
+def group_id_strings(data, grouping_columns):
+    group_ids = data[grouping_columns[0]].astype(str)
+    for col in grouping_columns[1:]:
+        group_ids = group_ids + ' | ' + data[col].astype(str)
+    return group_ids
+
+# Szakonkénti kulcs, hogy ne kelljen minden összehasonlításhoz három oszlopra merge-elni
+def program_key(data):
+    return group_id_strings(data, ['KépzésNév', 'Képzési szint', 'Nyelv ID'])
+
+### Létszám index: szakonként (KépzésNév | Képzési szint | Nyelv ID) az évfolyamonkénti létszám, a félévszámokból
+# számolt eredeti évfolyam szerint. Egyszer épül fel, a szűrés, a csoportosítás és az összevonás ebből olvas, a
+# duplikátumok törlésekor pedig csak a törölt sorokat vonjuk le belőle, így egyik lépésnek sem kell újraszámolnia.
+# Az évfolyam nélküli sorok (a félévszám üres vagy 1-14-en kívül esik) a None kulcson vannak: az évfolyamok
+# összevonásában nem vesznek részt, de a szak összlétszámába az eredeti szűréshez hasonlóan beleszámítanak.
+def build_count_index(data):
+    """Felépíti a szakonkénti és évfolyamonkénti létszám indexet.
 
-    main_data['Adjusted Félévszám'] = main_data['Félévszám'] + main_data['Képzési szint_x'].map(
-        {'alapképzés (BA/BSc/BProf)': 1, 'mesterképzés (MA/MSc)': 1, 'egységes, osztatlan képzés': 2}).fillna(0)
-    small_groups_data['Adjusted Félévszám'] = small_groups_data['Félévszám'] + small_groups_data['Képzési szint_x'].map(
-        {'alapképzés (BA/BSc/BProf)': 1, 'mesterképzés (MA/MSc)': 1, 'egységes, osztatlan képzés': 2}).fillna(0)
-
-    main_data['Exceed Limit'] = main_data['Aktív félévek'] > main_data['Adjusted Félévszám']
-    small_groups_data['Exceed Limit'] = small_groups_data['Aktív félévek'] > small_groups_data['Adjusted Félévszám']
+        Args:
+            data (pd.DataFrame): A hallgatók adatait tartalmazó DataFrame.
 
-    columns_to_drop = ['Képzéskód', 'Félévszám', 'Képzés neve', 'Képzési szint_y', 'Tagozat_y', 'FIR-be felad', 'Nyelv', 'Szükséges kredit',
-                       'Létrehozás ideje', 'Utolsó módosítás ideje', 'Létrehozó', 'Utolsó módosító', 'Archivált',
-                       'Szervezeti egység kódja']
-    main_data = main_data.drop(columns=[col for col in columns_to_drop if col in main_data.columns])
-    small_groups_data = small_groups_data.drop(
-        columns=[col for col in columns_to_drop if col in small_groups_data.columns])
+        Returns:
+            dict: {szak kulcs: {évfolyam: létszám}} szótár, az évfolyam nélküli sorok a None kulcson.
+    """
+    bins = [0, 2, 4, 6, 8, 10, 12, 14]
+    labels = ['1. éves', '2. éves', '3. éves', '4. éves', '5. éves', '6. éves', '7. éves']
+    program_columns = ['KépzésNév', 'Képzési szint', 'Nyelv ID']
+    years = pd.cut(data['Aktív félévek'], bins=bins, labels=labels, right=True).rename('Évfolyam')
+    counts = data.groupby(program_columns + [years], observed=True).size()
+
+    count_index = {}
+    for (name, level, language, year), count in counts.items():
+        count_index.setdefault(f'{name} | {level} | {language}', {})[year] = int(count)
+    for (name, level, language), total in data.groupby(program_columns).size().items():
+        year_counts = count_index.setdefault(f'{name} | {level} | {language}', {})
+        without_year = int(total) - sum(year_counts.values())
+        if without_year:
+            year_counts[None] = without_year
+    return count_index
+
+# Törölt hallgatók levonása az indexből
+def remove_from_count_index(count_index, removed_data):
+    bins = [0, 2, 4, 6, 8, 10, 12, 14]
+    labels = ['1. éves', '2. éves', '3. éves', '4. éves', '5. éves', '6. éves', '7. éves']
+    years = pd.cut(removed_data['Aktív félévek'], bins=bins, labels=labels, right=True)
+    for program, year in zip(program_key(removed_data), years.astype(object).where(years.notna(), None)):
+        program_counts = count_index.get(program, {})
+        if year in program_counts:
+            program_counts[year] -= 1
 
-    return main_data, small_groups_data
+# Szakonkénti összlétszám az indexből
+def program_totals(count_index):
+    return {program: sum(year_counts.values()) for program, year_counts in count_index.items()}
 
 ### Itt először csak átírja a félévszámokból szöveges labelre, és rendezi őket 4 tagú kulcs szerint
-def group_students(data):
+def group_students(data, count_index=None):
     """Csoportosítja a hallgatókat évfolyam szerint.
 
     Args:
         data (pd.DataFrame): A hallgatók adatait tartalmazó DataFrame.
+        count_index (dict, optional): A build_count_index által felépített létszám index.
 
     Returns:
         tuple: A csoportosított adatokat és az eredeti adatokat tartalmazó tuple.
     """
     bins = [0, 2, 4, 6, 8, 10, 12, 14]
     labels = ['1. éves', '2. éves', '3. éves', '4. éves', '5. éves', '6. éves', '7. éves']
+    data = data.copy(deep=False)
     data['Évfolyam'] = pd.cut(data['Aktív félévek'], bins=bins, labels=labels, right=True)
 
     grouping_columns = ['KépzésNév', 'Képzési szint', 'Nyelv ID', 'Évfolyam']
-    grouped = data.groupby(grouping_columns, observed=True).size().reset_index(name='Létszám')
+    if count_index is None:
+        grouped = data.groupby(grouping_columns, observed=True).size().reset_index(name='Létszám')
+    else:
+        # Ugyanaz a tábla, mint a groupby-jal: a szakok oszlopértékei a bemenetből, a létszámok az indexből
+        programs = data[grouping_columns[:3]].drop_duplicates()
+        grouped = pd.DataFrame(
+            [(*values, year, count) for values, program in zip(programs.itertuples(index=False), program_key(programs))
+             for year, count in count_index.get(program, {}).items() if year is not None and count > 0],
+            columns=grouping_columns + ['Létszám'])
+        grouped['Évfolyam'] = pd.Categorical(grouped['Évfolyam'], categories=labels, ordered=True)
+        grouped = grouped.sort_values(grouping_columns, ignore_index=True)
     return grouped, data
 
 # Azokon a szakokon ahol nincsen meg összesen a 10 fő, a hallgatókat egy külön excelbe rakja, small_groups.xlsx
-def filter_small_groups(data):
+def filter_small_groups(data, count_index=None):
     """Kiszűri azokat a hallgatókat, akik kiscsoportba tartoznak (kevesebb mint 10 fő a szakon).
 
         Args:
             data (pd.DataFrame): A hallgatók adatait tartalmazó DataFrame.
+            count_index (dict, optional): A build_count_index által felépített létszám index.
 
         Returns:
             tuple: A maradék adatokat és a kiscsoportok adatait tartalmazó tuple.
     """
-    grouping_columns = ['KépzésNév', 'Képzési szint', 'Nyelv ID']
-    course_counts = data.groupby(grouping_columns).size().reset_index(name='Total_in_Course')
-    data = data.merge(course_counts, on=grouping_columns)
-    small_groups = data[data['Total_in_Course'] < 10]
-    remaining_data = data[data['Total_in_Course'] >= 10]
-    small_groups = small_groups.drop(columns=['Total_in_Course'])
-    remaining_data = remaining_data.drop(columns=['Total_in_Course'])
+    if count_index is None:
+        count_index = build_count_index(data)
+    total_in_course = program_key(data).map(program_totals(count_index))
+    small_groups = data[total_in_course < 10].reset_index(drop=True)
+    remaining_data = data[total_in_course >= 10].reset_index(drop=True)
     return remaining_data, small_groups
 
 ### Ez a main logic, jó hosszú és itt történik a legfontosabb dolog, a hallgatók szak szerinti és évfolyam szerinti
@@ -140,101 +242,105 @@ def filter_small_groups(data):
 # Feltételes helyzet, (db hallgató)       12            0           6           51
 # Rendezés után:                          18            0           0           51
 
-def group_students_by_year(data):
-    """Csoportosítja a hallgatókat évfolyam szerint, biztosítva, hogy minden csoport legalább 10 fős legyen.
+def plan_year_merges(year_counts):
+    """Kiszámolja egy szak évfolyamainak összevonását az évfolyamonkénti létszámokból.
+
+        Az összevonás csak a létszámoktól függ, ezért a hallgatói sorok nélkül, a (szakonként legfeljebb 7 elemű)
+        létszám listán fut; a pandas és a DuckDB-s feldolgozás is ezt használja.
 
         Args:
-            data (pd.DataFrame): A hallgatók adatait tartalmazó DataFrame.
+            year_counts (pd.Series): Évfolyamonkénti létszám évfolyam szerint rendezve, a 0 fős évfolyamokkal együtt.
 
         Returns:
-            pd.DataFrame: A módosított DataFrame az összevont évfolyamokkal.
+            dict: {évfolyam: cél évfolyam} az összevont évfolyamokra. Láncolt összevonásnál (A -> B, majd B -> C)
+            a végső cél szerepel (A -> C).
     """
-    modified_data = data.copy()
-    grouping_columns = ['KépzésNév', 'Képzési szint', 'Nyelv ID']
+    # [évfolyam, létszám] párok listán, mert szakonként csak néhány elem van, és így nincs DataFrame indexelés
+    year_rows = sorted([year, count] for year, count in zip(year_counts.index, year_counts.values))
 
-    unique_programs = modified_data[grouping_columns].drop_duplicates()
+    year_order = {year: idx for idx, (year, _) in enumerate(year_rows)}
 
-    for _, program in unique_programs.iterrows():
-        program_mask = (
-            (modified_data['KépzésNév'] == program['KépzésNév']) &
-            (modified_data['Képzési szint'] == program['Képzési szint']) &
-            (modified_data['Nyelv ID'] == program['Nyelv ID'])
-        )
-        program_data = modified_data[program_mask].copy()
+    year_to_group = {year: year for year, _ in year_rows}
 
-        year_counts = program_data['Évfolyam'].value_counts().sort_index()
-        years = list(year_counts.index)
-        counts = list(year_counts.values)
+    merged_years = set()
 
-        year_df = pd.DataFrame({'Évfolyam': years, 'Létszám': counts})
-        year_df.sort_values('Évfolyam', inplace=True)
-        year_df.reset_index(drop=True, inplace=True)
+    idx = 0
+    while idx < len(year_rows):
+        current_year, current_count = year_rows[idx]
 
-        year_order = {label: idx for idx, label in enumerate(year_df['Évfolyam'])}
+        if current_count >= 10:
+            idx += 1
+            continue
 
-        year_to_group = {year: year for year in year_df['Évfolyam']}
+        candidates = []
+        if idx > 0:
+            candidates.append(idx - 1)
+        if idx + 1 < len(year_rows):
+            candidates.append(idx + 1)
 
-        merged_years = set()
+        if not candidates:
+            idx += 1
+            continue
 
-        idx = 0
-        while idx < len(year_df):
-            current_year = year_df.loc[idx, 'Évfolyam']
-            current_count = year_df.loc[idx, 'Létszám']
-
-            if current_count >= 10:
-                idx += 1
-                continue
+        min_count = min(year_rows[c][1] for c in candidates)
+        min_candidates = [c for c in candidates if year_rows[c][1] == min_count]
 
-            prev_idx = idx - 1 if idx > 0 else None
-            next_idx = idx + 1 if idx + 1 < len(year_df) else None
+        # Egyenlő létszámnál a magasabb évfolyamba kerül
+        merge_idx = max(min_candidates, key=lambda c: year_order[year_rows[c][0]])
+        merge_year = year_rows[merge_idx][0]
 
-            candidates = []
-            if prev_idx is not None:
-                prev_year = year_df.loc[prev_idx, 'Évfolyam']
-                prev_count = year_df.loc[prev_idx, 'Létszám']
-                candidates.append({'idx': prev_idx, 'year': prev_year, 'count': prev_count})
-            if next_idx is not None:
-                next_year = year_df.loc[next_idx, 'Évfolyam']
-                next_count = year_df.loc[next_idx, 'Létszám']
-                candidates.append({'idx': next_idx, 'year': next_year, 'count': next_count})
+        year_rows[merge_idx][1] += current_count
+        year_rows[idx][1] = 0
 
-            if not candidates:
-                idx += 1
-                continue
+        year_to_group[current_year] = year_to_group[merge_year]
 
-            min_count = min(c['count'] for c in candidates)
-            min_candidates = [c for c in candidates if c['count'] == min_count]
+        merged_years.add(current_year)
+        year_rows = [row for row in year_rows if row[1] > 0]
+        idx = 0
 
-            if len(min_candidates) > 1:
-                merge_candidate = max(min_candidates, key=lambda c: year_order[c['year']])
-            else:
-                merge_candidate = min_candidates[0]
+    # Egy már összevont évfolyam is beolvadhat később egy harmadikba, ilyenkor a hallgatói vele együtt mennek tovább
+    year_mapping = {}
+    for merged_year in merged_years:
+        target_group = year_to_group[merged_year]
+        while target_group in merged_years:
+            target_group = year_to_group[target_group]
+        year_mapping[merged_year] = target_group
+    return year_mapping
 
-            merge_idx = merge_candidate['idx']
-            merge_year = merge_candidate['year']
+def group_students_by_year(data, count_index=None, progress=None):
+    """Csoportosítja a hallgatókat évfolyam szerint, biztosítva, hogy minden csoport legalább 10 fős legyen.
 
-            year_df.loc[merge_idx, 'Létszám'] += current_count
-            year_df.loc[idx, 'Létszám'] = 0
+        Args:
+            data (pd.DataFrame): A hallgatók adatait tartalmazó DataFrame.
+            count_index (dict, optional): A build_count_index által felépített létszám index; ha meg van adva,
+                az évfolyam létszámokat innen olvassa ahelyett, hogy szakonként újraszámolná őket.
+            progress (callable, optional): Minden szak után meghívva a feldolgozott arány (0-1) értékével.
 
-            target_group = year_to_group[merge_year]
-            year_to_group[current_year] = target_group
+        Returns:
+            pd.DataFrame: A módosított DataFrame az összevont évfolyamokkal.
+    """
+    modified_data = data.copy(deep=False)
+    program_keys = program_key(modified_data)
+    unique_programs = program_keys.unique()
 
-            modified_data.loc[
-                program_mask & (modified_data['Évfolyam'] == current_year),
-                'Évfolyam'
-            ] = target_group
+    for program_number, program in enumerate(unique_programs, start=1):
+        program_mask = program_keys == program
 
-            merged_years.add(current_year)
-            year_df = year_df[year_df['Létszám'] > 0].reset_index(drop=True)
-            idx = 0
+        if count_index is None:
+            year_counts = modified_data.loc[program_mask, 'Évfolyam'].value_counts().sort_index()
+        else:
+            labels = modified_data['Évfolyam'].cat.categories
+            year_counts = pd.Series(count_index.get(program, {}), dtype='int64').reindex(labels, fill_value=0)
 
-        for merged_year in merged_years:
-            target_group = year_to_group[merged_year]
+        for year, target_group in plan_year_merges(year_counts).items():
             modified_data.loc[
-                program_mask & (modified_data['Évfolyam'] == merged_year),
+                program_mask & (modified_data['Évfolyam'] == year),
                 'Évfolyam'
             ] = target_group
 
+        if progress is not None:
+            progress(program_number / len(unique_programs))
+
     return modified_data
 
 # Ösztöndíjindex kiszámolása
@@ -247,7 +353,8 @@ def calculate_scholarship_index(data):
         Returns:
             pd.DataFrame: A DataFrame a kiszámolt ösztöndíjindexszel.
         """
-    data['Kredit szám'] = data['ElőzőFélévTeljesítettKredit'].apply(lambda x: min(x, 42))
+    data = data.copy(deep=False)
+    data['Kredit szám'] = data['ElőzőFélévTeljesítettKredit'].clip(upper=42)
     data['Ösztöndíjindex'] = data['Ösztöndíj átlag előző félév'] + ((data['Kredit szám'] / 27) - 1) / 2
 
     nan_rows = data[data['Ösztöndíjindex'].isna()]
@@ -265,59 +372,20 @@ def recalculate_year_for_small_groups(data):
         """
     bins = [0, 2, 4, 6, 8, 10, 12, 14]
     labels = ['1. éves', '2. éves', '3. éves', '4. éves', '5. éves', '6. éves', '7. éves']
+    data = data.copy(deep=False)
     data['Évfolyam'] = pd.cut(data['Aktív félévek'], bins=bins, labels=labels, right=True)
     return data
-# Excel mentése
-def save_to_excel(main_data, separate_data):
-    main_buffer = io.BytesIO()
-    with pd.ExcelWriter(main_buffer, engine='openpyxl') as writer:
-        main_data.to_excel(writer, index=False, sheet_name='MainData')
-        apply_alternate_row_coloring(writer, main_data, 'MainData')
-    main_buffer.seek(0)
-
-
-    separate_buffer = io.BytesIO()
-    with pd.ExcelWriter(separate_buffer, engine='openpyxl') as writer:
-        separate_data.to_excel(writer, index=False, sheet_name='SeparateData')
-        apply_alternate_row_coloring(writer, separate_data, 'SeparateData')
-    separate_buffer.seek(0)
-
-    return main_buffer, separate_buffer
-
-# Csak hogy könnyebben megkülönböztethetőek legyen a csoportok az output excelben, színezi a sorokat
-def apply_alternate_row_coloring(writer, df, sheet_name):
-    workbook = writer.book
-    worksheet = writer.sheets[sheet_name]
-    grouping_columns = ['KépzésNév', 'Képzési szint_x', 'Nyelv ID', 'Évfolyam']
-    df['TempGroupID'] = df[grouping_columns].apply(lambda x: ' | '.join(x.astype(str)), axis=1)
-    last_row = df.shape[0] + 1
-    last_col = df.shape[1]
-
-    fill_colors = ['FFFFFF', 'D3D3D3']
-    current_fill = 0
-    previous_group = None
-    red_fill = PatternFill(start_color='FF0000', end_color='FF0000', fill_type='solid')
-
-    for row in range(2, last_row + 1):
-        group_id = df.iloc[row - 2]['TempGroupID']
-        exceed_limit = df.iloc[row - 2]['Exceed Limit'] if 'Exceed Limit' in df.columns else False
-
-        if exceed_limit:
-            for col in range(1, last_col + 1):
-                cell = worksheet.cell(row=row, column=col)
-                cell.fill = red_fill
-        else:
-            if group_id != previous_group:
-                current_fill = (current_fill + 1) % len(fill_colors)
-                previous_group = group_id
-
-            fill = PatternFill(start_color=fill_colors[current_fill], end_color=fill_colors[current_fill],
-                               fill_type='solid')
-            for col in range(1, last_col + 1):
-                cell = worksheet.cell(row=row, column=col)
-                cell.fill = fill
-
-    df.drop(columns=['TempGroupID'], inplace=True)
+# Excel mentése. A két fájl független egymástól, executor megadásakor párhuzamosan készülnek.
+def save_to_excel(main_data, separate_data, executor=None, progress=None):
+    buffers = export_workbooks({'Main data Excel': [('MainData', main_data)],
+                                'Small groups Excel': [('SeparateData', separate_data)]}, executor, progress)
+    return buffers['Main data Excel'], buffers['Small groups Excel']
+
+# Választható mód: egyetlen munkafüzet mindkét lappal
+def save_to_single_excel(main_data, separate_data, progress=None):
+    buffers = export_workbooks({'Main data Excel': [('MainData', main_data), ('SeparateData', separate_data)]},
+                               progress=progress)
+    return buffers['Main data Excel']
 
 # Beszámozza a csoportokat
 def add_group_index(data):
@@ -330,9 +398,9 @@ def add_group_index(data):
             pd.DataFrame: A DataFrame a hozzáadott csoportindexszel.
         """
     grouping_columns = ['KépzésNév', 'Képzési szint', 'Nyelv ID', 'Évfolyam']
-    data['GroupID'] = data[grouping_columns].apply(lambda x: ' | '.join(x.astype(str)), axis=1)
-    data['GroupIndex'] = (data['GroupID'] != data['GroupID'].shift()).cumsum()
-    data.drop(columns=['GroupID'], inplace=True)
+    group_ids = group_id_strings(data, grouping_columns)
+    data = data.copy(deep=False)
+    data['GroupIndex'] = (group_ids != group_ids.shift()).cumsum()
     cols = data.columns.tolist()
     cols.insert(0, cols.pop(cols.index('GroupIndex')))
     data = data[cols]
@@ -342,6 +410,12 @@ def add_group_index(data):
 def sort_data(data):
     data = data.sort_values(by=['KépzésNév', 'Képzési szint', 'Nyelv ID', 'Évfolyam', 'Aktív félévek'], ascending=True)
     return data
+# Hiányzó évfolyamnál (az 'Aktív félévek' üres vagy 1-14-en kívül esik) vagy hiányzó ösztöndíjindexnél a KÖDI nem
+# számolható. Az első kiadás ilyenkor kivétellel állt meg; az ilyen sor nem kerülhet NaN KÖDI-vel a kimenetbe.
+def missing_kodi_error(neptun_codes):
+    return ValueError(f"KÖDI cannot be calculated for {len(neptun_codes)} students with a missing Évfolyam ('Aktív "
+                      f"félévek' must be between 1 and 14) or Ösztöndíjindex: {', '.join(map(str, neptun_codes))}")
+
 # KÖDI számolás, minden csoportban a max Ösztöndíjindex kap egy 100-as értéket, a legalacsonyabb pedig 0-t.
 # És a csoport többi tagja hozzájuk aránylik.
 def calculate_kodi(data):
@@ -355,6 +429,9 @@ def calculate_kodi(data):
 
         Returns:
             pd.DataFrame: A DataFrame a kiszámolt KÖDI értékekkel.
+
+        Raises:
+            ValueError: Ha egy hallgató KÖDI-je nem számolható (hiányzó évfolyam vagy ösztöndíjindex).
         """
     grouping_columns = ['KépzésNév', 'Képzési szint', 'Nyelv ID', 'Évfolyam']
     print("Unique values per grouping column:")
@@ -365,62 +442,60 @@ def calculate_kodi(data):
     print(data[data[grouping_columns].isna().any(axis=1)])
     grouped = data.groupby(grouping_columns, observed=True)
 
-    data['MinÖDI'] = grouped['Ösztöndíjindex'].transform('min')
-    data['MaxÖDI'] = grouped['Ösztöndíjindex'].transform('max')
-
-    def calculate_group_kodi(row):
-        if row['MaxÖDI'] == row['MinÖDI']:
-            return 100
-        else:
-            kodi = ((row['Ösztöndíjindex'] - row['MinÖDI']) / (row['MaxÖDI'] - row['MinÖDI'])) * 100
-            return round(kodi)
-
-    data['KÖDI'] = data.apply(calculate_group_kodi, axis=1)
+    # Oszloponként számolva, soronkénti apply nélkül (az minden sorhoz külön Series-t épített)
+    min_odi = grouped['Ösztöndíjindex'].transform('min')
+    max_odi = grouped['Ösztöndíjindex'].transform('max')
 
-    max_odi_mask = data['Ösztöndíjindex'] == data['MaxÖDI']
-    data.loc[max_odi_mask, 'KÖDI'] = 100
+    kodi = (((data['Ösztöndíjindex'] - min_odi) / (max_odi - min_odi)) * 100).round()
+    kodi = kodi.mask(max_odi == min_odi, 100)
 
-    min_odi_mask = data['Ösztöndíjindex'] == data['MinÖDI']
-    data.loc[min_odi_mask, 'KÖDI'] = 0
+    max_odi_mask = data['Ösztöndíjindex'] == max_odi
+    kodi = kodi.mask(max_odi_mask, 100)
 
-    data.drop(columns=['MinÖDI', 'MaxÖDI'], inplace=True)
+    min_odi_mask = data['Ösztöndíjindex'] == min_odi
+    kodi = kodi.mask(min_odi_mask, 0)
 
+    if kodi.isna().any():
+        raise missing_kodi_error(data.loc[kodi.isna(), 'Neptun kód'].tolist())
+    data = data.copy(deep=False)
+    data['KÖDI'] = kodi.astype('int64')
     return data
 
 
+### A teljes csoportosítási folyamat: szűrés, évfolyamok összevonása, KÖDI, duplikátumok, majd mindez újra
+def run_grouping_pipeline(data, progress=None):
+    """Lefuttatja a teljes csoportosítást és KÖDI számítást a feltöltött adatokon.
 
+        Args:
+            data (pd.DataFrame): A hallgatók adatait tartalmazó DataFrame.
+            progress (callable, optional): progress(szakasz, arány) alakban hívva a STEP1_STAGES szakaszaival.
 
-### Streamlit és függvények meghívása
-
-def main():
-    st.title("Student Grouping")
-    st.subheader("Upload an input file where 3,8 and 23 are filtered")
-    uploaded_file = st.file_uploader("Choose an Excel file", type="xlsx", key="main_file_upload")
-
-    st.subheader("Upload max number of semesters file")
-    uploaded_file2 = st.file_uploader("Choose an Excel file", type="xlsx", key="semester_limit_file_upload")
-
-
-    if uploaded_file is not None and uploaded_file2 is not None:
-        data = load_data(uploaded_file)
-        semester_limits = load_data(uploaded_file2)
-    else:
-        st.stop()
+        Returns:
+            tuple: A rendezett, csoportindexszel ellátott fő adatok és kiscsoport adatok
+            (a félévszám limitek hozzáadása előtt).
+    """
+    if progress is None:
+        progress = lambda stage, fraction: None
 
     check_duplicate_neptun_codes(data)
+    count_index = build_count_index(data)
 
-    remaining_data, small_groups_data_initial = filter_small_groups(data)
-    grouped_data, original_data = group_students(remaining_data)
-    updated_data = group_students_by_year(remaining_data)
+    remaining_data, small_groups_data_initial = filter_small_groups(data, count_index)
+    grouped_data, remaining_data = group_students(remaining_data, count_index)
+    updated_data = group_students_by_year(remaining_data, count_index,
+                                          lambda fraction: progress('Grouping', fraction))
     updated_data = calculate_scholarship_index(updated_data)
     updated_data = calculate_kodi(updated_data)
+    progress('KÖDI', 1.0)
 
-    updated_data = remove_lower_kodi_duplicates(updated_data)
+    updated_data = remove_lower_kodi_duplicates(updated_data, count_index)
+    progress('Duplicate removal', 1.0)
 
     # Re-run the grouping and redistribution after removing duplicates
-    remaining_data, small_groups_data_after = filter_small_groups(updated_data)
-    grouped_data, original_data = group_students(remaining_data)
-    updated_data = group_students_by_year(remaining_data)
+    remaining_data, small_groups_data_after = filter_small_groups(updated_data, count_index)
+    grouped_data, remaining_data = group_students(remaining_data, count_index)
+    updated_data = group_students_by_year(remaining_data, count_index,
+                                          lambda fraction: progress('Regrouping', 0.8 * fraction))
     updated_data = calculate_scholarship_index(updated_data)
     updated_data = calculate_kodi(updated_data)
 
@@ -434,28 +509,370 @@ def main():
 
     updated_data = add_group_index(updated_data)
     small_groups_data_combined = add_group_index(small_groups_data_combined)
+    progress('Regrouping', 1.0)
+
+    return updated_data, small_groups_data_combined
+
+# Az előző futás fő kimenetéből visszaállítja a highlight_exceeded_semesters előtti oszlopokat
+def strip_semester_limit_columns(main_data):
+    """Eltávolítja a félévszám limitekből származó oszlopokat az előző futás kimenetéből.
+
+        Args:
+            main_data (pd.DataFrame): Az első lépés fő kimenete (main_data.xlsx).
+
+        Returns:
+            pd.DataFrame: Az adatok a highlight_exceeded_semesters előtti oszlopnevekkel.
+    """
+    columns_to_drop = ['GroupIndex', 'Adjusted Félévszám', 'Exceed Limit', 'Unknown Program Code']
+    main_data = main_data.drop(columns=[col for col in columns_to_drop if col in main_data.columns])
+    # A korábbi verziók merge-dzsel adták hozzá a limiteket, az onnan maradt _x utótagokat is visszaalakítja
+    return main_data.rename(columns={'Képzési szint_x': 'Képzési szint', 'Tagozat_x': 'Tagozat'})
+
+### Inkrementális futtatás: a fellebbezési időszakban érkező javított exportokban csak néhány hallgató sora változik.
+# Soronként hash-t számol (a szám oszlopokat float-ra hozva, hogy az Excel 4 vs 4.0 ne számítson változásnak),
+# és azokat a Neptun kódokat adja vissza, amelyek sorai eltérnek, újak, vagy eltűntek.
+def find_changed_students(previous_data, new_data):
+    """Megkeresi azokat a hallgatókat, akiknek az adatai változtak az előző feltöltéshez képest.
+
+        Args:
+            previous_data (pd.DataFrame): Az előző futás bemeneti adatai.
+            new_data (pd.DataFrame): Az új bemeneti adatok.
+
+        Returns:
+            set: A hozzáadott, törölt vagy módosított hallgatók Neptun kódjai.
+    """
+    common_columns = [col for col in new_data.columns if col in previous_data.columns]
+
+    def row_hashes(data):
+        normalized = data[common_columns].apply(
+            lambda col: col.astype('float64') if pd.api.types.is_numeric_dtype(col) else col.astype(str))
+        return pd.DataFrame({'Neptun kód': data['Neptun kód'].values,
+                             'RowHash': pd.util.hash_pandas_object(normalized, index=False).values})
+
+    merged = pd.merge(row_hashes(previous_data), row_hashes(new_data), on=['Neptun kód', 'RowHash'],
+                      how='outer', indicator=True)
+    return set(merged.loc[merged['_merge'] != 'both', 'Neptun kód'])
+
+### Csak az érintett (szak, évfolyam) csoportokat számolja újra. Ha egy szak évfolyam létszámai nem változtak, az
+# előző futás évfolyam összevonásait használja, különben a szakra újra lefuttatja a group_students_by_year-t.
+# Ha a változás kiscsoportot vagy duplikált Neptun kódot érint, None-t ad vissza, és teljes újraszámolás kell.
+def incremental_group_update(previous_input, previous_main, new_data, changed_codes):
+    """Inkrementálisan frissíti az előző futás eredményét a megváltozott hallgatók alapján.
+
+        Args:
+            previous_input (pd.DataFrame): Az előző futás bemeneti adatai.
+            previous_main (pd.DataFrame): Az előző futás fő kimenete (main_data.xlsx).
+            new_data (pd.DataFrame): Az új bemeneti adatok.
+            changed_codes (set): A find_changed_students által visszaadott Neptun kódok.
+
+        Returns:
+            tuple or None: A frissített fő adatok, a kiscsoport adatok és az újraszámolt (szak, évfolyam)
+            csoportok listája, vagy None, ha teljes újraszámolás szükséges.
+    """
+    previous_main = strip_semester_limit_columns(previous_main)
+
+    new_index = build_count_index(new_data)
+    previous_index = build_count_index(previous_input)
+    new_totals = program_totals(new_index)
+    previous_totals = program_totals(previous_index)
+
+    remaining_data, small_groups_data = filter_small_groups(new_data, new_index)
+    if set(program_key(remaining_data)) != set(program_key(previous_main)):
+        print("Program membership of the main data changed, full recalculation needed.")
+        return None
+
+    changed_new = new_data['Neptun kód'].isin(changed_codes)
+    changed_old = previous_input['Neptun kód'].isin(changed_codes)
+    affected_programs = set(program_key(new_data[changed_new])) | set(program_key(previous_input[changed_old]))
+
+    new_keys = program_key(new_data)
+    previous_keys = program_key(previous_input)
+    main_keys = program_key(previous_main)
+    for data, keys in ((new_data, new_keys), (previous_input, previous_keys)):
+        affected_mask = keys.isin(affected_programs)
+        if data['Neptun kód'].duplicated(keep=False)[affected_mask].any():
+            print("Duplicate Neptun kód in an affected program, full recalculation needed.")
+            return None
+    if any(new_totals.get(program, 0) < 10 or previous_totals.get(program, 0) < 10 for program in affected_programs):
+        print("An affected program has fewer than 10 students, full recalculation needed.")
+        return None
+
+    kept_parts = [previous_main[~main_keys.isin(affected_programs)]]
+    recomputed_parts = []
+    recomputed_partitions = []
+    for program in affected_programs:
+        _, program_new = group_students(new_data[new_keys == program], new_index)
+        program_main = previous_main[main_keys == program]
+
+        if new_index.get(program) == previous_index.get(program):
+            _, raw_years = group_students(program_main)
+            year_to_group = dict(zip(raw_years['Évfolyam'].astype(str), program_main['Évfolyam'].astype(str)))
+            program_new['Évfolyam'] = program_new['Évfolyam'].astype(str).map(year_to_group)
+            touched_years = (set(program_new.loc[program_new['Neptun kód'].isin(changed_codes), 'Évfolyam']) |
+                             set(program_main.loc[program_main['Neptun kód'].isin(changed_codes), 'Évfolyam'].astype(str)))
+            kept_parts.append(program_main[~program_main['Évfolyam'].astype(str).isin(touched_years)])
+            program_new = program_new[program_new['Évfolyam'].isin(touched_years)]
+        else:
+            program_new = group_students_by_year(program_new, new_index)
+
+        program_new = calculate_scholarship_index(program_new)
+        program_new = calculate_kodi(program_new)
+        recomputed_parts.append(program_new)
+        recomputed_partitions.extend((program, year) for year in program_new['Évfolyam'].astype(str).unique())
+
+    updated_data = pd.concat(kept_parts + recomputed_parts, ignore_index=True)
+    updated_data = updated_data[[col for col in previous_main.columns if col in updated_data.columns]]
+
+    small_groups_data = small_groups_data.drop_duplicates().reset_index(drop=True)
+    small_groups_data = calculate_scholarship_index(small_groups_data)
+
+    updated_data = add_group_index(sort_data(updated_data))
+    small_groups_data = add_group_index(sort_data(small_groups_data))
+    return updated_data, small_groups_data, recomputed_partitions
+
+# Változási riport: mely hallgatóknál változott a megadott oszlopok bármelyike (vagy ki/bekerült)
+def build_change_report(previous_data, updated_data, columns):
+    """Összeveti az előző és az új futás eredményét Neptun kód szerint.
+
+        Args:
+            previous_data (pd.DataFrame): Az előző futás eredménye.
+            updated_data (pd.DataFrame): Az új futás eredménye.
+            columns (list): Az összehasonlítandó oszlopok.
+
+        Returns:
+            pd.DataFrame: A megváltozott hallgatók előző és új értékei.
+    """
+    merged = pd.merge(previous_data[['Neptun kód'] + columns].drop_duplicates(subset=['Neptun kód']),
+                      updated_data[['Neptun kód'] + columns].drop_duplicates(subset=['Neptun kód']),
+                      on='Neptun kód', how='outer', suffixes=(' (előző)', ' (új)'), indicator=True)
+    changed = merged['_merge'] != 'both'
+    for col in columns:
+        previous_values = merged[f'{col} (előző)']
+        new_values = merged[f'{col} (új)']
+        numeric_difference = (pd.to_numeric(previous_values, errors='coerce') -
+                              pd.to_numeric(new_values, errors='coerce')).abs()
+        same = (numeric_difference < 1e-9) | (previous_values.astype(str) == new_values.astype(str))
+        changed |= ~same
+    merged['Változás'] = merged['_merge'].map({'left_only': 'Kikerült', 'right_only': 'Új', 'both': 'Módosult'})
+    return merged[changed].drop(columns=['_merge']).reset_index(drop=True)
+
+### Az első lépés teljes feldolgozása a feltöltött adatokból a letölthető fájlokig. Streamlit hívás nincs benne, így
+# háttérszálon is futtatható; az üzeneteket és a változási riportot az eredménnyel adja vissza.
+def process_step1(data, semester_limit_index, previous_input=None, previous_main=None, progress=None, export_executor=None,
+                  single_workbook=False):
+    """Lefuttatja a csoportosítást, a félévszám ellenőrzést és az Excel exportokat.
+
+        Args:
+            data (pd.DataFrame): A hallgatók adatai.
+            semester_limit_index (pd.Series): A build_semester_limit_index által felépített félévszám index.
+            previous_input (pd.DataFrame, optional): Az előző futás bemenete az inkrementális módhoz.
+            previous_main (pd.DataFrame, optional): Az előző futás fő kimenete az inkrementális módhoz.
+            progress (callable, optional): progress(szakasz, arány) alakban hívva a STEP1_STAGES szakaszaival.
+            export_executor (Executor, optional): Ha meg van adva, a két Excel fájl párhuzamosan készül.
+            single_workbook (bool): Egyetlen munkafüzet mindkét lappal (ekkor a 'separate_buffer' None).
+
+        Returns:
+            dict: 'main_buffer', 'separate_buffer', 'change_report' (vagy None), 'messages' és 'main_data' (a fő
+            kimenet DataFrame-ként, az archiváláshoz).
+    """
+    if progress is None:
+        progress = lambda stage, fraction: None
+    messages = []
+
+    updated_data = None
+    if previous_input is not None and previous_main is not None:
+        changed_codes = find_changed_students(previous_input, data)
+        messages.append(f"Changed students since the previous run: **{len(changed_codes)}**")
+        incremental_result = incremental_group_update(previous_input, previous_main, data, changed_codes)
+        if incremental_result is not None:
+            updated_data, small_groups_data_combined, recomputed_partitions = incremental_result
+            messages.append(f"Recomputed partitions: **{len(recomputed_partitions)}**")
+            for stage in ['Grouping', 'KÖDI', 'Duplicate removal', 'Regrouping']:
+                progress(stage, 1.0)
+        else:
+            messages.append("The changes affect small groups or duplicate Neptun kód entries, running the full calculation.")
+
+    if updated_data is None:
+        updated_data, small_groups_data_combined = run_grouping_pipeline(data, progress)
+
+    change_report = None
+    if previous_main is not None:
+        change_report = build_change_report(strip_semester_limit_columns(previous_main), updated_data,
+                                            ['Évfolyam', 'Ösztöndíjindex', 'KÖDI'])
 
     updated_data, small_groups_data_combined = highlight_exceeded_semesters(updated_data, small_groups_data_combined,
-                                                                            semester_limits)
+                                                                            semester_limit_index)
+    unknown_codes = pd.concat([updated_data, small_groups_data_combined]).loc[
+        lambda combined: combined['Unknown Program Code'], 'KépzésKód'].unique()
+    if len(unknown_codes):
+        messages.append(f"Program codes missing from the semester limits file: **{', '.join(map(str, unknown_codes))}**")
+    progress('Semester limits', 1.0)
+
+    if single_workbook:
+        main_buffer = save_to_single_excel(updated_data, small_groups_data_combined, progress)
+        separate_buffer = None
+        progress('Small groups Excel', 1.0)
+    else:
+        main_buffer, separate_buffer = save_to_excel(updated_data, small_groups_data_combined, export_executor,
+                                                     progress)
+
+    return {'main_buffer': main_buffer, 'separate_buffer': separate_buffer, 'change_report': change_report,
+            'messages': messages, 'main_data': updated_data}
+
+STEP1_STAGES = ['Loading', 'Grouping', 'KÖDI', 'Duplicate removal', 'Regrouping', 'Semester limits',
+                'Main data Excel', 'Small groups Excel']
+
+# A feltöltött fájlok (és az archivált előző futás) beolvasása a háttérszálon, a 'Loading' szakasszal, hogy a
+# beolvasás alatt se álljon meg az oldal. A betöltők paraméter nélküli függvények a process_step1 négy bemenetére.
+def run_step1(loaders, progress=None, **options):
+    if progress is None:
+        progress = lambda stage, fraction: None
+    inputs = []
+    for number, loader in enumerate(loaders, 1):
+        inputs.append(loader())
+        progress('Loading', number / len(loaders))
+    return process_step1(*inputs, progress=progress, **options)
+
+# Az inkrementális módhoz az előző futás bemenete és fő kimenete, ha fel lettek töltve. Feltöltés helyett az
+# archívum legutolsó összetartozó bemenet-csoportosítás párja is választható, ekkor a harmadik érték a pár
+# (Archive.latest_linked_runs). Az archívumot (és a duckdb-t) csak a bepipálás után tölti be.
+def load_previous_run():
+    archived_run = None
+    with st.expander("Incremental mode (previous run)"):
+        previous_input_file = st.file_uploader("Previous input Excel file", type="xlsx", key="previous_input_upload")
+        previous_main_file = st.file_uploader("Previous main_data.xlsx", type="xlsx", key="previous_main_upload")
+        if previous_input_file is None and previous_main_file is None and \
+                st.checkbox("Use the latest archived run as the previous run", key="use_archived_run"):
+            import Archive
+
+            archived_run = Archive.latest_linked_runs('input', 'grouping')
+            if archived_run is None:
+                st.info("The archive has no complete Step 1 run (input with its grouping).")
+    return previous_input_file, previous_main_file, archived_run
+
+# A futás archiválása (első lépés bemenete és fő kimenete) a megadott félévvel
+def archive_step1_run(input_data, main_data):
+    with st.expander("Archive this run"):
+        semester = st.text_input("Semester (e.g. 2024/25/1)", key="step1_archive_semester")
+        if st.button("Archive", key="step1_archive") and semester:
+            import Archive
+
+            run_id = Archive.archive_run(input_data, 'input', semester)
+            Archive.archive_run(main_data, 'grouping', semester, parent_run=run_id)
+            st.success(f"Archived as run {run_id}")
+
+### Háttérben futó feldolgozás: a futás a session-höz kötött, a feltöltött fájlok tartalmának hash-e azonosítja, így
+# egy widget változtatás nem indítja újra, csak új fájlok feltöltése.
+def get_step1_job(uploaded_files, loaders, single_workbook=False, profile=False, archived_run=None):
+    job_key = hashlib.sha256(b''.join(
+        hashlib.sha256(file.getvalue()).digest() if file is not None else b'-' for file in uploaded_files)).hexdigest()
+    job_key += '-single' if single_workbook else ''
+    job_key += '-profile' if profile else ''
+    job_key += f"-{archived_run['input']}/{archived_run['grouping']}" if archived_run else ''
+
+    job = st.session_state.get('step1_job')
+    if job is None or job['key'] != job_key:
+        job_executor, export_executor = get_executors()
+        progress = {stage: 0.0 for stage in STEP1_STAGES}
+        future = job_executor.submit(run_profiled, profile, run_step1, loaders,
+                                     progress=progress.__setitem__, export_executor=export_executor,
+                                     single_workbook=single_workbook)
+        job = {'key': job_key, 'future': future, 'progress': progress}
+        st.session_state['step1_job'] = job
+    return job
+
+def show_progress(job):
+    for stage in STEP1_STAGES:
+        st.progress(min(job['progress'][stage], 1.0), text=stage)
+
+# Amíg a futás tart, csak ez a rész frissül másodpercenként, az oldal többi része használható marad
+@st.fragment(run_every=1)
+def poll_step1_job(job):
+    show_progress(job)
+    if job['future'].done():
+        st.rerun()
+
+
+### Streamlit és függvények meghívása
+
+def main():
+    st.title("Student Grouping")
+    st.subheader("Upload an input file where 3,8 and 23 are filtered")
+    uploaded_file = st.file_uploader("Choose an Excel file", type="xlsx", key="main_file_upload")
+
+    st.subheader("Upload max number of semesters file")
+    uploaded_file2 = st.file_uploader("Choose an Excel file", type="xlsx", key="semester_limit_file_upload")
+
+    if uploaded_file is None or uploaded_file2 is None:
+        st.stop()
 
-    main_buffer, separate_buffer = save_to_excel(updated_data, small_groups_data_combined)
+    previous_input_file, previous_main_file, archived_run = load_previous_run()
+    single_workbook = st.checkbox("Export both sheets into a single workbook", key="single_workbook")
+    profile = profiling_toggle("step1_profile")
+
+    # A beolvasás a háttérszálon fut (run_step1), itt csak a betöltők készülnek el
+    def load_archived_run(stage):
+        import Archive
+
+        return Archive.load_run(stage, archived_run['semester'], archived_run[stage])
+
+    def load_optional(file):
+        return load_data(file) if file is not None else None
+
+    loaders = [lambda: load_data(uploaded_file), lambda: load_semester_limit_index(uploaded_file2)]
+    if archived_run is not None:
+        loaders += [lambda: load_archived_run('input'), lambda: load_archived_run('grouping')]
+    else:
+        loaders += [lambda: load_optional(previous_input_file), lambda: load_optional(previous_main_file)]
+
+    job = get_step1_job([uploaded_file, uploaded_file2, previous_input_file, previous_main_file], loaders,
+                        single_workbook, profile, archived_run)
+
+    st.subheader("Progress")
+    if not job['future'].done():
+        poll_step1_job(job)
+        st.stop()
+    show_progress(job)
+
+    if job['future'].exception() is not None:
+        st.error(f"Processing failed: {job['future'].exception()}")
+        st.stop()
+    result, stats = job['future'].result()
+    show_profile(stats, "step1.prof")
+
+    for message in result['messages']:
+        st.write(message)
+
+    if result['change_report'] is not None:
+        st.subheader("Change Report")
+        st.dataframe(result['change_report'])
+
+    archive_step1_run(load_data(uploaded_file), result['main_data'])
 
     st.subheader("Download Output Files")
 
+    if result['separate_buffer'] is None:
+        st.download_button(
+            label="Download Scholarship Grouping Excel",
+            data=result['main_buffer'].getvalue(),
+            file_name="grouping_data.xlsx",
+            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+        )
+        st.stop()
+
     st.download_button(
         label="Download Main Data Excel",
-        data=main_buffer.getvalue(),
+        data=result['main_buffer'].getvalue(),
         file_name="main_data.xlsx",
         mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
     )
 
     st.download_button(
         label="Download Small Groups Data Excel",
-        data=separate_buffer.getvalue(),
+        data=result['separate_buffer'].getvalue(),
         file_name="small_groups_data.xlsx",
         mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
     )
 
 if __name__ == "__main__":
     main()
-
@@ -1,9 +1,27 @@
+import os
 import streamlit as st
 
+# Opcionális bemelegítés (SCHOLARSHIP_WARM_UP=1 környezeti változóval): a hibernálásból ébredés után a háttérben
+# betölti a nehéz modulokat és elindítja az első lépés export folyamatait, így az első feltöltésnél már nem kell
+# rájuk várni. A cache_resource miatt szerverenként csak egyszer fut le.
+@st.cache_resource
+def warm_up():
+    from Excel_Export import get_executors, preload
+
+    thread_executor, process_executor = get_executors()
+    return [thread_executor.submit(preload_page_modules), process_executor.submit(preload)]
+
+def preload_page_modules():
+    import matplotlib.pyplot
+    from Excel_Export import preload
+    preload()
+
 def main():
     st.set_page_config(page_title="Scholarship Main Menu")
     st.title("Scholarship Calculation Main Menu")
     st.markdown("Use the sidebar to navigate between steps.")
+    if os.environ.get('SCHOLARSHIP_WARM_UP') == '1':
+        warm_up()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,52 @@
+import cProfile
+import marshal
+import pstats
+
+import pandas as pd
+import streamlit as st
+
+# Oldalankénti profilozás (cProfile): bekapcsolva az oldal számítása a profiler alatt fut, a leglassabb függvények
+# táblázatként megjelennek, a teljes profil .prof fájlként letölthető (pl. snakeviz, python -m pstats).
+# Kikapcsolva a függvény közvetlenül hívódik, a profiler nem is jön létre.
+
+def profiling_toggle(key):
+    return st.sidebar.checkbox("Profile this run", key=key,
+                               help="Runs this page's computation under cProfile and shows the hot functions")
+
+### A függvény futtatása, bekapcsolt profilozásnál cProfile alatt. A cProfile csak a hívó szálat méri, a
+# folyamatokba küldött munkát (pl. az első lépés Excel exportjai) nem.
+def run_profiled(enabled, func, *args, **kwargs):
+    """Meghívja a függvényt, és ha kell, profilozza.
+
+        Args:
+            enabled (bool): A profilozás be van-e kapcsolva.
+            func (callable): A futtatandó függvény, a további argumentumokkal hívva.
+
+        Returns:
+            tuple: (a függvény eredménye, pstats.Stats vagy None, ha a profilozás ki van kapcsolva).
+    """
+    if not enabled:
+        return func(*args, **kwargs), None
+    profiler = cProfile.Profile()
+    result = profiler.runcall(func, *args, **kwargs)
+    return result, pstats.Stats(profiler)
+
+# A leglassabb függvények saját (tottime) és kumulatív (cumtime) idővel
+def top_functions(stats, limit=20):
+    rows = [{'Function': f"{function} ({file}:{line})", 'Calls': total_calls, 'Own time (s)': own_time,
+             'Cumulative time (s)': cumulative_time}
+            for (file, line, function), (_, total_calls, own_time, cumulative_time, _) in stats.stats.items()]
+    return pd.DataFrame(rows).sort_values('Cumulative time (s)', ascending=False, ignore_index=True).head(limit)
+
+# A .prof fájl tartalma: ugyanaz, amit a pstats.Stats.dump_stats ír, csak fájl helyett bytes-ként
+def profile_bytes(stats):
+    return marshal.dumps(stats.stats)
+
+def show_profile(stats, file_name):
+    if stats is None:
+        return
+    with st.expander("Profile", expanded=True):
+        st.write(f"Total time: **{stats.total_tt:.2f} s**")
+        st.dataframe(top_functions(stats))
+        st.download_button(label="Download full profile (.prof)", data=profile_bytes(stats), file_name=file_name,
+                           mime="application/octet-stream")
@@ -1,22 +1,197 @@
 import streamlit as st
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-import io
-import xlsxwriter
+import json
+import hashlib
+
+from Profiling import profiling_toggle, run_profiled, show_profile
+
+# Copy-on-write: a szűrt szeleteket nem kell .copy()-zni, és a függvények nem módosítják a kapott DataFrame-eket.
+pd.set_option('mode.copy_on_write', True)
+
+def read_input_file(file_path):
+    data = pd.read_excel(file_path)
+    # A régebbi első lépés exportokban a félévszám limit merge miatt _x utótagos oszlopnevek szerepelnek
+    return data.rename(columns={'Képzési szint_x': 'Képzési szint', 'Tagozat_x': 'Tagozat'})
 
 @st.cache_data
 def load_data(file_path):
-    data = pd.read_excel(file_path)
-    return data
+    return read_input_file(file_path)
+
+REQUIRED_COLUMNS = ['GroupIndex', 'KépzésKód', 'KépzésNév', 'Neptun kód', 'Nyomtatási név',
+                    'Felvétel féléve', 'Aktív félévek', 'Státusz2 jelen félév',
+                    'Ösztöndíj átlag előző félév', 'Képzési szint', 'Nyelv ID', 'Tagozat',
+                    'ElőzőFélévTeljesítettKredit', 'Hallgató kérvény azonosító', 'Évfolyam',
+                    'Kredit szám', 'Ösztöndíjindex', 'KÖDI', 'Exceed Limit']
+
+### Folyamatszintű adatkészlet tár: az ugyanazt a fájlt feltöltő sessionök (pl. a bizottság tagjai egyszerre)
+# egyetlen, csak olvasható példányon dolgoznak. A Streamlit sessionök egy folyamat szálai, így a cache_resource
+# által visszaadott objektumok másolás nélkül közösek (a cache_data minden hívónak külön másolatot adna), a
+# copy-on-write miatt pedig a sessionök szűrései és hozzárendelései sem módosítják őket. A sessionben csak a
+# paraméterek (százalékok, keretek) maradnak, a szerver memóriája az eltérő adatkészletek számával nő, nem a
+# felhasználókéval.
+@st.cache_resource(max_entries=4)
+def load_shared_dataset(content_hash, _uploaded_file):
+    """
+        Beolvassa és előkészíti a feltöltött fájlt, tartalmanként (hash) egyszer.
+
+        Args:
+            content_hash (str): A fájl tartalmának SHA-256 hash-e, a gyorsítótár kulcsa.
+            _uploaded_file (UploadedFile): A feltöltött fájl (a kulcsba nem számít bele).
+
+        Returns:
+            dict: 'data' és 'missing_columns', hiánytalan oszlopok esetén a split_submitted_data három táblája,
+            'group_table', 'group_sizes' és a csoportonkénti 'group_signatures'. Csak olvasható, a hívók nem
+            módosíthatják. A csoportok hash-e itt, adatkészletenként egyszer készül, nem minden újrafuttatáskor.
+    """
+    data = read_input_file(_uploaded_file)
+    dataset = {'data': data, 'missing_columns': [col for col in REQUIRED_COLUMNS if col not in data.columns]}
+    if dataset['missing_columns']:
+        return dataset
+
+    submitted_data_all, submitted_data_over, submitted_data_kerveny = split_submitted_data(data)
+    dataset.update({'submitted_data_all': submitted_data_all, 'submitted_data_over': submitted_data_over,
+                    'submitted_data_kerveny': submitted_data_kerveny,
+                    'group_table': build_group_table(submitted_data_all),
+                    'group_sizes': submitted_data_all['GroupIndex'].value_counts(),
+                    'group_signatures': build_group_signatures(submitted_data_kerveny)})
+    return dataset
+
+MAX_CACHED_GROUPS = 20000
+
+### Folyamatszintű ösztöndíjas gyorsítótár, adatkészletek között közös. A kulcs a csoport sorainak hash-e, így egy
+# javított feltöltés (új tartalom hash, új adatkészlet) a változatlan csoportok kiválasztását innen kapja, és csak a
+# módosult csoportokat kell újra kiválasztani. A legrégebbi bejegyzések törlődnek a korlát fölött.
+@st.cache_resource
+def get_recipient_cache():
+    return {}
+
+def build_group_signatures(submitted_data):
+    """
+        Csoportonként egy olcsó tartalom hash a kérelmet benyújtók soraiból (a sorrendtől független).
+
+        Args:
+            submitted_data (pd.DataFrame): A kérelmet benyújtott hallgatók adatai.
+
+        Returns:
+            dict: {csoport: hash}; a kérelmet benyújtó nélküli csoportok hiányoznak.
+    """
+    hashes = pd.util.hash_pandas_object(submitted_data, index=False)
+    return hashes.groupby(submitted_data['GroupIndex'].to_numpy()).sum().to_dict()
+
+
+def build_group_table(data):
+    """
+        Csoportonként egy sor a szerkesztőhöz: a csoport szakja, szintje, nyelve, évfolyama és létszáma.
+
+        Args:
+            data (pd.DataFrame): A limitet nem túllépő hallgatók adatai.
 
+        Returns:
+            pd.DataFrame: GroupIndex szerint indexelt tábla, 'Csoport' címkével ('KépzésNév | Képzési szint |
+            Nyelv ID | Évfolyam'), amely a presetekben a csoport azonosítója.
+    """
+    grouping_columns = ['KépzésNév', 'Képzési szint', 'Nyelv ID', 'Évfolyam']
+    group_table = data.groupby('GroupIndex')[grouping_columns].first()
+    group_table['Létszám'] = data['GroupIndex'].value_counts()
+    group_table['Csoport'] = group_table[grouping_columns[0]].astype(str)
+    for col in grouping_columns[1:]:
+        group_table['Csoport'] = group_table['Csoport'] + ' | ' + group_table[col].astype(str)
+    return group_table
+
+def bulk_update_percentages(percentages, group_table, operation, value, programs=None, levels=None):
+    """
+        Tömeges módosítás egyetlen vektorizált lépésben.
+
+        Args:
+            percentages (pd.Series): A jelenlegi százalékok GroupIndex szerint.
+            group_table (pd.DataFrame): A build_group_table eredménye.
+            operation (str): 'Set', 'Add' vagy 'Subtract'.
+            value (int): A beállítandó, hozzáadandó vagy levonandó százalék.
+            programs (list, optional): Csak ezeknek a szakoknak (KépzésNév) a csoportjai; üres vagy None esetén mind.
+            levels (list, optional): Csak ezeknek a képzési szinteknek a csoportjai; üres vagy None esetén mind.
+
+        Returns:
+            pd.Series: Az új százalékok (0 és 100 közé vágva).
+    """
+    selected = pd.Series(True, index=percentages.index)
+    if programs:
+        selected &= group_table['KépzésNév'].reindex(percentages.index).isin(programs)
+    if levels:
+        selected &= group_table['Képzési szint'].reindex(percentages.index).isin(levels)
+
+    if operation == 'Set':
+        updated = pd.Series(value, index=percentages.index)
+    elif operation == 'Add':
+        updated = percentages + value
+    else:
+        updated = percentages - value
+    return percentages.where(~selected, updated.clip(0, 100)).astype(int)
 
-def get_group_percentages(groups):
+def apply_percentage_changes(group_percentages, new_percentages):
+    """
+        Egy kötegben átvezeti a változásokat.
+
+        Args:
+            group_percentages (dict): A session state-ben tárolt {GroupIndex: százalék} szótár (helyben módosul).
+            new_percentages (pd.Series or dict): Az új százalékok GroupIndex szerint.
+
+        Returns:
+            list: A megváltozott csoportok.
+    """
+    changed_groups = [group for group, percentage in dict(new_percentages).items()
+                      if group_percentages.get(group) != int(percentage)]
+    for group in changed_groups:
+        group_percentages[group] = int(new_percentages[group])
+    return changed_groups
+
+# A presetek a csoport címkéjével ('KépzésNév | Képzési szint | Nyelv ID | Évfolyam') tárolják a százalékokat, mert a
+# GroupIndex számozás egy új első lépés futásnál eltolódhat
+def percentages_to_preset(group_percentages, group_table):
+    return {group_table.loc[group, 'Csoport']: int(percentage) for group, percentage in group_percentages.items()
+            if group in group_table.index}
+
+def preset_to_percentages(preset, group_table):
+    groups_by_label = pd.Series(group_table.index, index=group_table['Csoport'])
+    return {int(groups_by_label[label]): int(percentage) for label, percentage in preset.items()
+            if label in groups_by_label.index}
+
+# A feltöltött preset fájl ellenőrzése: {preset név: {csoport címke: százalék (0-100)}}
+def parse_presets(content):
+    """
+        Beolvassa és ellenőrzi a feltöltött preset JSON fájlt.
+
+        Args:
+            content (bytes): A fájl tartalma.
+
+        Returns:
+            dict: A presetek {név: {csoport címke: százalék}} alakban.
+
+        Raises:
+            ValueError: Ha a fájl nem érvényes JSON, vagy nem a fenti szerkezetű.
+    """
+    presets = json.loads(content)
+    if not isinstance(presets, dict):
+        raise ValueError("the file must contain an object of presets")
+    for name, preset in presets.items():
+        if not isinstance(preset, dict):
+            raise ValueError(f"preset '{name}' must map group labels to percentages")
+        for label, percentage in preset.items():
+            if isinstance(percentage, bool) or not isinstance(percentage, (int, float)) or \
+                    not 0 <= percentage <= 100:
+                raise ValueError(f"preset '{name}', group '{label}': percentage must be a number between 0 and 100")
+    return presets
+
+def get_group_percentages(groups, group_table):
     """
         Létrehozza és kezeli a csoportok ösztöndíj százalékainak beállítását az oldalsávon.
 
+        Csoportonkénti widgetek helyett egy szerkeszthető táblával, tömeges műveletekkel és JSON presetekkel; minden
+        módosítás űrlapon keresztül, egy kötegben érvényesül.
+
         Args:
             groups (list): A csoportok listája.
+            group_table (pd.DataFrame): A build_group_table eredménye.
 
         Returns:
             dict: A csoportokhoz tartozó százalékok szótára (tizedes formában).
@@ -29,40 +204,155 @@ def get_group_percentages(groups):
         for group in groups:
             if group not in st.session_state.group_percentages:
                 st.session_state.group_percentages[group] = 30
+    st.session_state.setdefault('percentage_presets', {})
+    st.session_state.setdefault('percentage_editor_version', 0)
 
     group_percentages = st.session_state.group_percentages
-
-    with st.sidebar.expander("Set Group Percentages", expanded=True):
-        col1, col2 = st.columns(2)
-        with col1:
-            if st.button("Add 1% to All"):
-                for group in groups:
-                    new_value = min(group_percentages[group] + 1, 100)
-                    group_percentages[group] = new_value
-                st.rerun()
-        with col2:
-            if st.button("Subtract 1% from All"):
-                for group in groups:
-                    new_value = max(group_percentages[group] - 1, 0)
-                    group_percentages[group] = new_value
-                st.rerun()
-
-        # Add number input for each group
-        for group in groups:
-            percentage = st.number_input(
-                f"Group {group} Percentage (%)",
-                min_value=0,
-                max_value=100,
-                value=group_percentages[group],
-                step=1,
-                key=f"group_{group}"
-            )
-            group_percentages[group] = percentage
+    percentages = pd.Series({group: group_percentages[group] for group in groups}, dtype=int)
+
+    def apply_changes(new_percentages):
+        changed_groups = apply_percentage_changes(group_percentages, new_percentages)
+        # A szerkesztő tábla új kulccsal indul, hogy a régi (már átvezetett) szerkesztései ne íródjanak vissza
+        st.session_state.percentage_editor_version += 1
+        st.sidebar.caption(f"Updated {len(changed_groups)} group(s).")
+
+    with st.sidebar.expander("Bulk edit", expanded=True):
+        with st.form("bulk_percentage_form"):
+            operation = st.selectbox("Operation", ['Set', 'Add', 'Subtract'])
+            value = st.number_input("Percentage (%)", min_value=0, max_value=100, value=1, step=1)
+            programs = st.multiselect("Only programs (KépzésNév)", sorted(group_table['KépzésNév'].astype(str).unique()))
+            levels = st.multiselect("Only levels (Képzési szint)",
+                                    sorted(group_table['Képzési szint'].astype(str).unique()))
+            if st.form_submit_button("Apply"):
+                apply_changes(bulk_update_percentages(percentages, group_table, operation, value, programs, levels))
+
+    with st.sidebar.expander("Presets"):
+        presets = st.session_state.percentage_presets
+        preset_name = st.text_input("Preset name")
+        if st.button("Save current percentages as preset") and preset_name:
+            presets[preset_name] = percentages_to_preset(group_percentages, group_table)
+        presets_file = st.file_uploader("Upload presets (JSON)", type="json")
+        # Egy feltöltött fájl csak egyszer töltődik be, hogy a később szerkesztett preseteket ne írja felül
+        if presets_file is not None and st.session_state.get('applied_presets_file') != presets_file.file_id:
+            st.session_state.applied_presets_file = presets_file.file_id
+            try:
+                presets.update(parse_presets(presets_file.getvalue()))
+            except ValueError as error:
+                st.error(f"Invalid presets file: {error}")
+        if presets:
+            selected_preset = st.selectbox("Preset", list(presets))
+            if st.button("Load preset"):
+                apply_changes(preset_to_percentages(presets[selected_preset], group_table))
+            st.download_button("Download presets (JSON)", data=json.dumps(presets, ensure_ascii=False, indent=2),
+                               file_name='percentage_presets.json', mime='application/json')
+
+    with st.sidebar.expander("Edit table"):
+        with st.form("percentage_table_form"):
+            editor_table = group_table.loc[groups, ['Csoport', 'Létszám']].assign(
+                **{'Percentage (%)': [group_percentages[group] for group in groups]})
+            edited = st.data_editor(
+                editor_table, key=f"percentage_editor_{st.session_state.percentage_editor_version}",
+                disabled=['Csoport', 'Létszám'],
+                column_config={'Percentage (%)': st.column_config.NumberColumn(min_value=0, max_value=100, step=1)})
+            if st.form_submit_button("Save table"):
+                apply_changes(edited['Percentage (%)'].fillna(editor_table['Percentage (%)']))
 
     group_percentages_decimal = {group: pct / 100 for group, pct in group_percentages.items()}
     return group_percentages_decimal
 
-def calculate_scholarship_amounts_global(submitted_data, all_data, max_amount_per_group, min_amount_per_group, group_percentages, k, x0):
+# A keret szintjei: csoportonként vagy szakonként (KépzésKód) külön keret
+BUDGET_LEVELS = {'Group': 'GroupIndex', 'Program': 'KépzésKód'}
+
+def build_budget_table(data, budget_column):
+    """
+        Keretenként egy sor a szerkesztőhöz: a címke ('Csoport') és a létszám.
+
+        Args:
+            data (pd.DataFrame): A limitet nem túllépő hallgatók adatai.
+            budget_column (str): 'GroupIndex' vagy 'KépzésKód'.
+
+        Returns:
+            pd.DataFrame: A budget_column szerint indexelt tábla 'Csoport' és 'Létszám' oszlopokkal.
+    """
+    if budget_column == 'GroupIndex':
+        return build_group_table(data)[['Csoport', 'Létszám']]
+    return data.groupby(budget_column).agg(Csoport=('KépzésNév', 'first'), Létszám=('Neptun kód', 'size'))
+
+# Alapértelmezett keretek: a teljes keret létszámarányosan, 100 Ft-ra kerekítve
+def split_fund_by_headcount(total_fund, budget_table):
+    shares = budget_table['Létszám'] / budget_table['Létszám'].sum()
+    return ((shares * total_fund / 100).round() * 100).astype(int).to_dict()
+
+def get_group_budgets(budget_table, budget_column, total_fund):
+    """
+        A keretek szerkesztése az oldalsávon, űrlapon keresztül egy kötegben. Az első megnyitáskor és a
+        visszaállító gombra a teljes keret létszámarányos felosztásával indul.
+
+        Args:
+            budget_table (pd.DataFrame): A build_budget_table eredménye.
+            budget_column (str): 'GroupIndex' vagy 'KépzésKód'.
+            total_fund (int): A teljes ösztöndíj keret.
+
+        Returns:
+            dict: {csoport vagy szak: keret}.
+    """
+    budgets_key = f'group_budgets_{budget_column}'
+    st.session_state.setdefault('budget_editor_version', 0)
+    if budgets_key not in st.session_state or st.sidebar.button("Split the total fund by headcount"):
+        st.session_state[budgets_key] = split_fund_by_headcount(total_fund, budget_table)
+        st.session_state.budget_editor_version += 1
+    group_budgets = st.session_state[budgets_key]
+
+    with st.sidebar.expander("Budgets"):
+        with st.form("budget_table_form"):
+            editor_table = budget_table.assign(
+                **{'Budget': [group_budgets.get(key, 0) for key in budget_table.index]})
+            edited = st.data_editor(
+                editor_table, key=f"budget_editor_{st.session_state.budget_editor_version}",
+                disabled=['Csoport', 'Létszám'],
+                column_config={'Budget': st.column_config.NumberColumn(min_value=0, step=1000)})
+            if st.form_submit_button("Save budgets"):
+                group_budgets.update(edited['Budget'].fillna(editor_table['Budget']).astype(int).to_dict())
+                st.session_state.budget_editor_version += 1
+    return {key: group_budgets.get(key, 0) for key in budget_table.index}
+
+def select_group_recipients(group_submitted_data, num_recipients):
+    """
+        Kiválasztja egy csoport ösztöndíjasait KÖDI szerint, a határon lévő holtversenyeket is beleértve.
+
+        Args:
+            group_submitted_data (pd.DataFrame): A csoport kérelmet benyújtott hallgatói.
+            num_recipients (int): A csoportban ösztöndíjat kapók tervezett száma.
+
+        Returns:
+            pd.DataFrame: A csoport ösztöndíjasai, vagy None, ha nincs kedvezményezett.
+    """
+    group_submitted_data = group_submitted_data.sort_values(by='KÖDI', ascending=False).reset_index(drop=True)
+
+    initial_recipients = group_submitted_data.iloc[:num_recipients]
+
+    if initial_recipients.empty:
+        return None
+
+    last_included_KODI = initial_recipients['KÖDI'].iloc[-1]
+
+    additional_recipients = group_submitted_data[
+        (group_submitted_data['KÖDI'] == last_included_KODI) & (group_submitted_data.index >= num_recipients)]
+
+    all_recipients_group = pd.concat([initial_recipients, additional_recipients]).drop_duplicates(
+        subset=['Neptun kód'])
+
+    if len(all_recipients_group) < num_recipients:
+        remaining_students = group_submitted_data.loc[
+            ~group_submitted_data['Neptun kód'].isin(all_recipients_group['Neptun kód'])]
+        num_needed = num_recipients - len(all_recipients_group)
+        additional_needed = remaining_students.iloc[:num_needed]
+        all_recipients_group = pd.concat([all_recipients_group, additional_needed])
+
+    return all_recipients_group
+
+def calculate_scholarship_amounts_global(submitted_data, all_data, max_amount_per_group, min_amount_per_group, group_percentages, k, x0,
+                                         recipient_cache=None, group_sizes=None, group_signatures=None):
     """
         Kiszámolja az ösztöndíjakat globálisan, figyelembe véve a csoportszázalékokat és a KÖDI értékeket.
 
@@ -74,6 +364,13 @@ def calculate_scholarship_amounts_global(submitted_data, all_data, max_amount_pe
             group_percentages (dict): A csoportokhoz tartozó százalékok.
             k (float): A logisztikus függvény meredeksége.
             x0 (float): A logisztikus függvény középpontja.
+            recipient_cache (dict, optional): Csoportonkénti gyorsítótár (csoport, a csoport sorainak hash-e és a
+                kedvezményezettek száma szerint); csak az új kombinációkat számolja ki. A kulcs a tartalomhoz kötött,
+                így az adatkészletek és a sessionök közösen használhatják (get_recipient_cache).
+            group_sizes (pd.Series, optional): Csoportonkénti létszám (all_data['GroupIndex'].value_counts()),
+                hogy ne kelljen minden csoportnál újraszámolni.
+            group_signatures (dict, optional): A build_group_signatures eredménye; ha hiányzik, és van
+                gyorsítótár, itt készül el.
 
         Returns:
             tuple: Az ösztöndíjasok adatai, a teljes ösztöndíjasok száma, az összes hallgató száma, a csoport minimum ösztöndíjindexeinek szótára.
@@ -85,57 +382,50 @@ def calculate_scholarship_amounts_global(submitted_data, all_data, max_amount_pe
     group_min_kodi_dict = {}
     group_min_index_dict = {}
 
+    if group_sizes is None:
+        group_sizes = all_data['GroupIndex'].value_counts()
+    submitted_by_group = {group: group_data for group, group_data in submitted_data.groupby('GroupIndex')}
+    if recipient_cache is not None and group_signatures is None:
+        group_signatures = build_group_signatures(submitted_data)
+
     for group in all_data['GroupIndex'].unique():
-        all_group_data = all_data[all_data['GroupIndex'] == group].copy()
-        group_submitted_data = submitted_data[submitted_data['GroupIndex'] == group].copy()
+        group_submitted_data = submitted_by_group.get(group, submitted_data.iloc[0:0])
 
-        num_students_in_group = len(all_group_data)
+        num_students_in_group = int(group_sizes[group])
         group_percentage = group_percentages.get(group, 0.25)
 
         num_recipients = int(np.ceil(group_percentage * num_students_in_group))
 
-        group_submitted_data = group_submitted_data.sort_values(by='KÖDI', ascending=False).reset_index(drop=True)
-
-        initial_recipients = group_submitted_data.iloc[:num_recipients].copy()
-
-        if not initial_recipients.empty:
-            last_included_KODI = initial_recipients['KÖDI'].iloc[-1]
-
-            additional_recipients = group_submitted_data[
-                (group_submitted_data['KÖDI'] == last_included_KODI) & (group_submitted_data.index >= num_recipients)]
-
-            all_recipients_group = pd.concat([initial_recipients, additional_recipients]).drop_duplicates(
-                subset=['Neptun kód'])
-
-            if len(all_recipients_group) < num_recipients:
-                remaining_students = group_submitted_data.loc[
-                    ~group_submitted_data['Neptun kód'].isin(all_recipients_group['Neptun kód'])]
-                num_needed = num_recipients - len(all_recipients_group)
-                additional_needed = remaining_students.iloc[:num_needed]
-                all_recipients_group = pd.concat([all_recipients_group, additional_needed])
-
+        if recipient_cache is not None:
+            signature = (group, group_signatures.get(group, 0), num_recipients)
+            if signature in recipient_cache:
+                all_recipients_group = recipient_cache[signature]
+            else:
+                all_recipients_group = select_group_recipients(group_submitted_data, num_recipients)
+                recipient_cache[signature] = all_recipients_group
+                if len(recipient_cache) > MAX_CACHED_GROUPS:
+                    recipient_cache.pop(next(iter(recipient_cache)), None)
+        else:
+            all_recipients_group = select_group_recipients(group_submitted_data, num_recipients)
+
+        if all_recipients_group is not None:
             num_recipients_actual = len(all_recipients_group)
             total_recipients += num_recipients_actual
 
-            group_min_kodi_dict[group] = last_included_KODI
+            group_min_kodi_dict[group] = all_recipients_group['KÖDI'].min()
             group_min_index_dict[group] = all_recipients_group['Ösztöndíjindex'].min()
 
-            all_recipients_group['Group Minimum Ösztöndíjindex'] = all_recipients_group['Ösztöndíjindex'].min()
+            all_recipients_group = all_recipients_group.assign(
+                **{'Group Minimum Ösztöndíjindex': all_recipients_group['Ösztöndíjindex'].min()})
             recipients_list.append(all_recipients_group)
 
     all_recipients = pd.concat(recipients_list, ignore_index=True)
-    all_recipients.drop_duplicates(inplace=True)
+    all_recipients = all_recipients.drop_duplicates()
 
     KODI_cutoff_global = all_recipients['KÖDI'].min()
 
-    epsilon = 0.01
-    KODI_normalized = (all_recipients['KÖDI'] - KODI_cutoff_global) / (100 - KODI_cutoff_global + epsilon)
-    KODI_normalized = np.clip(KODI_normalized, 0, 1)
-
-    f_K = 1 / (1 + np.exp(-k * (KODI_normalized - x0)))
-
-    all_recipients['Scholarship Amount'] = min_amount_per_group + f_K * (max_amount_per_group - min_amount_per_group)
-    all_recipients.loc[all_recipients['KÖDI'] == 100, 'Scholarship Amount'] = max_amount_per_group
+    all_recipients['Scholarship Amount'] = logistic_amounts(all_recipients['KÖDI'], KODI_cutoff_global,
+                                                            max_amount_per_group, min_amount_per_group, k, x0)
     all_recipients['Scholarship Amount'] = (all_recipients['Scholarship Amount'] / 100).round() * 100
 
     cols = all_recipients.columns.tolist()
@@ -145,6 +435,217 @@ def calculate_scholarship_amounts_global(submitted_data, all_data, max_amount_pe
 
     return all_recipients, total_recipients, total_students, group_min_index_dict
 
+# A limiten belüli hallgatók, a limitet túllépők és a limiten belüli kérelmet benyújtók
+def split_submitted_data(data):
+    submitted_data_all = data[data['Exceed Limit'] == False]
+    submitted_data_over = data[data['Exceed Limit'] == True]
+    submitted_data_kerveny = submitted_data_all[
+        submitted_data_all['Hallgató kérvény azonosító'].notnull() & (submitted_data_all['Hallgató kérvény azonosító'] != '')]
+
+    submitted_data_all['GroupIndex'] = submitted_data_all['GroupIndex'].astype(int)
+    submitted_data_kerveny['GroupIndex'] = submitted_data_kerveny['GroupIndex'].astype(int)
+    return submitted_data_all, submitted_data_over, submitted_data_kerveny
+
+def build_all_students_data(data, recipients, group_min_kodi_dict, submitted_data_over):
+    """
+        Összeállítja az exportálandó táblát: minden hallgató a csoport minimum ösztöndíjindexével és az ösztöndíjával.
+
+        Args:
+            data (pd.DataFrame): Az első lépés kimenete.
+            recipients (pd.DataFrame): Az ösztöndíjasok adatai.
+            group_min_kodi_dict (dict): A csoport minimum ösztöndíjindexek.
+            submitted_data_over (pd.DataFrame): A félévszám limitet túllépő hallgatók.
+
+        Returns:
+            pd.DataFrame: A harmadik lépés bemenete (Scholarship_Data.xlsx).
+    """
+    group_min_kodi_df = pd.DataFrame(list(group_min_kodi_dict.items()), columns=['GroupIndex', 'Group Minimum Ösztöndíjindex'])
+
+    data = pd.merge(data, group_min_kodi_df, on='GroupIndex', how='left')
+
+    all_students_data = pd.merge(
+        data,
+        recipients[['Neptun kód', 'Scholarship Amount']],
+        on='Neptun kód',
+        how='left'
+    )
+    all_students_data['Scholarship Amount'] = all_students_data['Scholarship Amount'].fillna('')
+    all_students_data['Group Minimum Ösztöndíjindex'] = all_students_data['Group Minimum Ösztöndíjindex'].fillna('')
+
+    all_students_data['Exceeded Semester Limit'] = all_students_data['Neptun kód'].isin(
+        submitted_data_over['Neptun kód'])
+    all_students_data['Scholarship Amount'] = all_students_data['Scholarship Amount'].fillna('Not Eligible')
+    return all_students_data
+
+# Az exportálandó tábla xlsx fájlként (bytes)
+def scholarship_data_excel(all_students_data):
+    from io import BytesIO
+    output = BytesIO()
+    with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
+        all_students_data.to_excel(writer, index=False, sheet_name='Scholarship Recipients')
+    return output.getvalue()
+
+### A KÖDI alapú logisztikus összeg kerekítés előtt; a 100-as KÖDI mindig a maximumot kapja
+def logistic_amounts(kodi, cutoff, max_amount, min_amount, k, x0):
+    epsilon = 0.01
+    KODI_normalized = np.clip((kodi - cutoff) / (100 - cutoff + epsilon), 0, 1)
+    f_K = 1 / (1 + np.exp(-k * (KODI_normalized - x0)))
+    amounts = min_amount + f_K * (max_amount - min_amount)
+    return amounts.where(kodi != 100, max_amount)
+
+### Keret mód: a globális KÖDI határ helyett minden csoport (szak) a saját legkisebb KÖDI-jéhez normál, és a
+# szigmoid összegeket a saját keretére skálázza. A szorzót csoportonként a largest_remainder_units oldja meg a min/max
+# vágással együtt, így a vágás nem viszi a keret fölé a csoportot, és a 100-as KÖDI a skálázás után is a maximumot
+# kapja. Csoportonként két numpy rendezés, így a csúszkák mozgatásakor több száz csoportnál is gyors.
+def calculate_group_budget_amounts(recipients, group_budgets, max_amount, min_amount, k, x0, budget_column='GroupIndex',
+                                   unit=100):
+    """
+        Kiszámolja az ösztöndíjakat csoportonkénti kerettel.
+
+        Args:
+            recipients (pd.DataFrame): A calculate_scholarship_amounts_global által kiválasztott ösztöndíjasok.
+            group_budgets (dict): {csoport vagy szak: keret}; a kulcsok szövegként is megadhatók (pl. JSON-ból).
+            max_amount (int): A maximális ösztöndíj.
+            min_amount (int): A minimális ösztöndíj.
+            k (float): A logisztikus függvény meredeksége.
+            x0 (float): A logisztikus függvény középpontja.
+            budget_column (str): 'GroupIndex' vagy 'KépzésKód'.
+            unit (int): A kerekítési egység forintban.
+
+        Returns:
+            tuple: Az ösztöndíjasok az új 'Scholarship Amount' értékekkel, és a keret vs. kiosztott összeg riport.
+            Egy csoport csak akkor lépi túl a keretét, ha a keret a minimumokra (és a 100-as KÖDI-k maximumára)
+            sem elég.
+
+        Raises:
+            ValueError: Ha egy ösztöndíjasokkal rendelkező csoportnak (szaknak) nincs kerete.
+    """
+    keys = recipients[budget_column]
+    by_key = recipients.groupby(budget_column)
+
+    # A kulcsok a szöveges alakjuk szerint párosulnak, így a JSON szöveg kulcsai a szám GroupIndex-hez (KépzésKód-hoz)
+    # is illeszkednek. Keret nélküli csoportnál nincs mire skálázni, ezért az hiba, nem csendes skálázatlan összeg.
+    budgets_by_label = {str(key): float(budget) for key, budget in group_budgets.items()}
+    labels = keys.astype(str)
+    missing = sorted(set(labels) - set(budgets_by_label))
+    if missing:
+        raise ValueError(f"Missing budget for {budget_column}: {', '.join(missing)}")
+
+    raw_amounts = logistic_amounts(recipients['KÖDI'], by_key['KÖDI'].transform('min'), max_amount, min_amount, k,
+                                   x0).to_numpy(dtype=float)
+    kodi = recipients['KÖDI'].to_numpy()
+    units = np.zeros(len(recipients), dtype=np.int64)
+    for key, positions in by_key.indices.items():
+        units[positions] = largest_remainder_units(raw_amounts[positions], kodi[positions],
+                                                   int(budgets_by_label[str(key)] // unit), -(-min_amount // unit),
+                                                   max_amount // unit)
+    amounts = pd.Series(units * unit, index=recipients.index)
+    recipients = recipients.assign(**{'Scholarship Amount': amounts})
+
+    report = pd.DataFrame({
+        'Recipients': by_key.size(),
+        'Cutoff KÖDI': by_key['KÖDI'].min(),
+        'Allocated': amounts.groupby(keys).sum(),
+    })
+    report.insert(0, 'Budget', [budgets_by_label[str(key)] for key in report.index])
+    report['Difference'] = report['Allocated'] - report['Budget']
+    return recipients, report
+
+### Pontos keret egész egységekben (legnagyobb maradék módszer). A nyers összegeket egyetlen s szorzóval skálázza úgy,
+# hogy sum(clip(s * összeg, min, max)) pontosan a keret legyen: ez s-ben szakaszonként lineáris, a töréspontjai
+# (min / összeg és max / összeg) rendezése után a megfelelő szakaszon zárt alakban megoldható. Ezután mindenki a
+# lefelé kerekített egységeit kapja, a maradék egységeket pedig a legnagyobb törtrészűek. Az azonos törtrészeknél a
+# nagyobb összeg az első, így a nagyobb KÖDI sosem kap kevesebbet. Az azonos összegűek (azonos KÖDI) egy blokkban
+# állnak; ha a maradék egységek egy blokk közepén fogynának el, alapból az egész blokk kimarad, így az azonos KÖDI-jűek
+# azonos összeget kapnak, és a kiosztatlan rész egy blokknál kevesebb egység. Két rendezés, tehát O(n log n), ciklus
+# nélkül.
+def largest_remainder_units(amounts, kodi, target, low, high, slack=None):
+    """
+        Egész egységekre osztja a keretet a nyers összegek arányában.
+
+        Args:
+            amounts (np.ndarray): A nyers (pozitív, a KÖDI szerint monoton) összegek.
+            kodi (np.ndarray): A KÖDI értékek; a 100-as KÖDI mindig a maximumot kapja.
+            target (int): A keret egységekben.
+            low (int): A minimum egységekben.
+            high (int): A maximum egységekben.
+            slack (int, optional): Ennyi egységgel maradhat a keret alatt, hogy az azonos összegűek azonosak
+                maradjanak; a nagyobb blokkot a sorrend szerint kettévágja (0: pontos keret). None esetén a blokkok
+                mindig egyben maradnak.
+
+        Returns:
+            np.ndarray: Egységek hallgatónként. Ha a keret a minimumokra sem elég, mindenki a minimumot kapja; ha
+            a maximumokkal sem fogy el, mindenki a maximumot.
+    """
+    units = np.full(len(amounts), low, dtype=np.int64)
+    pinned = kodi == 100
+    units[pinned] = high
+    free = ~pinned
+    weights = amounts[free]
+    count = len(weights)
+    target = target - high * int(pinned.sum())
+    if count == 0 or target <= low * count:
+        return units
+    if target >= high * count:
+        units[free] = high
+        return units
+
+    # A töréspontokban (a szorzó függvényében) a minimumon és a maximumon lévők száma és a többiek összege
+    sorted_weights = np.sort(weights)[::-1]
+    prefix = np.concatenate([[0.0], np.cumsum(sorted_weights)])
+    breakpoints = np.sort(np.concatenate([low / weights, high / weights]))
+    at_low = np.searchsorted(low / sorted_weights, breakpoints, side='left')
+    at_high = np.searchsorted(high / sorted_weights, breakpoints, side='right')
+    totals = low * (count - at_low) + high * at_high + breakpoints * (prefix[at_low] - prefix[at_high])
+
+    j = min(max(np.searchsorted(totals, target), 1), len(totals) - 1)
+    scale = breakpoints[j - 1] + (target - totals[j - 1]) * (breakpoints[j] - breakpoints[j - 1]) / \
+        (totals[j] - totals[j - 1])
+    scaled = np.clip(scale * weights, low, high)
+    whole = np.floor(scaled)
+    remainder = scaled - whole
+
+    deficit = min(max(int(round(target - whole.sum())), 0), int((remainder > 0).sum()))
+    order = np.lexsort((-scaled, -remainder))
+    if 0 < deficit < count:
+        # Egy azonos összegű blokkot nem vágunk ketté, ha a kimaradó rész belefér a tűrésbe
+        split = scaled[order[:deficit]] == scaled[order[deficit]]
+        if slack is None or split.sum() <= slack:
+            deficit -= int(split.sum())
+    whole[order[:deficit]] += 1
+    units[free] = whole.astype(np.int64)
+    return units
+
+def allocate_exact_budget(recipients, total_fund, max_amount, min_amount, k, x0, slack=None, unit=100):
+    """
+        Kiosztja a teljes keretet egész 100 Ft-os egységekben.
+
+        A calculate_scholarship_amounts_global kerekített összegei helyett a nyers logisztikus összegeket skálázza,
+        így a végösszeg a keret, legfeljebb egy azonos KÖDI-jű blokknyi egységgel (vagy slack-kel) alatta, és a
+        harmadik lépés kerekítése sem változtat rajta, mert minden összeg egész egység.
+
+        Args:
+            recipients (pd.DataFrame): A calculate_scholarship_amounts_global által kiválasztott ösztöndíjasok.
+            total_fund (int): A teljes keret.
+            max_amount (int): A maximális ösztöndíj.
+            min_amount (int): A minimális ösztöndíj.
+            k (float): A logisztikus függvény meredeksége.
+            x0 (float): A logisztikus függvény középpontja.
+            slack (int, optional): A megengedett maradvány forintban; a nagyobb azonos KÖDI-jű blokkot a sorrend
+                szerint kettévágja (0: pontos keret). None esetén az azonos KÖDI-jűek mindig azonos összeget kapnak.
+            unit (int): A kerekítési egység forintban.
+
+        Returns:
+            pd.DataFrame: Az ösztöndíjasok az új, egész 'Scholarship Amount' értékekkel.
+    """
+    if recipients.empty:
+        return recipients
+    amounts = logistic_amounts(recipients['KÖDI'], recipients['KÖDI'].min(), max_amount, min_amount, k, x0)
+    units = largest_remainder_units(amounts.to_numpy(dtype=float), recipients['KÖDI'].to_numpy(), total_fund // unit,
+                                    -(-min_amount // unit), max_amount // unit,
+                                    None if slack is None else slack // unit)
+    return recipients.assign(**{'Scholarship Amount': units * unit})
+
 def calculate_total_allocated_funds(recipients):
     """
         Kiszámolja a kiosztott ösztöndíjak teljes összegét.
@@ -165,6 +666,9 @@ def visualize_distribution(recipients):
        Args:
            recipients (pd.DataFrame): Az ösztöndíjasok adatai.
     """
+    # A matplotlib csak itt töltődik be, hogy az oldal indulását ne lassítsa
+    import matplotlib.pyplot as plt
+
     plt.figure(figsize=(10, 6))
     plt.scatter(recipients['KÖDI'], recipients['Scholarship Amount'], alpha=0.7)
     plt.xlabel('KÖDI')
@@ -189,6 +693,26 @@ def export_data_to_excel(data_to_export, required_columns):
                        file_name='Scholarship_Data.xlsx',
                        mime='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
 
+def build_amount_change_report(previous_data, current_data):
+    """
+        Összeveti az előző futás ösztöndíj összegeit a mostaniakkal Neptun kód szerint.
+
+        Args:
+            previous_data (pd.DataFrame): Az előző futás exportja ('Neptun kód', 'Scholarship Amount').
+            current_data (pd.DataFrame): A mostani futás eredménye ugyanezekkel az oszlopokkal.
+
+        Returns:
+            pd.DataFrame: Azok a hallgatók, akiknek az ösztöndíj összege megváltozott.
+    """
+    def amounts(data):
+        data = data[['Neptun kód', 'Scholarship Amount']].drop_duplicates(subset=['Neptun kód'])
+        return data.assign(**{'Scholarship Amount': pd.to_numeric(data['Scholarship Amount'], errors='coerce').fillna(0)})
+
+    report = pd.merge(amounts(previous_data), amounts(current_data), on='Neptun kód', how='outer',
+                      suffixes=(' (Previous)', ' (New)')).fillna(0)
+    report['Difference'] = report['Scholarship Amount (New)'] - report['Scholarship Amount (Previous)']
+    return report[report['Difference'] != 0].reset_index(drop=True)
+
 def format_number_with_spaces(n):
     s = f"{n:,}"
     s = s.replace(',', ' ')
@@ -205,32 +729,22 @@ def main():
     uploaded_file = st.file_uploader("Choose an Excel file", type="xlsx")
 
     if uploaded_file is not None:
-        data = load_data(uploaded_file)
+        dataset = load_shared_dataset(hashlib.sha256(uploaded_file.getvalue()).hexdigest(), uploaded_file)
+        data = dataset['data']
     else:
         st.stop()
 
     display_columns = ['KépzésNév','Neptun kód','Ösztöndíj átlag előző félév', 'Ösztöndíjindex',
                                            'KÖDI', 'Scholarship Amount']
 
-    required_columns = ['GroupIndex', 'KépzésKód', 'KépzésNév', 'Neptun kód', 'Nyomtatási név',
-                        'Felvétel féléve', 'Aktív félévek', 'Státusz2 jelen félév',
-                        'Ösztöndíj átlag előző félév', 'Képzési szint_x', 'Nyelv ID', 'Tagozat_x',
-                        'ElőzőFélévTeljesítettKredit', 'Hallgató kérvény azonosító', 'Évfolyam',
-                        'Kredit szám', 'Ösztöndíjindex', 'KÖDI', 'Exceed Limit']
+    for col in dataset['missing_columns']:
+        st.error(f"Error: Column '{col}' not found in data.")
+        return
 
-    for col in required_columns:
-        if col not in data.columns:
-            st.error(f"Error: Column '{col}' not found in data.")
-            return
-
-    submitted_data_all = data[data['Exceed Limit'] == False].copy()
-    submitted_data_over = data[data['Exceed Limit'] == True].copy()
-    submitted_data_kerveny = submitted_data_all[
-        submitted_data_all['Hallgató kérvény azonosító'].notnull() & (submitted_data_all['Hallgató kérvény azonosító'] != '')].copy()
-
-
-    submitted_data_all['GroupIndex'] = submitted_data_all['GroupIndex'].astype(int)
-    submitted_data_kerveny['GroupIndex'] = submitted_data_kerveny['GroupIndex'].astype(int)
+    # A közös táblák csak olvashatók: oszlop hozzáadása helyett mindig új táblát kell képezni (merge, assign)
+    submitted_data_all = dataset['submitted_data_all']
+    submitted_data_over = dataset['submitted_data_over']
+    submitted_data_kerveny = dataset['submitted_data_kerveny']
 
     groups = sorted(submitted_data_all['GroupIndex'].unique())
 
@@ -243,12 +757,14 @@ def main():
     max_amount_per_group = st.sidebar.number_input("Maximum Scholarship Amount per Student", value=100000, step=100)
     min_amount_per_group = st.sidebar.number_input("Minimum Scholarship Amount per Student", value=30000, step=100)
 
-    group_percentages = get_group_percentages(groups)
+    group_percentages = get_group_percentages(groups, dataset['group_table'])
+
+    group_sizes = dataset['group_sizes']
 
     total_students = len(submitted_data_all)
     total_recipients_estimated = 0
     for group in groups:
-        num_students_in_group_all = len(submitted_data_all[submitted_data_all['GroupIndex'] == group])
+        num_students_in_group_all = int(group_sizes[group])
         group_percentage = group_percentages.get(group, 0.25)
         num_recipients = int(np.ceil(group_percentage * num_students_in_group_all))
         total_recipients_estimated += num_recipients
@@ -257,27 +773,42 @@ def main():
     k = st.number_input("Parameter k (steepness of the curve)", min_value=0.1, max_value=50.0, value=10.0, step=0.1)
     x0 = st.number_input("Parameter x₀ (midpoint of the curve)", min_value=0.0, max_value=1.0, value=0.5, step=0.01)
 
-    recipients, total_recipients, total_students, group_min_kodi_dict= calculate_scholarship_amounts_global(
-        submitted_data_kerveny, submitted_data_all, max_amount_per_group, min_amount_per_group, group_percentages, k, x0)
+    profile = profiling_toggle("step2_profile")
+    (recipients, total_recipients, total_students, group_min_kodi_dict), stats = run_profiled(
+        profile, calculate_scholarship_amounts_global, submitted_data_kerveny, submitted_data_all,
+        max_amount_per_group, min_amount_per_group, group_percentages, k, x0,
+        recipient_cache=get_recipient_cache(), group_sizes=group_sizes,
+        group_signatures=dataset['group_signatures'])
+    show_profile(stats, "step2.prof")
+
+    budget_report = None
+    allocation_mode = st.sidebar.radio("Allocation mode", ["Global", "Per-group budget"],
+                                       help="Per-group budget: every group (or program) has its own fund and cutoff")
+    if allocation_mode == "Per-group budget":
+        budget_column = BUDGET_LEVELS[st.sidebar.selectbox("Budget level", list(BUDGET_LEVELS))]
+        group_budgets = get_group_budgets(build_budget_table(submitted_data_all, budget_column), budget_column,
+                                          total_fund)
+        try:
+            recipients, budget_report = calculate_group_budget_amounts(
+                recipients, group_budgets, max_amount_per_group, min_amount_per_group, k, x0, budget_column)
+        except ValueError as error:
+            st.error(f"Error: {error}")
+            st.stop()
+    elif st.sidebar.checkbox("Exact budget", help="Scale the amounts in 100 Ft units so that they add up to the "
+                                                  "total fund"):
+        slack = None
+        if st.sidebar.checkbox("Split ties", help="Students with equal KÖDI get equal amounts, so up to one block of "
+                                                  "them can stay unspent. Splitting ties spends the whole fund, and "
+                                                  "equal students can then get amounts 100 Ft apart by row order"):
+            slack = st.sidebar.number_input("Allowed slack", min_value=0, value=0, step=100,
+                                            help="Unused fund allowed to keep students with equal amounts equal; a "
+                                                 "larger tie is split")
+        recipients = allocate_exact_budget(recipients, total_fund, max_amount_per_group, min_amount_per_group, k, x0,
+                                           slack)
 
     total_allocated = calculate_total_allocated_funds(recipients)
 
-    group_min_kodi_df = pd.DataFrame(list(group_min_kodi_dict.items()), columns=['GroupIndex', 'Group Minimum Ösztöndíjindex'])
-
-    data = pd.merge(data, group_min_kodi_df, on='GroupIndex', how='left')
-
-    all_students_data = pd.merge(
-        data,
-        recipients[['Neptun kód', 'Scholarship Amount']],
-        on='Neptun kód',
-        how='left'
-    )
-    all_students_data['Scholarship Amount'] = all_students_data['Scholarship Amount'].fillna('')
-    all_students_data['Group Minimum Ösztöndíjindex'] = all_students_data['Group Minimum Ösztöndíjindex'].fillna('')
-
-    all_students_data['Exceeded Semester Limit'] = all_students_data['Neptun kód'].isin(
-        submitted_data_over['Neptun kód'])
-    all_students_data['Scholarship Amount'] = all_students_data['Scholarship Amount'].fillna('Not Eligible')
+    all_students_data = build_all_students_data(data, recipients, group_min_kodi_dict, submitted_data_over)
 
     st.header("Results")
 
@@ -320,17 +851,40 @@ def main():
     st.write(f"**Total Number of Students Receiving Scholarships:** {total_recipients:}")
     st.write(f"Total Number of students who submitted request: **{submitted_data_kerveny_num}** out of **{total_students}**. Percentage: **{kerveny_percentage:.2f}**%")
 
+    if budget_report is not None:
+        st.subheader("Budget vs. Allocated")
+        over_budget = int((budget_report['Difference'] > 0).sum())
+        st.write(f"Groups over their budget: **{over_budget}** out of **{len(budget_report)}** (their budget does "
+                 f"not cover the minimum amounts)")
+        st.dataframe(budget_report)
+
     st.subheader("KÖDI vs. Scholarship Amount")
     visualize_distribution(recipients)
 
     st.subheader("Ready to Export table")
     st.dataframe(all_students_data)
 
+    with st.expander("Archive this run"):
+        semester = st.text_input("Semester (e.g. 2024/25/1)", key="step2_archive_semester")
+        if st.button("Archive", key="step2_archive") and semester:
+            import Archive
+
+            st.success(f"Archived as run {Archive.archive_run(recipients, 'recipients', semester)}")
+
+    with st.expander("Compare with a previous run"):
+        previous_file = st.file_uploader("Upload the previous Scholarship_Data.xlsx", type="xlsx", key="previous_run_upload")
+        if previous_file is not None:
+            change_report = build_amount_change_report(load_data(previous_file), all_students_data)
+            st.write(f"Students whose scholarship amount changed: **{len(change_report)}**")
+            st.dataframe(change_report)
+
     st.subheader("Scholarship Recipients by Group")
+    all_group_sizes = data['GroupIndex'].value_counts()
+    recipients_by_group = {group: group_data for group, group_data in recipients.groupby('GroupIndex')}
     for group in groups:
-        num_students_in_group_all = len(data[data['GroupIndex'] == group])
+        num_students_in_group_all = int(all_group_sizes.get(group, 0))
 
-        group_recipients = recipients[recipients['GroupIndex'] == group]
+        group_recipients = recipients_by_group.get(group, recipients.iloc[0:0])
         num_recipients_in_group = len(group_recipients)
         actual_percentage = (num_recipients_in_group / num_students_in_group_all) * 100
         if not group_recipients.empty:
@@ -1,9 +1,12 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 from io import BytesIO
-from openpyxl.styles import PatternFill
-from pygments.unistring import combine
 
+from Profiling import profiling_toggle, run_profiled, show_profile
+
+# Copy-on-write: functions never modify the DataFrames they receive, so callers need no defensive .copy().
+pd.set_option('mode.copy_on_write', True)
 
 def calculate_summary(combined_df):
     """Calculates the average scholarship summary.
@@ -20,19 +23,31 @@ def calculate_summary(combined_df):
         st.error("Error: Required columns ('Ösztöndíjindex', 'KépzésNév', '1 havi Ösztöndíj') are missing for summary calculation.")
         return None
 
+    summary_df = summary_groups(combined_df)['1 havi Ösztöndíj'].mean().reset_index()
+    return pivot_summary(summary_df)
+
+def summary_groups(combined_df):
+    """Groups the rows by rounded Ösztöndíjindex and 'KépzésNév, Nyelv ID, Képzési szint' key."""
+    combined_df = combined_df.copy(deep=False)
     combined_df['CombinedKey'] = combined_df['KépzésNév'].astype(str) + ", " + \
                                  combined_df['Nyelv ID'].astype(str) + ", " + \
-                                 combined_df['Képzési szint_x'].astype(str)
+                                 combined_df['Képzési szint'].astype(str)
 
     combined_df['Rounded Ösztöndíjindex'] = combined_df['Ösztöndíjindex'].round(2)
-    summary_df = combined_df.groupby(['Rounded Ösztöndíjindex', 'CombinedKey'])['1 havi Ösztöndíj'].mean().reset_index()
+    return combined_df.groupby(['Rounded Ösztöndíjindex', 'CombinedKey'])
 
+def pivot_summary(summary_df):
+    """Pivots the per group average amounts into the summary table with an 'Average of Courses' column."""
     pivot_df = summary_df.pivot_table(index='Rounded Ösztöndíjindex', columns='CombinedKey', values='1 havi Ösztöndíj',
                                       fill_value=0)
     pivot_df['Average of Courses'] = pivot_df.apply(lambda row: row[row != 0].mean(), axis=1)
 
     return pivot_df
 
+def load_scholarship_file(scholarship_file):
+    # Older exports carry the '_x' suffixes left over from the semester limit merge
+    return pd.read_excel(scholarship_file).rename(columns={'Képzési szint_x': 'Képzési szint', 'Tagozat_x': 'Tagozat'})
+
 def main():
     st.title("Final Step: Merge Scholarship Data with All Students")
     st.subheader("Upload Files")
@@ -41,40 +56,70 @@ def main():
     original_file = st.file_uploader("Upload Original Excel File", type="xlsx")
 
     if scholarship_file is not None and original_file is not None:
-        scholarship_df = pd.read_excel(scholarship_file)
-        original_df = pd.read_excel(original_file)
-        combined_df = process_files(scholarship_df, original_df)
+        scholarship_df = load_scholarship_file(scholarship_file)
+        profile = profiling_toggle("step3_profile")
+        if st.checkbox("Streaming mode (process the original export in chunks)"):
+            import tempfile
+
+            # The decided chunks are kept on disk for the archive until the end of the run
+            with tempfile.TemporaryDirectory() as decisions_dir:
+                result, stats = run_profiled(profile, stream_combined_excel, scholarship_df, original_file,
+                                             decisions_dir=decisions_dir)
+                show_profile(stats, "step3.prof")
+                if result is not None:
+                    show_combined_preview(result['preview'], result['totals'])
+                    download_combined_excel(result['excel'])
+                    st.subheader("Scholarship Summary")
+                    st.write(result['summary'])
+                    download_summary_df(result['summary'])
+                    archive_decisions(result['decisions'])
+            return
 
-        if combined_df is not None:
-            st.subheader("Combined Data")
-            st.write(combined_df)
-            download_combined_df(combined_df)
+        result, stats = run_profiled(profile, merge_files, scholarship_df, original_file)
+        show_profile(stats, "step3.prof")
 
-            summary_df = calculate_summary(combined_df.copy())
-            if summary_df is not None:
+        if result is not None:
+            show_combined_preview(result['combined'].head(PREVIEW_ROWS), combined_totals(result['combined']))
+            download_combined_excel(result['excel'])
+
+            if result['summary'] is not None:
                 st.subheader("Scholarship Summary")
-                st.write(summary_df)
-                download_summary_df(summary_df)
+                st.write(result['summary'])
+                download_summary_df(result['summary'])
+
+            archive_decisions(result['combined'])
     else:
         st.info("Please upload both files to proceed.")
 
-def process_files(scholarship_df, original_df):
-    st.subheader("Processing Files")
+def archive_decisions(decisions):
+    """Adds the combined decisions to the multi-semester archive (see Archive.py).
 
-    if 'Neptun kód' not in scholarship_df.columns or 'Neptun kód' not in original_df.columns:
-        st.error("Error: 'Neptun kód' column is missing in one of the files.")
-        return None
+    Args:
+        decisions: The combined DataFrame, or in streaming mode the chunked run collected by stream_combined_excel.
+    """
+    with st.expander("Archive this run"):
+        semester = st.text_input("Semester (e.g. 2024/25/1)", key="step3_archive_semester")
+        if st.button("Archive", key="step3_archive") and semester:
+            import Archive
 
-    columns_to_keep = scholarship_df.columns.tolist()
+            if isinstance(decisions, pd.DataFrame):
+                run_id = Archive.archive_run(decisions, 'decisions', semester)
+            else:
+                run_id = Archive.archive_chunked_run(decisions, semester)
+            st.success(f"Archived as run {run_id}")
 
-    merged_df = pd.merge(
-        original_df,
-        scholarship_df[['Neptun kód']],
-        on='Neptun kód',
-        how='left',
-        indicator=True
-    )
-    new_students_df = merged_df[merged_df['_merge'] == 'left_only'].copy()
+def new_student_rows(original_df, recipient_codes, columns_to_keep):
+    """Selects the students of the original export who are not in the scholarship file.
+
+    Args:
+        original_df: The original export (or a chunk of it).
+        recipient_codes: A set of the scholarship file's Neptun codes.
+        columns_to_keep: The scholarship file's columns; the rows are returned in this layout.
+
+    Returns:
+        The new students' rows, missing columns filled with ''.
+    """
+    new_students_df = original_df[~original_df['Neptun kód'].isin(recipient_codes)]
 
     existing_columns = [col for col in columns_to_keep if col in new_students_df.columns]
     new_students_df = new_students_df[existing_columns]
@@ -95,34 +140,55 @@ def process_files(scholarship_df, original_df):
     for col in missing_cols:
         new_students_df[col] = ''
 
-    new_students_df = new_students_df[columns_to_keep]
+    return new_students_df[columns_to_keep]
 
-    combined_df = pd.concat([scholarship_df, new_students_df], ignore_index=True)
+def check_combined_columns(scholarship_df, original_columns):
+    """Checks the columns the merge needs, showing an error for the first missing one.
 
-    if 'GroupIndex' not in combined_df.columns:
+    Returns:
+        True if processing can continue.
+    """
+    if 'Neptun kód' not in scholarship_df.columns or 'Neptun kód' not in original_columns:
+        st.error("Error: 'Neptun kód' column is missing in one of the files.")
+        return False
+    if 'GroupIndex' not in scholarship_df.columns:
         st.error("Error: 'GroupIndex' column is missing in the data.")
-        return None
-    if 'KépzésNév' not in combined_df.columns or \
-            'Nyelv ID' not in combined_df.columns or \
-            'Képzési szint_x' not in combined_df.columns:
-        st.error("Error: Required columns ('KépzésNév', 'Nyelv ID', 'Képzési szint_x') are missing in the data.")
-        return None
+        return False
+    if 'KépzésNév' not in scholarship_df.columns or \
+            'Nyelv ID' not in scholarship_df.columns or \
+            'Képzési szint' not in scholarship_df.columns:
+        st.error("Error: Required columns ('KépzésNév', 'Nyelv ID', 'Képzési szint') are missing in the data.")
+        return False
 
+    required_columns = ['Ösztöndíj átlag előző félév', 'ElőzőFélévTeljesítettKredit']
+    for col in required_columns:
+        if col not in scholarship_df.columns:
+            st.error(f"Error: Column '{col}' is missing in the data.")
+            return False
+    return True
+
+def group_minimums(scholarship_df):
+    """The 'Group Minimum Ösztöndíjindex' of every group in the scholarship file, indexed by GroupIndex."""
     group_min_osztondijindex = scholarship_df[['GroupIndex', 'Group Minimum Ösztöndíjindex']].drop_duplicates()
     group_min_osztondijindex = group_min_osztondijindex.dropna(subset=['Group Minimum Ösztöndíjindex'])
+    return group_min_osztondijindex.drop_duplicates(subset=['GroupIndex']).set_index('GroupIndex')[
+        'Group Minimum Ösztöndíjindex']
 
-    combined_df = pd.merge(
-        combined_df.drop(columns=['Group Minimum Ösztöndíjindex']),
-        group_min_osztondijindex,
-        on='GroupIndex',
-        how='left'
-    )
+def decide_eligibility(combined_df, group_min_osztondijindex):
+    """Adds the eligibility and scholarship decisions with their reasons, and the 5 month amount.
 
-    required_columns = ['Ösztöndíj átlag előző félév', 'ElőzőFélévTeljesítettKredit']
-    for col in required_columns:
-        if col not in combined_df.columns:
-            st.error(f"Error: Column '{col}' is missing in the data.")
-            return
+    Every column is computed from the row itself (plus the group minimum lookup), so the function gives the same
+    result on the whole combined table or on any chunk of it.
+
+    Args:
+        combined_df: Scholarship rows and/or new student rows in the scholarship file's layout.
+        group_min_osztondijindex: The group_minimums Series.
+
+    Returns:
+        The DataFrame with the decision columns, 'Scholarship Amount' renamed to '1 havi Ösztöndíj'.
+    """
+    combined_df = combined_df.drop(columns=['Group Minimum Ösztöndíjindex'])
+    combined_df['Group Minimum Ösztöndíjindex'] = combined_df['GroupIndex'].map(group_min_osztondijindex)
 
     combined_df['Ösztöndíj átlag előző félév'] = pd.to_numeric(combined_df['Ösztöndíj átlag előző félév'],
                                                                errors='coerce')
@@ -198,11 +264,73 @@ def process_files(scholarship_df, original_df):
     negy_havi_osztondij_idx = combined_df.columns.get_loc('Scholarship Amount') + 1
     combined_df.insert(negy_havi_osztondij_idx, '5 havi Ösztöndíj', combined_df['Scholarship Amount'] * 5)
 
-    combined_df = combined_df.rename(columns={'Scholarship Amount' : '1 havi Ösztöndíj'})
+    return combined_df.rename(columns={'Scholarship Amount' : '1 havi Ösztöndíj'})
+
+def process_files(scholarship_df, original_df):
+    st.subheader("Processing Files")
+
+    if not check_combined_columns(scholarship_df, original_df.columns):
+        return None
+
+    new_students_df = new_student_rows(original_df, set(scholarship_df['Neptun kód']),
+                                       scholarship_df.columns.tolist())
+    combined_df = pd.concat([scholarship_df, new_students_df], ignore_index=True)
+    combined_df = decide_eligibility(combined_df, group_minimums(scholarship_df))
+
     combined_df.insert(0, 'ID', range(1, len(combined_df) + 1))
     return combined_df
 
-def download_combined_df(combined_df):
+def merge_files(scholarship_df, original_file):
+    """The in-memory counterpart of stream_combined_excel: reads the original export, merges it and writes the xlsx.
+
+    Args:
+        scholarship_df: The scholarship file (Step 2 output).
+        original_file: The original export (xlsx path or file object).
+
+    Returns:
+        A dict with the combined DataFrame, the xlsx content and the summary, or None if the columns do not match.
+    """
+    combined_df = process_files(scholarship_df, pd.read_excel(original_file))
+    if combined_df is None:
+        return None
+    return {'combined': combined_df, 'excel': write_combined_excel(combined_df),
+            'summary': calculate_summary(combined_df)}
+
+def group_band_numbers(group_index, previous_group=None, previous_band=0):
+    """Numbers the groups' bands: every change of GroupIndex starts a new band.
+
+    Args:
+        group_index: The 'GroupIndex' column in row order.
+        previous_group: The last GroupIndex (as str) of the previous chunk when writing in chunks.
+        previous_band: The band number of the previous chunk's last row.
+
+    Returns:
+        A NumPy array of band numbers, the first band being 1.
+    """
+    group_ids = group_index.astype(str)
+    changes = group_ids != group_ids.shift(fill_value=previous_group)
+    return (previous_band + changes.cumsum()).to_numpy()
+
+def group_band_parity(group_index):
+    """Returns True for the rows of every second group (the grey bands), False for the others.
+
+    Args:
+        group_index: The 'GroupIndex' column in row order.
+
+    Returns:
+        A boolean NumPy array; the first group is white and every change of GroupIndex flips the band.
+    """
+    return group_band_numbers(group_index) % 2 == 0
+
+def write_combined_excel(combined_df):
+    """Writes the combined data to an xlsx file with alternating grey/white bands per group.
+
+    Args:
+        combined_df: The DataFrame from process_files.
+
+    Returns:
+        The xlsx file content as bytes.
+    """
     output = BytesIO()
     with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
         combined_df.to_excel(writer, index=False, sheet_name='Combined_Data')
@@ -210,7 +338,6 @@ def download_combined_df(combined_df):
         worksheet = writer.sheets['Combined_Data']
 
         last_row = combined_df.shape[0]
-        last_col = combined_df.shape[1]
 
         yellow_fill = workbook.add_format({'bg_color': '#FFFF00'})
         group_fill_1 = workbook.add_format({'bg_color': '#D3D3D3'})
@@ -219,39 +346,187 @@ def download_combined_df(combined_df):
         col_idx = combined_df.columns.get_loc('1 havi Ösztöndíj')
         worksheet.conditional_format(1, col_idx, last_row, col_idx, {'type': 'no_blanks', 'format': yellow_fill})
 
-        combined_df['TempGroupID'] = combined_df[['GroupIndex']].apply(lambda x: ' | '.join(x.astype(str)), axis=1)
-        previous_group = None
-        current_fill = group_fill_1
-
-        for row in range(1, last_row + 1):
-            group_id = combined_df.iloc[row - 1]['TempGroupID']
-
-            if group_id != previous_group:
-                current_fill = group_fill_1 if current_fill == group_fill_2 else group_fill_2
-                previous_group = group_id
-
-            worksheet.set_row(row, None, current_fill)
-
-        combined_df.drop(columns=['TempGroupID'], inplace=True)
-    output.seek(0)
+        # The new students' GroupIndex is '', so the bands cannot be derived from a formula on GroupIndex; every
+        # row gets its precomputed band format
+        grey_band = group_band_parity(combined_df['GroupIndex'])
+        for row, band_fill in enumerate(np.where(grey_band, group_fill_1, group_fill_2), start=1):
+            worksheet.set_row(row, None, band_fill)
+    return output.getvalue()
 
+def download_combined_excel(excel):
     st.download_button(
         label='Download Combined Excel File',
-        data=output.getvalue(),
+        data=excel,
         file_name='Combined_Scholarship_Data.xlsx',
         mime='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
     )
 
-def download_summary_df(summary_df):
-    """Downloads the summary DataFrame as an Excel file."""
+PREVIEW_ROWS = 1000
+STREAM_CHUNK_ROWS = 50_000
+
+def combined_totals(combined_df):
+    """The totals shown instead of the full combined table."""
+    return {
+        'Students': len(combined_df),
+        'Eligible (Jogosult)': int((combined_df['Jogosultság döntés'] == 'Jogosult').sum()),
+        'Scholarship recipients': int((combined_df['Ösztöndíj döntés'] == 'Jogosult').sum()),
+        'Total 1 havi Ösztöndíj': float(combined_df['1 havi Ösztöndíj'].sum()),
+        'Total 5 havi Ösztöndíj': float(combined_df['5 havi Ösztöndíj'].sum()),
+    }
+
+def show_combined_preview(preview_df, totals):
+    st.subheader("Combined Data")
+    st.write(pd.DataFrame([totals]))
+    st.caption(f"Showing the first {len(preview_df)} of {totals['Students']} rows; the download contains all of them.")
+    st.write(preview_df)
+
+def read_excel_chunks(file, chunk_rows=STREAM_CHUNK_ROWS):
+    """Reads the first sheet of an xlsx file as DataFrame chunks, without loading the whole sheet.
+
+    Args:
+        file: A path or file object of an xlsx file whose first row is the header.
+        chunk_rows: The number of rows per chunk.
+
+    Yields:
+        DataFrames of at most chunk_rows rows.
+    """
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(file, read_only=True, data_only=True)
+    rows = workbook.worksheets[0].iter_rows(values_only=True)
+    header = list(next(rows, ()))
+    while header and header[-1] is None:
+        header.pop()
+
+    chunk = []
+    for row in rows:
+        row = row[:len(header)] + (None,) * (len(header) - len(row))
+        if all(value is None for value in row):
+            continue
+        chunk.append(row)
+        if len(chunk) == chunk_rows:
+            yield pd.DataFrame(chunk, columns=header)
+            chunk = []
+    if chunk:
+        yield pd.DataFrame(chunk, columns=header)
+    workbook.close()
+
+def stream_combined_excel(scholarship_df, original_file, chunk_rows=STREAM_CHUNK_ROWS, decisions_dir=None):
+    """Streaming version of process_files + write_combined_excel + calculate_summary.
+
+    The original export is read in chunks; each chunk's new students (a hash set lookup of the scholarship file's
+    Neptun codes) are decided and written straight to a constant-memory xlsx writer, and the summary sums and
+    counts are accumulated per chunk. Only the scholarship file, one chunk and a preview are kept in memory; for
+    the archive, the decided chunks are written to Parquet files in decisions_dir.
+
+    Args:
+        scholarship_df: The scholarship file (Step 2 output).
+        original_file: The original export (xlsx path or file object).
+        chunk_rows: The number of rows processed at once.
+        decisions_dir: A temporary directory for the archive's chunks (deleted by the caller), or None to skip them.
+
+    Returns:
+        A dict with 'excel' (bytes), 'preview' (the first PREVIEW_ROWS rows), 'totals', 'summary' and 'decisions'
+        (the chunked run for Archive.archive_chunked_run, or None), or None on error.
+    """
+    import os
+    import tempfile
+    import xlsxwriter
+
+    st.subheader("Processing Files")
+    original_chunks = read_excel_chunks(original_file, chunk_rows)
+    first_chunk = next(original_chunks, None)
+    if first_chunk is None:
+        st.error("Error: The original export is empty.")
+        return None
+    if not check_combined_columns(scholarship_df, first_chunk.columns):
+        return None
+
+    recipient_codes = set(scholarship_df['Neptun kód'])
+    columns_to_keep = scholarship_df.columns.tolist()
+    group_min_osztondijindex = group_minimums(scholarship_df)
+
+    def combined_chunks():
+        yield scholarship_df
+        yield new_student_rows(first_chunk, recipient_codes, columns_to_keep)
+        for original_chunk in original_chunks:
+            yield new_student_rows(original_chunk, recipient_codes, columns_to_keep)
+
+    preview_parts = []
+    preview_rows = 0
+    totals = None
+    summary_sums = None
+    previous_group, previous_band = None, 0
+    decisions = None
+    if decisions_dir is not None:
+        import Archive
+
+        decisions = Archive.start_chunked_run('decisions', decisions_dir)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, 'Combined_Scholarship_Data.xlsx')
+        workbook = xlsxwriter.Workbook(path, {'constant_memory': True, 'tmpdir': temp_dir})
+        worksheet = workbook.add_worksheet('Combined_Data')
+        header_format = workbook.add_format({'bold': True, 'border': 1, 'align': 'center', 'valign': 'top'})
+        group_fill_1 = workbook.add_format({'bg_color': '#D3D3D3'})
+        group_fill_2 = workbook.add_format({'bg_color': '#FFFFFF'})
+
+        row_number = 0
+        columns = None
+        for chunk in combined_chunks():
+            if chunk.empty:
+                continue
+            chunk = decide_eligibility(chunk, group_min_osztondijindex)
+            chunk.insert(0, 'ID', range(row_number + 1, row_number + len(chunk) + 1))
+
+            if columns is None:
+                columns = chunk.columns.tolist()
+                worksheet.write_row(0, 0, columns, header_format)
+            chunk = chunk[columns]
+
+            bands = group_band_numbers(chunk['GroupIndex'], previous_group, previous_band)
+            previous_group, previous_band = str(chunk['GroupIndex'].iloc[-1]), int(bands[-1])
+            for values, band in zip(chunk.itertuples(index=False, name=None), bands):
+                row_number += 1
+                worksheet.set_row(row_number, None, group_fill_1 if band % 2 == 0 else group_fill_2)
+                for col, value in enumerate(values):
+                    if not pd.isna(value):
+                        worksheet.write(row_number, col, value)
+
+            chunk_totals = combined_totals(chunk)
+            totals = chunk_totals if totals is None else {key: totals[key] + value
+                                                          for key, value in chunk_totals.items()}
+            chunk_sums = summary_groups(chunk)['1 havi Ösztöndíj'].agg(['sum', 'count'])
+            summary_sums = chunk_sums if summary_sums is None else summary_sums.add(chunk_sums, fill_value=0)
+            if preview_rows < PREVIEW_ROWS:
+                preview_parts.append(chunk.head(PREVIEW_ROWS - preview_rows))
+                preview_rows += len(preview_parts[-1])
+            if decisions is not None:
+                Archive.add_chunk(decisions, chunk)
+
+        yellow_fill = workbook.add_format({'bg_color': '#FFFF00'})
+        col_idx = columns.index('1 havi Ösztöndíj')
+        worksheet.conditional_format(1, col_idx, row_number, col_idx, {'type': 'no_blanks', 'format': yellow_fill})
+        workbook.close()
+        with open(path, 'rb') as excel_file:
+            excel = excel_file.read()
+
+    summary_df = (summary_sums['sum'] / summary_sums['count']).rename('1 havi Ösztöndíj').reset_index()
+    return {'excel': excel, 'preview': pd.concat(preview_parts, ignore_index=True), 'totals': totals,
+            'summary': pivot_summary(summary_df), 'decisions': decisions}
+
+def summary_excel(summary_df):
+    """The summary DataFrame as xlsx file content (bytes)."""
     output = BytesIO()
     with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
         summary_df.to_excel(writer, sheet_name='Summary_Data', index=True)
-    output.seek(0)
+    return output.getvalue()
 
+def download_summary_df(summary_df):
+    """Downloads the summary DataFrame as an Excel file."""
     st.download_button(
         label='Download Summary Excel File',
-        data=output.getvalue(),
+        data=summary_excel(summary_df),
         file_name='Scholarship_Summary.xlsx',
         mime='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
     )